@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import queue
+import atexit
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+# fastapi_srv, CocktailEmbeddingMaker, UI 모듈이 함께 쓰는 logger 설정입니다.
+#     LOG_LEVEL         : DEBUG, INFO(기본), WARNING, ERROR
+#     LOG_FORMAT        : json(기본, 한 줄에 하나의 JSON) 또는 text
+#     DECODE_TRACE_RATE : generate_recipe의 step별 trace(DEBUG)를 남길 요청의 비율 (0~1, 기본 0 = 남기지 않음)
+# 로그를 남기는 thread는 queue에 넣기만 하고, 별도 thread(QueueListener)가 stdout에 씁니다.
+# queue가 가득 차면 기다리지 않고 버립니다.
+
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'
+QUEUE_SIZE = 10000
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+class RequestIdFilter(logging.Filter):
+    # 로그를 남긴 thread(요청)의 ID를 record에 넣습니다.
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    # logger.info('message', extra={...})의 extra 값도 함께 출력합니다.
+    reserved = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.reserved:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+listener = None
+queue_handler = None
+decode_trace_rate = 0.0
+
+def setup_logging():
+    global listener, queue_handler, decode_trace_rate
+    if listener is not None:
+        return
+    decode_trace_rate = float(os.environ.get('DECODE_TRACE_RATE', 0))
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if os.environ.get('LOG_FORMAT', 'json') == 'text':
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        stream_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    root = logging.getLogger('feelflask')
+    root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    root.addHandler(queue_handler)
+    root.propagate = False
+    if decode_trace_rate > 0:
+        logging.getLogger('feelflask.decode').setLevel(logging.DEBUG)
+
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(f'feelflask.{name}')
+
+def decode_trace_enabled(logger):
+    '''
+    현재 요청의 decode trace를 남길지 정합니다. 같은 요청 ID는 항상 같은 결과이므로 요청 하나의 trace는 모두 남거나 모두 빠집니다.
+    '''
+    if decode_trace_rate <= 0 or not logger.isEnabledFor(logging.DEBUG):
+        return False
+    if decode_trace_rate >= 1:
+        return True
+    return zlib.crc32(request_id_var.get().encode()) % 10000 < decode_trace_rate * 10000
@@ -1,22 +1,166 @@
 import numpy as np
 import pandas as pd
 import random
-import tensorflow as tf
-import wandb
+import os
 import json
 import math
+import time
+from types import MappingProxyType
+from contextlib import nullcontext
+from RecipeDecoder import pad_sequences
+from AppLogging import get_logger, decode_trace_enabled
+try:
+    import wandb
+except ImportError:
+    # 서빙 환경(fastapi_srv)에는 wandb가 없어도 됩니다. evaluate_model의 wandb 로깅에만 사용합니다.
+    wandb = None
+
+# numpy 1.x는 float32 스칼라와 파이썬 float의 곱을 float64로 계산한 뒤 저장하고, numpy 2.x는 float32로 계산합니다.
+# 재료별로 곱하던 기존 결과와 똑같이 나오도록 확률 벡터에 곱할 때 같은 정밀도를 사용합니다.
+SCALAR_FLOAT64_PROMOTION = (np.float32(1) * 1.0).dtype == np.float64
+
+def scale_probabilities(probabilities, factors):
+    if SCALAR_FLOAT64_PROMOTION:
+        return (probabilities * factors).astype(probabilities.dtype)
+    return probabilities * factors.astype(probabilities.dtype)
+
+logger = get_logger('engine')
+# generate_recipe의 step별 trace는 DECODE_TRACE_RATE 비율의 요청에서만 남깁니다. (AppLogging.py 참고)
+decode_logger = get_logger('decode')
+
+# 단계별 시간 측정을 끈 상태의 timer입니다. fastapi_srv에서 metrics를 켜면 Eval을 만들 때 stage_timer를 넘겨줍니다.
+NO_TIMER = nullcontext()
+# 소지 재료 대체에 사용하는 재료 매핑 파일 (실행 위치와 관계없이 이 파일과 같은 폴더에서 읽습니다.)
+INGREDIENT_MAPPING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'limited_item_dict.json')
+
+def no_stage_timer(stage):
+    return NO_TIMER
+
+class IngredientTable:
+    '''
+    flavor_data(재료 dict 리스트)를 생성 시 한 번만 열 기반 배열로 변환한 읽기 전용 재료 테이블입니다.
+    행 번호는 재료 ID와 같고, matrix의 열은 attributes 순서를 따릅니다.
+    '''
+    def __init__(self, flavor_data, category_data, attributes, normalize_string=None):
+        self.attributes = tuple(attributes)
+        self.attribute_index = MappingProxyType({attribute: i for i, attribute in enumerate(self.attributes)})
+        # row -> name, name -> row (같은 이름이 여러 개면 기존 next() 탐색처럼 앞의 행을 사용합니다.)
+        self.names = tuple(item['name'] for item in flavor_data)
+        name_index = {}
+        for row, name in enumerate(self.names):
+            name_index.setdefault(name, row)
+        self.name_index = MappingProxyType(name_index)
+
+        matrix = np.array([[item[attribute] for attribute in self.attributes] for item in flavor_data], dtype=np.float64)
+        matrix.flags.writeable = False
+        self.matrix = matrix
+        self.abv = self.column('ABV')
+
+        # 카테고리는 이름 대신 정수 코드로 저장합니다. category.json에 없는 재료는 -1입니다.
+        if normalize_string is None:
+            normalize_string = lambda name: name
+        categories = [category_data[normalize_string(name)][0] if normalize_string(name) in category_data else None for name in self.names]
+        self.category_names = tuple(sorted(set(category for category in categories if category is not None)))
+        self.category_codes = MappingProxyType({category: code for code, category in enumerate(self.category_names)})
+        category_array = np.array([self.category_codes.get(category, -1) for category in categories], dtype=np.int8)
+        category_array.flags.writeable = False
+        self.categories = category_array
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.name_index
+
+    def row(self, name):
+        return self.name_index.get(name)
+
+    def column(self, attribute):
+        return self.matrix[:, self.attribute_index[attribute]]
+
+    def profile(self, name):
+        row = self.row(name)
+        if row is None:
+            return None
+        return dict(zip(self.attributes, self.matrix[row].tolist()))
+
+    def category_mask(self, category):
+        if category not in self.category_codes:
+            return np.zeros(len(self), dtype=bool)
+        return self.categories == self.category_codes[category]
+
+
+class CocktailMatrix:
+    '''
+    cocktail_info의 레시피(재료 양)를 cocktail마다 L2 정규화한 cocktail×재료 sparse 행렬입니다.
+    재료(열)마다 0이 아닌 값의 (cocktail 행, 값)만 저장하므로(CSC), 레시피와의 코사인 유사도는 레시피 재료의 열만 더해 구합니다.
+    '''
+    def __init__(self, cocktail_info):
+        self.names = tuple(cocktail['cocktail_name'] for cocktail in cocktail_info)
+        columns = {}
+        for row, cocktail in enumerate(cocktail_info):
+            norm = np.linalg.norm(np.array(list(cocktail['recipe'].values()), dtype=np.float64))
+            for ingredient, quantity in cocktail['recipe'].items():
+                columns.setdefault(ingredient, []).append((row, quantity / norm if norm else 0.0))
+        self.ingredient_index = MappingProxyType({ingredient: column for column, ingredient in enumerate(columns)})
+        self.indptr = np.cumsum([0] + [len(entries) for entries in columns.values()])
+        self.rows = np.array([row for entries in columns.values() for row, _ in entries], dtype=np.int64)
+        self.values = np.array([value for entries in columns.values() for _, value in entries], dtype=np.float64)
+        for array in (self.indptr, self.rows, self.values):
+            array.flags.writeable = False
+
+    def __len__(self):
+        return len(self.names)
+
+    def similarities_batch(self, recipes):
+        '''
+        recipes({재료: 양} dict 리스트)와 모든 cocktail의 코사인 유사도를 (레시피 수, cocktail 수) 배열로 반환합니다.
+        레시피마다 재료 열의 값에 정규화한 양을 곱해 cocktail 행별로 더합니다. (sparse 행렬 곱)
+        '''
+        size = len(self)
+        rows = []
+        weights = []
+        for i, recipe in enumerate(recipes):
+            norm = np.linalg.norm(np.array(list(recipe.values()), dtype=np.float64))
+            if not norm:
+                continue
+            for ingredient, quantity in recipe.items():
+                column = self.ingredient_index.get(ingredient)
+                if column is None:
+                    # 기존 cocktail에 없는 재료는 레시피의 크기(norm)에만 영향을 줍니다.
+                    continue
+                start, end = self.indptr[column], self.indptr[column + 1]
+                rows.append(self.rows[start:end] + i * size)
+                weights.append(self.values[start:end] * (quantity / norm))
+        if not rows:
+            return np.zeros((len(recipes), size))
+        similarities = np.bincount(np.concatenate(rows), weights=np.concatenate(weights), minlength=len(recipes) * size)
+        return similarities.reshape(len(recipes), size)
+
+    def similarities(self, recipe):
+        return self.similarities_batch([recipe])[0]
+
+    def closest(self, recipe, k=5):
+        # 유사도가 높은 순서로 k개의 (cocktail 이름, 유사도)를 반환합니다. 유사도가 같으면 cocktail_info 순서를 따릅니다.
+        similarities = self.similarities(recipe)
+        order = np.argsort(-similarities, kind='stable')[:k]
+        return [(self.names[row], float(similarities[row])) for row in order]
+
+
 class CocktailEmbeddingMaker:
     def __init__(self, json_data, flavor_data,category_data, total_amount=200):
         self.cocktail_info = json_data['cocktail_info']
+        self.cocktail_matrix = CocktailMatrix(self.cocktail_info)
         self.flavor_data = flavor_data
         self.total_amount = total_amount
         self.max_recipe_length=10
         self.category_data = category_data
+        self.attributes = ['ABV', 'boozy', 'sweet', 'sour', 'bitter', 'umami', 'salty', 'astringent', 'Perceived_temperature', 'spicy', 'herbal', 'floral', 'fruity', 'nutty', 'creamy', 'smoky']
+        self.ingredient_table = IngredientTable(flavor_data, category_data, self.attributes, self.normalize_string)
         self.init()
         self.ingredient_mapping=None
-        self.attributes = ['ABV', 'boozy', 'sweet', 'sour', 'bitter', 'umami', 'salty', 'astringent', 'Perceived_temperature', 'spicy', 'herbal', 'floral', 'fruity', 'nutty', 'creamy', 'smoky']
-    def set_ingredient_mapping(self):
-        with open('limited_item_dict.json', 'r') as f:
+    def set_ingredient_mapping(self, path=INGREDIENT_MAPPING_PATH):
+        with open(path, 'r') as f:
             ingredient_mapping = json.load(f)
         self.ingredient_mapping = ingredient_mapping
     
@@ -26,7 +170,7 @@ class CocktailEmbeddingMaker:
         return name
 
     def init(self):
-        print("CocktailEmbeddingMaker Initiated")
+        logger.info("CocktailEmbeddingMaker Initiated")
         ingredient_ids = {}
         try:
             for idx, item in enumerate(self.flavor_data):
@@ -34,7 +178,7 @@ class CocktailEmbeddingMaker:
                 normalized_name = self.normalize_string(item['name'])
                 ingredient_ids[normalized_name] = idx
         except Exception as e:
-            print(f"error : {e}")
+            logger.error(f"error : {e}")
         self.ingredient_ids = ingredient_ids
         self.num_ingredients = len(self.flavor_data)
         self.embedding_dim = 64
@@ -42,6 +186,7 @@ class CocktailEmbeddingMaker:
         self.middle_ing = []
         self.high_ing = []
         try:
+            # 재료 테이블에서 바로 도수를 읽으므로 전체 재료를 한 번만 순회합니다.
             for ingredient in self.ingredient_ids.keys() :
                 if self.get_ingredient_category(ingredient) == 'Alcohol':
                     ingradient_abv= self.get_ingredient_abv(ingredient)
@@ -55,12 +200,12 @@ class CocktailEmbeddingMaker:
                     else:
                         self.high_ing.append(ingredient)
         except Exception as e:
-            print(f"[ingredient in self.ingredient_ids.keys()]error : {e}")
-        print("CocktailEmbeddingMaker Initiated Done")
+            logger.error(f"[ingredient in self.ingredient_ids.keys()]error : {e}")
+        logger.info("CocktailEmbeddingMaker Initiated Done")
 
     def get_ingredient_abv(self, ingredient):
-        ingredient_info = next((item for item in self.flavor_data if item["name"] == ingredient), None)
-        return ingredient_info['ABV'] if ingredient_info else 0
+        row = self.ingredient_table.row(ingredient)
+        return float(self.ingredient_table.abv[row]) if row is not None else 0
     
     def get_ingredient_category(self,ingredient_name):
         ingredient_category = self.category_data[ingredient_name][0]
@@ -122,17 +267,17 @@ class CocktailEmbeddingMaker:
         return recipe_embeddings
     
     def calculate_recipe_taste_weights(self, recipe):
-        recipe_ingredients = [d for d in self.flavor_data if d['name'] in list(recipe.keys())]
         total_amount = sum(recipe.values())
         # print(f"Total Amount: {total_amount} , Recipe: {recipe}")
         ingredient_ratios = {ingredient: amount / total_amount for ingredient, amount in recipe.items()}
         recipe_taste_weights = {}
         for ingredient, ratio in ingredient_ratios.items():
-            ingredient_dict = next((d for d in recipe_ingredients if d['name'] == ingredient), None)
-            if ingredient_dict:
-                for taste, weight in ingredient_dict.items():
-                    if taste != 'name':
-                        recipe_taste_weights[taste] = recipe_taste_weights.get(taste, 0) + weight * ratio
+            row = self.ingredient_table.row(ingredient)
+            if row is not None:
+                for taste, weight in zip(self.ingredient_table.attributes, self.ingredient_table.matrix[row].tolist()):
+                    recipe_taste_weights[taste] = recipe_taste_weights.get(taste, 0) + weight * ratio
+                # flavor_data의 각 재료에는 init()에서 'ID'가 추가되어 있어 기존과 같이 함께 합산합니다.
+                recipe_taste_weights['ID'] = recipe_taste_weights.get('ID', 0) + row * ratio
         return recipe_taste_weights
 
     def create_taste_embedding_list(self):
@@ -163,7 +308,7 @@ class CocktailEmbeddingMaker:
 
         for ingredient in cocktail_recipe.keys():
             if ingredient not in self.ingredient_ids:
-                print(f"Ingredient '{ingredient}' not found in ingredient_ids")
+                logger.warning(f"Ingredient '{ingredient}' not found in ingredient_ids")
             else:
                 recipe_taste_weights = self.calculate_recipe_taste_weights(cocktail_recipe)
                 recipe_taste_weights.pop('ID')
@@ -186,150 +331,208 @@ class CocktailEmbeddingMaker:
         total_amount = sum(quantities)
         total_abv = 0
         for ingredient, quantity in zip(recipe, quantities):
-            ingredient_info = next((item for item in self.flavor_data if item["name"] == ingredient), None)
-            if ingredient_info:
-                total_abv += ingredient_info['ABV'] * (quantity / total_amount)
+            row = self.ingredient_table.row(ingredient)
+            if row is not None:
+                total_abv += self.ingredient_table.abv[row] * (quantity / total_amount)
         return total_abv
     
     
+class RecipeContext:
+    '''
+    요청 하나에서만 사용하는 상태입니다. (소지 재료 목록, seed 재료, 난수 생성기, 선호도 점수)
+    Eval은 생성된 뒤에 바뀌지 않으므로 여러 thread가 각자의 RecipeContext로 하나의 Eval을 함께 사용할 수 있습니다.
+    '''
+    def __init__(self, limited_ingredient_list=None, seed_ingredient=None, rng=None):
+        # 소지 재료 목록이 주어지면 seed 선택과 재료 대체를 그 목록 안에서만 합니다.
+        self.limited_ingredient_list = list(limited_ingredient_list) if limited_ingredient_list is not None else []
+        self.limited_mode = limited_ingredient_list is not None
+        self.seed_ingredient = seed_ingredient
+        self.rng = rng if rng is not None else random
+        # 사용자 선호도별 get_ingredient_taste_scores 결과 (요청 안에서 여러 단계가 같은 벡터를 사용합니다.)
+        self.taste_scores = {}
+
+
 class Eval(CocktailEmbeddingMaker):
-    def __init__(self,json_data, flavor_data,category_data, total_amount=200):
+    '''
+    생성된 뒤에는 바뀌지 않는 추천 엔진입니다. 설정은 모두 생성할 때 넘겨줍니다.
+        ingredient_mapping : 소지 재료 대체에 사용하는 재료 매핑 (없으면 INGREDIENT_MAPPING_PATH에서 한 번만 읽습니다.)
+        quantity_method : 재료 양 조정 방식, 'heuristic'(기존 반복 조정) 또는 'solver'(제약 조건 최적화)
+        stage_timer : stage_timer(stage)는 with 문으로 감싼 단계의 실행 시간을 기록합니다. (기본값은 아무것도 하지 않습니다.)
+    '''
+    def __init__(self,json_data, flavor_data,category_data, total_amount=200, ingredient_mapping=None, quantity_method='heuristic', stage_timer=no_stage_timer):
         super().__init__(json_data, flavor_data,category_data, total_amount=200)
-        print("Eval Class Initiated")
-        self.user_seed = None
-        self.user_seed_len = 0
-        self.limited_ingredient_list=[]
-        self.limited_mode = False
+        logger.info("Eval Class Initiated")
+        if ingredient_mapping is None:
+            self.set_ingredient_mapping()
+        else:
+            self.ingredient_mapping = ingredient_mapping
+        self.quantity_method = quantity_method
+        self.stage_timer = stage_timer
+        self.init_rescoring_table()
 
-    def set_user_seed(self,user_seed_ingredient):
-        self.user_seed = user_seed_ingredient
-        self.user_seed_len = len(user_seed_ingredient)
+    def init_rescoring_table(self):
+        # generate_recipe에서 매 단계마다 전체 재료를 다시 찾지 않도록 ID 순서의 배열을 재료 테이블에서 만들어 둡니다.
+        self.ingredient_names = [None] * self.num_ingredients
+        for ingredient, ingredient_id in self.ingredient_ids.items():
+            self.ingredient_names[ingredient_id] = ingredient
+        # flavor_data에서 찾을 수 없는 재료는 기존처럼 ABV 0, 선호도 점수 0으로 처리합니다.
+        rows = [self.ingredient_table.row(name) for name in self.ingredient_names]
+        self.ingredient_found = np.array([row is not None for row in rows])
+        rows = [row if row is not None else 0 for row in rows]
+        self.ingredient_abv_array = np.where(self.ingredient_found, self.ingredient_table.abv[rows], 0.0)
+        self.ingredient_taste_matrix = self.ingredient_table.matrix[rows]
 
-    def select_user_seed(self, user_preference):
+    def category_mask(self, category):
+        return self.ingredient_table.category_mask(category)
+
+    def select_user_seed(self, user_preference, context=None):
+        context = context or RecipeContext()
         if user_preference['ABV'] == 0:
             #Mixer중에서 선택
             user_seed = [ingredient for ingredient in self.ingredient_ids.keys() if self.get_ingredient_category(ingredient) == 'Mixer']
-            if self.limited_mode:
-                user_seed = [ingredient for ingredient in self.limited_ingredient_list if self.get_ingredient_category(ingredient) == 'Mixer' ]
+            if context.limited_mode:
+                user_seed = [ingredient for ingredient in context.limited_ingredient_list if self.get_ingredient_category(ingredient) == 'Mixer' ]
             judge = {}                
             user_seed_list = list(set(user_seed))
+            taste_scores = self.get_ingredient_taste_scores(user_preference, context)
             for item in user_seed_list:
-                judge[item] = self.get_ingredient_taste_score(item, user_preference)
+                judge[item] = self.lookup_taste_score(taste_scores, item)
             user_seed = max(judge, key=judge.get)    
         else:
             #Alcohol중에서 선택
-            if self.limited_mode:
+            if context.limited_mode:
                 judge = {} 
-                alcohol_list = [ingredient for ingredient in self.limited_ingredient_list if self.get_ingredient_category(ingredient) == 'Alcohol']
+                alcohol_list = [ingredient for ingredient in context.limited_ingredient_list if self.get_ingredient_category(ingredient) == 'Alcohol']
                 # print(f"alcohol_list:{alcohol_list}")
+                taste_scores = self.get_ingredient_taste_scores(user_preference, context)
                 for item in alcohol_list:
-                    judge[item] = self.get_ingredient_taste_score(item, user_preference)
+                    judge[item] = self.lookup_taste_score(taste_scores, item)
                 user_seed = max(judge, key=judge.get)
             else:
                 user_seed_list=[]
                 if user_preference['ABV']<=10:
-                    user_seed_list.extend(random.choices(self.low_ing, k=3))
-                    user_seed_list.extend(random.choices(self.middle_ing, k=3))
-                    user_seed_list.extend(random.choices(self.high_ing, k=2))
+                    user_seed_list.extend(context.rng.choices(self.low_ing, k=3))
+                    user_seed_list.extend(context.rng.choices(self.middle_ing, k=3))
+                    user_seed_list.extend(context.rng.choices(self.high_ing, k=2))
                 elif user_preference['ABV']>10 and user_preference['ABV']<=30:
-                    user_seed_list.extend(random.choices(self.middle_ing, k=5))
-                    user_seed_list.extend(random.choices(self.high_ing, k=2))
+                    user_seed_list.extend(context.rng.choices(self.middle_ing, k=5))
+                    user_seed_list.extend(context.rng.choices(self.high_ing, k=2))
                 else:
-                    user_seed_list.extend(random.choices(self.middle_ing, k=2))
-                    user_seed_list.extend(random.choices(self.high_ing, k=5))
+                    user_seed_list.extend(context.rng.choices(self.middle_ing, k=2))
+                    user_seed_list.extend(context.rng.choices(self.high_ing, k=5))
                 judge = {}                
-                user_seed_list = list(set(user_seed_list))
+                # 뽑힌 순서대로 중복을 제거합니다. (set 순서는 프로세스마다 달라 점수가 같은 재료 중 어느 것이 선택될지 달라집니다.)
+                user_seed_list = list(dict.fromkeys(user_seed_list))
+                taste_scores = self.get_ingredient_taste_scores(user_preference, context)
                 for item in user_seed_list:
-                    judge[item] = self.get_ingredient_taste_score(item, user_preference)
+                    judge[item] = self.lookup_taste_score(taste_scores, item)
                 user_seed = max(judge, key=judge.get)
                 # user_seed = random.choice(user_seed_list)
 
-        print(f"user_seed : {user_seed}")
+        logger.debug("user_seed selected", extra={'user_seed': user_seed})
+        context.seed_ingredient = user_seed
         return user_seed         
                     
 
 
-    def evaluate_model(self,model, test_user_list,wandb_flag, num_recipes=100):
-        self.model = model
-        similarity_list= []
-        diversity_list = []
-        abv_match_list = []
-        taste_match_list = []
-        recipe_profile_list=[]
+    def evaluate_model(self,model, test_user_list,wandb_flag, num_recipes=100, seed=None):
+        # seed를 주면 사용자마다 정해진 난수로 seed 재료를 고릅니다. (ParallelEvaluation.py와 같은 결과)
+        evaluation_results = []
         recipe_ingredient_count_list = []
-        for user in test_user_list:
+        for index, user in enumerate(test_user_list):
             # def generate_recipe(self, seed_ingredient, user_preference, max_length=10):
             # seed_ingredient=random.choice(list(self.ingredient_ids.keys()))
-            seed_ingredient = self.select_user_seed(user)
+            seed_ingredient = self.select_user_seed(user, self.evaluation_context(seed, index))
             # seed_ingredient = "vodka"#"lemon juice"
             print(seed_ingredient)
             generated_recipes = self.generate_recipe(model,seed_ingredient,user)
             print(generated_recipes)
             print(json.dumps(user,indent=4))
-            recipe_profile=self.get_taste_log(generated_recipes)
-            recipe_profile_list.append(recipe_profile)
+            result = self.evaluate_recipe(generated_recipes, user)
+            evaluation_results.append(result)
             if wandb_flag:
                 wandb.log({f"generated_recipe_{user['user_id']}": generated_recipes})
                 ingredient_count = len(generated_recipes[0])
                 recipe_ingredient_count_list.append(ingredient_count)
                 wandb.log({f"ingredient_count_{user['user_id']}": ingredient_count})
-                
-            s = self.evaluate_similarity(generated_recipes)
-            d = self.evaluate_diversity(generated_recipes)
-            a = self.evaluate_abv_match(generated_recipes, user)
-            t = self.evaluate_taste_match(generated_recipes, user)
-            print(f"s : {s}, d : {d}, a : {a}, t : {t}")
-            similarity_list.append(s)
-            diversity_list.append(d)
-            abv_match_list.append(a)
-            taste_match_list.append(t)
-
-        similarity = np.mean(similarity_list)
-        diversity = np.mean(diversity_list)
-        abv_match = np.mean(abv_match_list)
-        taste_match = np.mean(taste_match_list)
+
+            print(f"s : {result['similarity']}, d : {result['diversity']}, a : {result['abv_match']}, t : {result['taste_match']}")
+
+        evaluation_metrics, recipe_profile_list = self.summarize_evaluation(evaluation_results)
         avg_ingredient_count = np.mean(recipe_ingredient_count_list)
         if wandb_flag:
             wandb.log({'avg_ingredient_count': avg_ingredient_count})
-        evaluation_metrics = {
-            'similarity': similarity,
-            'diversity': diversity,
-            'abv_match': abv_match,
-            'taste_match': taste_match,
-        }
         
         return evaluation_metrics,recipe_profile_list
+
+    def evaluation_context(self, seed, index):
+        # seed가 없으면 기존처럼 random 모듈을 사용합니다.
+        if seed is None:
+            return RecipeContext()
+        return RecipeContext(rng=random.Random(f"{seed}-{index}"))
+
+    def evaluate_recipe(self, generated_recipes, user, similarity=None):
+        # 사용자 한 명의 레시피에 대한 평가 지표와 맛 프로파일
+        if similarity is None:
+            similarity = self.evaluate_similarity(generated_recipes)
+        return {'recipe': generated_recipes,
+                'profile': self.get_taste_log(generated_recipes),
+                'similarity': similarity,
+                'diversity': self.evaluate_diversity(generated_recipes),
+                'abv_match': self.evaluate_abv_match(generated_recipes, user),
+                'taste_match': self.evaluate_taste_match(generated_recipes, user)}
+
+    def evaluate_users(self, model, users, seed=0, start=0, batch_size=64):
+        '''
+        evaluate_model과 같은 평가를 batch_size명씩 generate_recipes로 함께 디코딩해 수행하고 사용자별 결과를 반환합니다.
+        start는 users[0]의 전체 사용자 목록에서의 위치입니다. (사용자별 난수가 나누는 방식과 관계없이 같도록)
+        '''
+        evaluation_results = []
+        for batch_start in range(0, len(users), batch_size):
+            batch = users[batch_start:batch_start + batch_size]
+            seed_ingredients = [self.select_user_seed(user, self.evaluation_context(seed, start + batch_start + i)) for i, user in enumerate(batch)]
+            generated = self.generate_recipes(model, seed_ingredients, batch)
+            for generated_recipes in generated:
+                if isinstance(generated_recipes, Exception):
+                    raise generated_recipes
+            similarities = self.evaluate_similarity_batch(generated)
+            for generated_recipes, user, similarity in zip(generated, batch, similarities):
+                evaluation_results.append(self.evaluate_recipe(generated_recipes, user, similarity))
+        return evaluation_results
+
+    @staticmethod
+    def summarize_evaluation(evaluation_results):
+        # 사용자 순서대로 평균을 내므로 같은 결과 목록이면 나누어 평가해도 같은 값이 나옵니다.
+        evaluation_metrics = {metric: np.mean([result[metric] for result in evaluation_results])
+                              for metric in ['similarity', 'diversity', 'abv_match', 'taste_match']}
+        recipe_profile_list = [result['profile'] for result in evaluation_results]
+        return evaluation_metrics, recipe_profile_list
+
     def cosine_similarity(self,vector1, vector2):
         dot_product = sum(a * b for a, b in zip(vector1, vector2))
         vector1_norm = math.sqrt(sum(x ** 2 for x in vector1))
         vector2_norm = math.sqrt(sum(x ** 2 for x in vector2))
         return dot_product / (vector1_norm * vector2_norm)
-    def evaluate_similarity(self, generated_recipe):        
+    def recipe_quantities(self, generated_recipe):
         recipe_dict = {}
         for item, quantity_ratio in zip(generated_recipe[0], generated_recipe[1]):
             recipe_dict[item] = quantity_ratio * self.total_amount
-        # 벡터 생성 함수
-        def create_vector(recipe, all_ingredients):
-            return np.array([recipe.get(ing, 0) for ing in all_ingredients])
+        return recipe_dict
 
-        # 모든 재료 목록 생성
-        all_ingredients = set(recipe_dict.keys())
-        for cocktail in self.cocktail_info:
-            all_ingredients.update(cocktail['recipe'].keys())
+    def evaluate_similarity(self, generated_recipe):
+        # 기존 cocktail 레시피와의 코사인 유사도 중 최댓값 (0보다 작으면 0)
+        return self.evaluate_similarity_batch([generated_recipe])[0]
 
-        generated_vector = create_vector(recipe_dict, all_ingredients)
+    def evaluate_similarity_batch(self, generated_recipes_list):
+        similarities = self.cocktail_matrix.similarities_batch([self.recipe_quantities(generated_recipe) for generated_recipe in generated_recipes_list])
+        return [max(0, float(row_max)) for row_max in similarities.max(axis=1)]
 
-        max_similarity = 0
-        for cocktail in self.cocktail_info:
-            origin_vector = create_vector(cocktail['recipe'], all_ingredients)
-
-            # 코사인 유사도 계산
-            dot_product = np.dot(generated_vector, origin_vector)
-            norm_product = np.linalg.norm(generated_vector) * np.linalg.norm(origin_vector)
-            similarity = dot_product / norm_product if norm_product else 0
-            max_similarity = max(max_similarity, similarity)
-
-        return max_similarity
+    def closest_cocktails(self, generated_recipe, k=5):
+        '''
+        생성된 레시피와 코사인 유사도가 가장 높은 기존 cocktail k개를 [{'cocktail_name', 'similarity'}] 형태로 반환합니다.
+        '''
+        return [{'cocktail_name': name, 'similarity': similarity}
+                for name, similarity in self.cocktail_matrix.closest(self.recipe_quantities(generated_recipe), k)]
 
     def evaluate_diversity(self, generated_recipes):
         # 생성된 레시피와 원본 레시피 간의 다양성 계산
@@ -402,24 +605,16 @@ class Eval(CocktailEmbeddingMaker):
         return recipe_taste
 
     
-    def calculate_recipe_taste_score(self, recipe, quantities, user_preference):
+    def calculate_recipe_taste_score(self, recipe, quantities, user_preference, context=None):
         recipe_taste_score = 0
+        taste_scores = self.get_ingredient_taste_scores(user_preference, context)
         for ingredient, quantity in zip(recipe, quantities):
-            ingredient_taste_score = self.get_ingredient_taste_score(ingredient, user_preference)
+            ingredient_taste_score = self.lookup_taste_score(taste_scores, ingredient)
             recipe_taste_score += ingredient_taste_score * quantity
         
         recipe_taste_score /= len(recipe)  # 재료 개수로 나누어 평균 점수 계산
         return recipe_taste_score
     
-    def set_limited_ingredient(self, ingredient_list):
-        '''
-        소지 재료 입력
-        '''
-        self.limited_ingredient_list = ingredient_list
-        self.limited_mode = True
-        # print(f"limited_ingredient_list : {self.limited_ingredient_list}")
-        self.set_ingredient_mapping()
-
     def calculate_taste_similarity(self, taste_profile, ingredient_taste_profile, user_preference):
         similarity = 0
         # print(f"taste_profile : {taste_profile} , ingredient_taste_profile : {ingredient_taste_profile} , user_preference : {user_preference}")
@@ -431,15 +626,15 @@ class Eval(CocktailEmbeddingMaker):
         return 1 - similarity
 
     def get_ingredient_taste_profile(self, ingredient):
-        ingredient_info = next((item for item in self.flavor_data if item["name"] == ingredient), None)
-        if ingredient_info:
-            taste_profile = {taste: ingredient_info[taste] for taste in self.attributes if taste != "name"}
+        taste_profile = self.ingredient_table.profile(ingredient)
+        if taste_profile is not None:
             return taste_profile
         else:
-            print(f"Ingredient '{ingredient}' not found in flavor_data")
+            logger.warning(f"Ingredient '{ingredient}' not found in flavor_data")
             return None
         
-    def find_similar_ingredients(self, recipe_ingredients, available_ingredients, user_preference):
+    def find_similar_ingredients(self, recipe_ingredients, available_ingredients, user_preference, context=None):
+        context = context or RecipeContext(available_ingredients)
         # 재료 매핑 처리
         best_set = set()
         non_mapped_recipe = []
@@ -474,88 +669,272 @@ class Eval(CocktailEmbeddingMaker):
                     break
             if best_replacement is None:
                 # print(f"best_replacement is None for item: {item}, available_ingredients: {available_ingredients}")
-                best_replacement = random.choice(available_ingredients)
+                best_replacement = context.rng.choice(available_ingredients)
+            best_set.add(best_replacement)
+        return best_set
+
+    def find_inventory_substitutes(self, recipe_ingredients, inventory, user_preference, context=None):
+        '''
+        find_similar_ingredients(recipe_ingredients, inventory.ingredients, ...)와 같은 결과를 반환합니다.
+        재료 매핑과 재료 간 거리는 등록할 때 계산해 둔 Inventory(InventoryRegistry.py)의 값을 사용합니다.
+        '''
+        context = context or RecipeContext(list(inventory.ingredients))
+        best_set = set()
+        non_mapped_recipe = []
+        for recipe_ingredient in recipe_ingredients:
+            resolved = inventory.resolved.get(recipe_ingredient)
+            if resolved is not None:
+                best_set.add(resolved)
+            else:
+                non_mapped_recipe.append(recipe_ingredient)
+
+        for item in non_mapped_recipe:
+            if item in inventory.member_set:
+                best_set.add(item)
+                continue
+            similarities = inventory.similarities(item, user_preference)
+            # 유사도가 같으면 목록의 앞쪽 재료를 고릅니다.
+            best_index = int(np.argmax(similarities))
+            if similarities[best_index] > -500:
+                best_replacement = inventory.members[best_index]
+            else:
+                best_replacement = context.rng.choice(inventory.ingredients)
             best_set.add(best_replacement)
         return best_set
     
 
     
 
-    def generate_recipe(self,model, seed_ingredient, user_preference, max_length=10):
+    def get_ingredient_taste_scores(self, user_preference, context=None):
+        '''
+        모든 재료의 선호도 점수(0.7 * 맛 점수 + 0.3 * 도수 점수)를 재료 ID 순서의 벡터로 반환합니다.
+        context가 주어지면 요청 안에서 같은 사용자 선호도에 대해 한 번만 계산하고 context에 두어 재사용합니다.
+        '''
+        if context is None:
+            return self.compute_ingredient_taste_scores(user_preference)
+        cache_key = tuple(user_preference.items())
+        taste_scores = context.taste_scores.get(cache_key)
+        if taste_scores is None:
+            taste_scores = self.compute_ingredient_taste_scores(user_preference)
+            taste_scores.flags.writeable = False
+            context.taste_scores[cache_key] = taste_scores
+        return taste_scores
+
+    def lookup_taste_score(self, taste_scores, ingredient_name):
+        ingredient_id = self.ingredient_ids.get(ingredient_name)
+        if ingredient_id is None:
+            logger.warning(f"[ingredient_name]there is no ingredient!:{ingredient_name}")
+            return 0.0  # 재료 정보가 없는 경우 0 반환
+        return taste_scores[ingredient_id]
+
+    def compute_ingredient_taste_scores(self, user_preference):
+        # ABV 점수 계산 (abv max값은 75.5)
+        abv_score = 1 - (np.abs(self.ingredient_abv_array - user_preference['ABV']) / 75.5)
+        # 맛 점수 계산: 사용자 선호도의 key 순서대로 재료 전체 열을 더해 평균을 냅니다.
+        taste_score = 0
+        taste_count = 0
+        for taste in user_preference:
+            if taste != 'ABV' and taste != 'abv_min' and taste != 'abv_max' and taste != 'user_id':
+                ingredient_taste = self.ingredient_taste_matrix[:, self.ingredient_table.attribute_index[taste]] / 100
+                taste_score = taste_score + (1 - np.abs(ingredient_taste - user_preference[taste] / 100))
+                taste_count += 1
+        taste_score = taste_score / taste_count
+
+        # TODO: 가중치 조정 필요
+        taste_weight = 0.7
+        abv_weight = 0.3
+        weighted_score = taste_weight * taste_score + abv_weight * abv_score
+        return np.where(self.ingredient_found, weighted_score, 0.0)
+
+    def rescore_probabilities(self, probabilities, user_preference, high_abv_count, total_prob, max_high_abv=3, context=None):
+        '''
+        모델이 출력한 다음 재료 확률 전체에 도수 점수, 카테고리 가중치, 높은 도수 제한을 한 번에 적용합니다.
+        조정된 확률과 갱신된 high_abv_count를 반환합니다.
+        '''
+        taste_scores = self.get_ingredient_taste_scores(user_preference, context)
+        probabilities, high_abv_counts = self.rescore_probabilities_batch(probabilities[None], [user_preference], [high_abv_count], [total_prob], max_high_abv, taste_scores[None])
+        return probabilities[0], int(high_abv_counts[0])
+
+    def rescore_probabilities_batch(self, probabilities, user_preferences, high_abv_counts, total_probs, max_high_abv=3, taste_scores=None):
+        '''
+        rescore_probabilities를 (레시피 수, 재료 수) 확률 행렬의 모든 행에 한 번에 적용합니다.
+        taste_scores(행별 get_ingredient_taste_scores 결과)를 주면 다시 계산하지 않습니다.
+        조정된 확률 행렬과 갱신된 high_abv_count 배열을 반환합니다.
+        '''
+        target_abv = np.array([user_preference['ABV'] for user_preference in user_preferences], dtype=np.float64)[:, None]
+        high_abv_counts = np.asarray(high_abv_counts, dtype=np.int64)
+        condiment_rows = (np.asarray(total_probs, dtype=np.float64) > 1.0)[:, None]
+        ingredient_abv = self.ingredient_abv_array
+        abv_score = 1 / (1 + np.abs(ingredient_abv - target_abv))  # 도수 차이가 작을수록 높은 점수
+        abv_score = np.where((target_abv == 0) & (ingredient_abv > 0), 0.0, abv_score)
+
+        is_alcohol = self.category_mask('Alcohol')
+        is_mixer = self.category_mask('Mixer')
+        is_condiment = self.category_mask('Condiment')
+        alcohol_rows = target_abv > 0
+        multiplier = np.ones(probabilities.shape)
+        #도수가 있는 것을 선호할때
+        is_high_abv = is_alcohol & (ingredient_abv > 32)
+        # ID 순서대로 max_high_abv개의 높은 도수 재료까지는 제한하지 않고 개수만 셉니다. (이미 max_high_abv개면 모두 제한합니다.)
+        count_before = np.minimum(high_abv_counts[:, None] + np.cumsum(is_high_abv) - is_high_abv, max_high_abv)
+        limited = count_before >= max_high_abv
+        high_abv_counts = np.where(alcohol_rows[:, 0], np.minimum(max_high_abv, high_abv_counts + int(is_high_abv.sum())), high_abv_counts)
+        multiplier[alcohol_rows & is_high_abv & limited] = 0.8  # 높은 도수 음료 제한
+        multiplier[alcohol_rows & is_mixer & limited] = 1.5
+        multiplier[alcohol_rows & condiment_rows & is_condiment] = 1.5
+        #도수가 없는 것을 선호할때
+        multiplier[~alcohol_rows & is_alcohol] = 0  # 높은 도수 음료 제한
+        multiplier[~alcohol_rows & is_mixer] = 2.5
+        multiplier[~alcohol_rows & condiment_rows & is_condiment] = 2.5
+
+        if taste_scores is None:
+            taste_scores = np.array([self.get_ingredient_taste_scores(user_preference) for user_preference in user_preferences])
+        probabilities = scale_probabilities(probabilities, multiplier)
+        probabilities = scale_probabilities(probabilities, taste_scores * abv_score)
+        return probabilities, high_abv_counts
+
+    def generate_recipe(self,model, seed_ingredient, user_preference, max_length=10, context=None):
         #TODO : 가니시 고려해야함 
         #TODO : 높은 도수의 음료는 한두가지로 제한해야함
-        self.model = model
+        # 선호도 점수는 재료 선택과 재료 양 조정에서 함께 사용하도록 context에 한 번만 계산합니다.
+        context = context or RecipeContext()
+        generated_recipe = list(self.generate_recipe_steps(model, seed_ingredient, user_preference, max_length, context))
+        # 레시피 도수 계산 및 재료 양 조정
+        target_abv = user_preference['ABV']
+        with self.stage_timer('quantities'):
+            quantities = self.adjust_ingredient_quantities(generated_recipe, target_abv,user_preference, context=context)
+        return generated_recipe, quantities
+
+    def generate_recipe_steps(self, model, seed_ingredient, user_preference, max_length=10, context=None):
+        '''
+        generate_recipe의 재료 선택 과정입니다. seed 재료부터 재료가 정해질 때마다 하나씩 yield합니다.
+        '''
+        context = context or RecipeContext()
         generated_recipe = [seed_ingredient]
+        yield seed_ingredient
         high_abv_count = 0
         
         max_high_abv = 3
         total_prob = 0
         max_prob_sum = 1.5
-        print(f"[generate_recipe]seed_ingredient : {seed_ingredient}")
+        # IncrementalRecipeDecoder가 주어지면 LSTM 상태를 유지하면서 새 재료만 입력합니다.
+        session = None
+        input_offset = getattr(model, 'input_offset', 0)
+        trace = decode_trace_enabled(decode_logger)
+        if trace:
+            decode_logger.debug("generate_recipe start", extra={'seed_ingredient': seed_ingredient, 'user_preference': user_preference})
         while total_prob < max_prob_sum:
             try:
-                sequence = [self.ingredient_ids[self.normalize_string(ingredient)] for ingredient in generated_recipe]
-                sequence = tf.keras.preprocessing.sequence.pad_sequences([sequence], maxlen=self.max_recipe_length)
+                recipe_ids = [self.ingredient_ids[self.normalize_string(ingredient)] for ingredient in generated_recipe]
+                sequence = pad_sequences([recipe_ids], maxlen=self.max_recipe_length)
             except Exception as e:
-                print(f"generated_recipe : {generated_recipe}")
-            print(f"sequence : {sequence}")
-            probabilities = self.model.predict(sequence)[0]
+                logger.error(f"[generate_recipe]unknown ingredient : {e}", extra={'generated_recipe': generated_recipe})
+            if trace:
+                decode_logger.debug("generate_recipe sequence", extra={'sequence': sequence[0].tolist()})
+            with self.stage_timer('model_step'):
+                if hasattr(model, 'start'):
+                    if session is None:
+                        session = model.start(recipe_ids)
+                    probabilities = session.next_probabilities()
+                else:
+                    # mask_zero 모델은 재료 ID + 1을 입력합니다. (sequence는 중복 재료 제거에 그대로 사용합니다.)
+                    model_input = pad_sequences([recipe_ids], self.max_recipe_length, input_offset) if input_offset else sequence
+                    probabilities = model.predict(model_input)[0]
             probabilities[sequence[0]] = 0  # 중복 재료 제거
             try:
                 # 사용자 선호도를 반영하여 재료 선택 확률 조정
-                for ingredient_id, prob in enumerate(probabilities):
-                    ingredient_name = list(self.ingredient_ids.keys())[list(self.ingredient_ids.values()).index(ingredient_id)]
-                    ingredient_taste_score = self.get_ingredient_taste_score(ingredient_name, user_preference)
-                    ingredient_abv = self.get_ingredient_abv(ingredient_name)
-                    if user_preference['ABV'] == 0 and ingredient_abv > 0:
-                        abv_score = 0
-                    else:
-                        abv_diff = abs(ingredient_abv - user_preference['ABV'])
-                        abv_score = 1 / (1 + abv_diff)  # 도수 차이가 작을수록 높은 점수
-                    # 재료의 카테고리를 고려하는 후처리
-                    category = self.get_ingredient_category(ingredient_name)
-                    if user_preference['ABV']>0:
-                        #도수가 있는 것을 선호할때
-                        if category in ['Alcohol'] and ingredient_abv>32:
-                            if high_abv_count >= max_high_abv:
-                                probabilities[ingredient_id] *= 0.8  # 높은 도수 음료 제한
-                            else:
-                                high_abv_count += 1
-                        elif category in ['Mixer']:
-                            if high_abv_count >= max_high_abv:
-                                probabilities[ingredient_id] *= 1.5
-                        elif category in ['Condiment'] and total_prob>1.0:
-                            probabilities[ingredient_id] *= 1.5
-                    else:
-                        if category in ['Alcohol']:
-                            probabilities[ingredient_id] *= 0  # 높은 도수 음료 제한
-                        elif category in ['Mixer']:
-                            probabilities[ingredient_id] *= 2.5
-                        elif category in ['Condiment'] and total_prob>1.0:
-                            probabilities[ingredient_id] *= 2.5
-                        
-                    # elif category in ['Condiment']:
-                    #     probabilities[ingredient_id] *= 10  # 과일이나 향신료, Mixer 선호
-                    probabilities[ingredient_id] *= ingredient_taste_score * abv_score
+                with self.stage_timer('rescoring'):
+                    probabilities, high_abv_count = self.rescore_probabilities(probabilities, user_preference, high_abv_count, total_prob, max_high_abv, context)
             except Exception as e:
-                print(f"[generate_recipe]error : {e}")
-            sum_prob = sum(probabilities)
-            normalized_prob = [prob / sum_prob for prob in probabilities]
+                logger.error(f"[generate_recipe]error : {e}")
+            sum_prob = np.cumsum(probabilities)[-1]  # sum()과 같은 순서로 더합니다.
+            normalized_prob = probabilities / sum_prob
             next_ingredient_id = np.argmax(normalized_prob)
 
-            next_ingredient = list(self.ingredient_ids.keys())[list(self.ingredient_ids.values()).index(next_ingredient_id)]
+            next_ingredient = self.ingredient_names[next_ingredient_id]
             generated_recipe.append(next_ingredient)
-            print(f"next_ingredient : {next_ingredient}, total_prob : {total_prob} , normalized_prob[next_ingredient_id] : {normalized_prob[next_ingredient_id]}")
+            yield next_ingredient
+            if session is not None:
+                session.feed(next_ingredient_id)
+            if trace:
+                decode_logger.debug("generate_recipe step", extra={'next_ingredient': next_ingredient, 'total_prob': float(total_prob),
+                                                                   'next_prob': float(normalized_prob[next_ingredient_id])})
             total_prob += normalized_prob[next_ingredient_id]
             if len(generated_recipe)>=max_length:
                 break
-        # 레시피 도수 계산 및 재료 양 조정
-        target_abv = user_preference['ABV']
-        quantities = self.adjust_ingredient_quantities(generated_recipe, target_abv,user_preference)
-        return generated_recipe, quantities
         
         #TODO : taste고려해야함 
-    def adjust_ingredient_quantities(self, recipe, target_abv, user_preference, total_amount=200, max_iterations=100):
+    def generate_recipes(self, model, seed_ingredients, user_preferences, max_length=10):
+        '''
+        여러 (seed 재료, 사용자 선호도)의 레시피를 함께 생성합니다. step마다 아직 끝나지 않은 레시피들의 다음 재료 확률을
+        한 번의 batch predict로 구하고 재점수화도 한 번에 적용합니다. generate_recipe와 같은 규칙으로 재료를 고릅니다.
+        입력 순서대로 (레시피, 재료 비율) 또는 해당 항목에서 발생한 Exception을 담은 리스트를 반환합니다.
+        '''
+        results = [None] * len(seed_ingredients)
+        recipes = {}
+        recipe_ids = {}
+        high_abv_counts = {}
+        total_probs = {}
+        # 선호도 점수는 항목마다 한 번만 계산해 재료 양 조정까지 항목별 context로 사용합니다.
+        contexts = {}
+        taste_scores = {}
+        for i, (seed_ingredient, user_preference) in enumerate(zip(seed_ingredients, user_preferences)):
+            try:
+                recipe_ids[i] = [self.ingredient_ids[self.normalize_string(seed_ingredient)]]
+                contexts[i] = RecipeContext()
+                taste_scores[i] = self.get_ingredient_taste_scores(user_preference, contexts[i])
+            except Exception as e:
+                results[i] = e
+                continue
+            recipes[i] = [seed_ingredient]
+            high_abv_counts[i] = 0
+            total_probs[i] = 0
+
+        max_high_abv = 3
+        max_prob_sum = 1.5
+        active = list(recipes)
+        input_offset = getattr(model, 'input_offset', 0)
+        while active:
+            sequences = pad_sequences([recipe_ids[i] for i in active], maxlen=self.max_recipe_length)
+            model_input = pad_sequences([recipe_ids[i] for i in active], self.max_recipe_length, input_offset) if input_offset else sequences
+            with self.stage_timer('model_step'):
+                probabilities = np.array(model.predict(model_input))
+            probabilities[np.arange(len(active))[:, None], sequences] = 0  # 중복 재료 제거
+            with self.stage_timer('rescoring'):
+                probabilities, step_high_abv_counts = self.rescore_probabilities_batch(
+                    probabilities, [user_preferences[i] for i in active], [high_abv_counts[i] for i in active],
+                    [total_probs[i] for i in active], max_high_abv, np.array([taste_scores[i] for i in active]))
+            sum_prob = np.cumsum(probabilities, axis=1)[:, -1]  # sum()과 같은 순서로 더합니다.
+            normalized_prob = probabilities / sum_prob[:, None]
+            next_ingredient_ids = np.argmax(normalized_prob, axis=1)
+
+            next_active = []
+            for row, i in enumerate(active):
+                next_ingredient_id = next_ingredient_ids[row]
+                recipes[i].append(self.ingredient_names[next_ingredient_id])
+                recipe_ids[i].append(next_ingredient_id)
+                high_abv_counts[i] = int(step_high_abv_counts[row])
+                total_probs[i] += normalized_prob[row, next_ingredient_id]
+                if total_probs[i] < max_prob_sum and len(recipes[i]) < max_length:
+                    next_active.append(i)
+            active = next_active
+
+        # 레시피 도수 계산 및 재료 양 조정
+        for i, recipe in recipes.items():
+            try:
+                with self.stage_timer('quantities'):
+                    quantities = self.adjust_ingredient_quantities(recipe, user_preferences[i]['ABV'], user_preferences[i], context=contexts[i])
+                results[i] = (recipe, quantities)
+            except Exception as e:
+                results[i] = e
+        return results
+
+    def adjust_ingredient_quantities(self, recipe, target_abv, user_preference, total_amount=200, max_iterations=100, method=None, context=None):
+        method = method or self.quantity_method
+        if method == 'solver':
+            return self.solve_ingredient_quantities(recipe, target_abv, user_preference, total_amount, context=context)
+        # 반복할 때마다 선호도 점수를 다시 계산하지 않도록 context에 둡니다.
+        context = context or RecipeContext()
         quantities = [total_amount / len(recipe)] * len(recipe)  # 초기 재료 양 설정 (균등 분배)
         min_quantity = 10  # 최소 재료 양 설정 (ml 단위)
         min_ingredients = 3  # 최소 재료 개수 설정
@@ -563,10 +942,12 @@ class Eval(CocktailEmbeddingMaker):
         max_ingredient_ratio = 1 - (len(recipe) - 1) * 0.1  # 단일 재료의 최대 비율 동적 설정
 
         prev_quantities = quantities.copy()  # 이전 단계의 재료 양 저장
+        taste_scores = self.get_ingredient_taste_scores(user_preference, context)
+        recipe_taste_scores = [self.lookup_taste_score(taste_scores, ingredient) for ingredient in recipe]
 
         for iteration in range(max_iterations):
             recipe_abv = self.calculate_recipe_abv(recipe, quantities)
-            recipe_taste_score = self.calculate_recipe_taste_score(recipe, quantities, user_preference)
+            recipe_taste_score = self.calculate_recipe_taste_score(recipe, quantities, user_preference, context)
 
             if abs(recipe_abv - target_abv) < convergence_threshold and recipe_taste_score >= 0.8:
                 non_zero_ingredients = sum(1 for q in quantities if q > min_quantity)
@@ -584,19 +965,18 @@ class Eval(CocktailEmbeddingMaker):
             if recipe_abv < target_abv:
                 # 알코올 함량이 높은 재료의 양을 증가
                 for i, ingredient in enumerate(recipe):
-                    ingredient_info = next((item for item in self.flavor_data if item["name"] == ingredient), None)
-                    if ingredient_info and ingredient_info['ABV'] > 0:
-                        quantities[i] += scale_factor * ingredient_info['ABV'] * 0.5  # 도수의 영향을 줄임
+                    row = self.ingredient_table.row(ingredient)
+                    if row is not None and self.ingredient_table.abv[row] > 0:
+                        quantities[i] += scale_factor * self.ingredient_table.abv[row] * 0.5  # 도수의 영향을 줄임
             else:
                 # 알코올 함량이 낮은 재료의 양을 증가
                 for i, ingredient in enumerate(recipe):
-                    ingredient_info = next((item for item in self.flavor_data if item["name"] == ingredient), None)
-                    if ingredient_info and ingredient_info['ABV'] == 0:
+                    row = self.ingredient_table.row(ingredient)
+                    if row is not None and self.ingredient_table.abv[row] == 0:
                         quantities[i] += scale_factor * 0.5  # 도수의 영향을 줄임
 
             # 사용자 선호도에 따라 재료 양 조정
-            for i, ingredient in enumerate(recipe):
-                ingredient_taste_score = self.get_ingredient_taste_score(ingredient, user_preference)
+            for i, ingredient_taste_score in enumerate(recipe_taste_scores):
                 if ingredient_taste_score < 0.5:
                     quantities[i] = max(quantities[i] - scale_factor, min_quantity)
                 elif ingredient_taste_score > 0.8:
@@ -628,7 +1008,7 @@ class Eval(CocktailEmbeddingMaker):
                 remaining_amount -= min_quantity
 
             # 나머지 양을 선호도에 따라 분배
-            preference_scores = [self.get_ingredient_taste_score(recipe[i], user_preference) for i in non_zero_indices]
+            preference_scores = [recipe_taste_scores[i] for i in non_zero_indices]
             total_preference_score = sum(preference_scores)
             for i, score in zip(non_zero_indices, preference_scores):
                 quantities[i] += remaining_amount * (score / total_preference_score)
@@ -641,53 +1021,107 @@ class Eval(CocktailEmbeddingMaker):
     
 
 
-    def get_ingredient_taste_score(self, ingredient_name, user_preference):
-        ingredient_info = next((item for item in self.flavor_data if item["name"] == ingredient_name), None)
-
-        if ingredient_info:
-            # ABV 점수 계산
-            abv_diff = abs(ingredient_info['ABV'] - user_preference['ABV'])
-            #abv max값은 75.5
-            abv_score = 1 - (abv_diff / 75.5)  # 0~1 범위로 정규화
-
-            # 맛 점수 계산
-            taste_scores = []
-            for taste in user_preference:
-                if taste != 'ABV' and taste != 'abv_min' and taste != 'abv_max' and taste != 'user_id':
-                    ingredient_taste = ingredient_info[taste] / 100
-                    user_taste = user_preference[taste] / 100
-                    taste_score = 1 - abs(ingredient_taste - user_taste)  # 0~1 범위로 정규화
-                    taste_scores.append(taste_score)
-            
-            taste_score = sum(taste_scores) / len(taste_scores)  # 맛 점수들의 평균
+    def solve_ingredient_quantities(self, recipe, target_abv, user_preference, total_amount=200, min_quantity=10, min_ingredients=3, context=None):
+        '''
+        재료 양 조정을 작은 제약 조건 최적화 문제로 풉니다.
+            minimize   ||q - p||^2       (p : 선호도 점수에 비례하여 나눈 재료 양)
+            subject to sum(q) = total_amount, sum(abv * q) = target_abv * total_amount,
+                       min_quantity <= q <= max_ingredient_ratio * total_amount
+        등식 제약은 닫힌 형태(2x2 선형 시스템)로 풀고, 범위를 벗어난 재료는 경계값으로 고정한 뒤 나머지를 다시 풉니다.
+        모든 재료가 min_quantity 이상이므로 최소 재료 개수(min_ingredients) 조건은 재료 수가 충분하면 자동으로 만족됩니다.
+        adjust_ingredient_quantities와 같이 총량 대비 비율 리스트를 반환합니다.
+        '''
+        n = len(recipe)
+        taste_scores = self.get_ingredient_taste_scores(user_preference, context)
+        scores = np.array([self.lookup_taste_score(taste_scores, ingredient) for ingredient in recipe], dtype=np.float64)
+        abv = np.array([self.get_ingredient_abv(ingredient) for ingredient in recipe], dtype=np.float64)
+        if n < min_ingredients:
+            logger.warning(f"[solve_ingredient_quantities]recipe has less than {min_ingredients} ingredients : {recipe}")
 
-            # TODO: 가중치 조정 필요
-            # 가중 평균 계산
-            taste_weight = 0.7
-            abv_weight = 0.3
-            weighted_score = taste_weight * taste_score + abv_weight * abv_score
+        # 범위 제약 (재료가 많아 최소량/최대 비율을 함께 만족할 수 없으면 완화합니다.)
+        max_ingredient_ratio = max(1 - (n - 1) * 0.1, 1 / n)
+        lower = min(min_quantity, total_amount / n)
+        upper = max_ingredient_ratio * total_amount
 
-            return weighted_score
+        # 선호도 점수에 비례하는 초기 분배
+        if scores.sum() > 0:
+            preferred = total_amount * scores / scores.sum()
         else:
-            print(f"[ingredient_name]there is no ingredient!:{ingredient_name}")
-            return 0.0  # 재료 정보가 없는 경우 0 반환
-    def generate_random_user_list(self,num_users):
+            preferred = np.full(n, total_amount / n)
+
+        # 범위 제약 안에서 만들 수 있는 도수 범위로 목표 도수를 제한합니다. (도수가 낮은/높은 재료부터 채운 경우)
+        abv_range = []
+        for order in [np.argsort(abv), np.argsort(-abv)]:
+            q = np.full(n, lower)
+            remaining = total_amount - lower * n
+            for i in order:
+                added = min(upper - lower, remaining)
+                q[i] += added
+                remaining -= added
+            abv_range.append(abv @ q / total_amount)
+        target = min(max(target_abv, abv_range[0]), abv_range[1])
+
+        constraints = np.vstack([np.ones(n), abv])
+        bounds = np.array([total_amount, target * total_amount])
+        quantities = preferred.copy()
+        fixed = np.zeros(n, dtype=bool)
+        for _ in range(n):
+            free = ~fixed
+            A = constraints[:, free]
+            residual = bounds - constraints[:, fixed] @ quantities[fixed] - A @ preferred[free]
+            multiplier = np.linalg.lstsq(A @ A.T, residual, rcond=None)[0]
+            quantities[free] = preferred[free] + A.T @ multiplier
+            violated = free & ((quantities < lower - 1e-9) | (quantities > upper + 1e-9))
+            if not violated.any():
+                break
+            quantities[violated] = np.clip(quantities[violated], lower, upper)
+            fixed |= violated
+            if fixed.all():
+                break
+        quantities = np.clip(quantities, lower, upper)
+        return (quantities / quantities.sum()).tolist()
+
+    def evaluate_quantity_methods(self, recipe_list, user_list, total_amount=200):
+        '''
+        같은 레시피들에 대해 재료 양 조정 방식(heuristic, solver)별 평균 도수 오차(%p)와 평균 실행 시간(ms)을 비교합니다.
+        '''
+        results = {}
+        for method in ['heuristic', 'solver']:
+            abv_errors = []
+            runtimes = []
+            for recipe, user in zip(recipe_list, user_list):
+                start = time.perf_counter()
+                quantities = self.adjust_ingredient_quantities(recipe, user['ABV'], user, total_amount=total_amount, method=method)
+                runtimes.append(time.perf_counter() - start)
+                abv_errors.append(abs(self.calculate_recipe_abv(recipe, quantities) - user['ABV']))
+            results[method] = {'abv_error': np.mean(abv_errors), 'runtime_ms': np.mean(runtimes) * 1000}
+            print(f"{method} : abv_error {results[method]['abv_error']:.3f}, runtime {results[method]['runtime_ms']:.3f}ms")
+        return results
+
+    def get_ingredient_taste_score(self, ingredient_name, user_preference):
+        # 단일 재료의 선호도 점수. 계산은 get_ingredient_taste_scores의 벡터를 그대로 사용합니다.
+        return self.lookup_taste_score(self.get_ingredient_taste_scores(user_preference), ingredient_name)
+
+    def generate_random_user_list(self,num_users, seed=None, save=True):
+        # seed를 주면 항상 같은 사용자 목록을 만듭니다. save=False이면 파일로 저장하지 않습니다.
+        rng = np.random.RandomState(seed) if seed is not None else np.random
         user_list = []
         attributes = ['ABV', 'boozy', 'sweet', 'sour', 'bitter', 'umami', 'salty', 'astringent', 'Perceived_temperature', 'spicy', 'herbal', 'floral', 'fruity', 'nutty', 'creamy', 'smoky']
 
         for i in range(num_users):
             user = {
                 'user_id': i,
-                'ABV': np.random.randint(0, 60),
+                'ABV': rng.randint(0, 60),
             }
             for attribute in attributes[2:]:
-                user[attribute] = np.random.randint(0, 100)
+                user[attribute] = rng.randint(0, 100)
             user_list.append(user)
 
-        with open(f'user_list_v1_{num_users}.json', 'w') as f:
-            json.dump(user_list, f)
+        if save:
+            with open(f'user_list_v1_{num_users}.json', 'w') as f:
+                json.dump(user_list, f)
 
-        print("Random user_list generated and saved.")
+            print("Random user_list generated and saved.")
         return user_list
             
 
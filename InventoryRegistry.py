@@ -0,0 +1,134 @@
+import threading
+import numpy as np
+
+# Live Demo 레시피에서 사용하는 매장(바)별 소지 재료 목록입니다.
+# 등록할 때 모든 재료와 소지 재료 사이의 feature별 거리를 한 번만 계산해 두고,
+# 요청마다 사용자 선호도를 가중치로 더해 대체 재료를 고릅니다. (Eval.find_inventory_substitutes)
+
+IGNORED_PREFERENCES = ('abv_min', 'abv_max', 'user_id')
+
+
+class InventoryLimitError(Exception):
+    '''
+    등록된 목록 수가 max_inventories에 도달해 새 ID를 등록할 수 없을 때 발생합니다.
+    '''
+
+
+class Inventory:
+    '''
+    등록된 소지 재료 목록입니다. 생성된 뒤에는 바뀌지 않으므로 여러 요청이 함께 사용할 수 있습니다.
+        distances[재료 행, feature 열, 소지 재료] : 두 재료의 feature 값 차이의 절댓값
+        resolved[재료 이름] : 대체하지 않고 바로 사용할 소지 재료 (limited_item_dict.json의 매핑 또는 매핑이 없는 같은 재료)
+        nearest[재료 행, feature 열] : 해당 feature 값이 가장 가까운 소지 재료
+    '''
+    def __init__(self, inventory_id, ingredients, ingredient_table, ingredient_mapping, version=1):
+        unknown = [name for name in ingredients if name not in ingredient_table]
+        if unknown:
+            raise ValueError(f"unknown ingredients: {unknown}")
+        if not ingredients:
+            raise ValueError("inventory is empty")
+        self.inventory_id = inventory_id
+        self.version = version
+        self.ingredient_table = ingredient_table
+        # 대체 재료가 없을 때 무작위로 고르는 목록은 입력 그대로(중복 포함) 사용합니다.
+        self.ingredients = tuple(ingredients)
+        self.members = tuple(dict.fromkeys(ingredients))
+        self.member_set = frozenset(self.members)
+
+        rows = [ingredient_table.row(name) for name in self.members]
+        distances = np.abs(ingredient_table.matrix[:, :, None] - ingredient_table.matrix[rows].T[None, :, :])
+        distances.flags.writeable = False
+        self.distances = distances
+        nearest = np.argmin(distances, axis=2)
+        nearest.flags.writeable = False
+        self.nearest = nearest
+
+        # 매핑된 재료가 없으면 같은 재료가 있어도 대체 단계에서 고릅니다. (find_similar_ingredients와 같은 순서로 추가됩니다.)
+        resolved = {}
+        for name in ingredient_table.names:
+            if name in ingredient_mapping:
+                if ingredient_mapping[name] in self.member_set:
+                    resolved[name] = ingredient_mapping[name]
+            elif name in self.member_set:
+                resolved[name] = name
+        self.resolved = resolved
+
+    @property
+    def key(self):
+        # 같은 ID로 다시 등록하면 key가 바뀌므로 이전 목록으로 만든 /predict 캐시 결과를 사용하지 않습니다.
+        return f"{self.inventory_id}:{self.version}"
+
+    def similarities(self, ingredient, user_preference):
+        '''
+        ingredient와 각 소지 재료의 선호도 가중 유사도(1 - sum(|차이| * 선호도 / 100))를 members 순서로 반환합니다.
+        Eval.calculate_taste_similarity와 같은 순서로 더하므로 결과가 같습니다.
+        '''
+        row = self.ingredient_table.row(ingredient)
+        if row is None:
+            raise KeyError(f"unknown ingredient: {ingredient}")
+        distances = self.distances[row]
+        similarity = 0
+        for taste, user_score in user_preference.items():
+            if taste not in IGNORED_PREFERENCES and taste in self.ingredient_table.attribute_index:
+                similarity = similarity + distances[self.ingredient_table.attribute_index[taste]] * user_score / 100
+        return 1 - similarity
+
+    def substitutes(self, ingredient):
+        # feature별로 값이 가장 가까운 소지 재료
+        row = self.ingredient_table.row(ingredient)
+        return {attribute: self.members[index] for attribute, index in zip(self.ingredient_table.attributes, self.nearest[row])}
+
+    def summary(self):
+        return {'inventory_id': self.inventory_id, 'version': self.version, 'ingredients': list(self.ingredients)}
+
+
+class InventoryRegistry:
+    '''
+    소지 재료 목록은 (전체 재료 수 x feature 수 x 소지 재료 수) 크기의 거리를 가지므로 개수와 크기를 제한합니다.
+        max_inventories : 등록할 수 있는 목록 수 (이미 등록된 ID를 교체하는 것은 항상 허용)
+        max_ingredients : 목록 하나의 재료 수 (중복 포함)
+    서버가 직접 등록하는 기본 목록은 limited=False로 등록해 제한을 적용하지 않습니다.
+    '''
+    def __init__(self, ingredient_table, ingredient_mapping, max_inventories=64, max_ingredients=100):
+        self.ingredient_table = ingredient_table
+        self.ingredient_mapping = ingredient_mapping
+        self.max_inventories = max_inventories
+        self.max_ingredients = max_ingredients
+        self.inventories = {}
+        self.versions = 0
+        self.lock = threading.Lock()
+
+    def register(self, inventory_id, ingredients, limited=True):
+        # 거리 계산은 lock 밖에서 합니다. 같은 ID의 이전 목록은 교체됩니다.
+        if limited and len(ingredients) > self.max_ingredients:
+            raise ValueError(f"inventory has {len(ingredients)} ingredients, at most {self.max_ingredients} are allowed")
+        with self.lock:
+            if limited:
+                self.check_capacity(inventory_id)
+            self.versions += 1
+            version = self.versions
+        inventory = Inventory(inventory_id, ingredients, self.ingredient_table, self.ingredient_mapping, version)
+        with self.lock:
+            # 거리를 계산하는 동안 다른 ID가 등록되었을 수 있으므로 다시 확인합니다.
+            if limited:
+                self.check_capacity(inventory_id)
+            # 동시에 같은 ID를 등록하면 나중에 요청한 목록을 남깁니다.
+            current = self.inventories.get(inventory_id)
+            if current is None or current.version < version:
+                self.inventories[inventory_id] = inventory
+        return inventory
+
+    def check_capacity(self, inventory_id):
+        # lock을 잡은 상태에서 호출합니다.
+        if inventory_id not in self.inventories and len(self.inventories) >= self.max_inventories:
+            raise InventoryLimitError(f"at most {self.max_inventories} inventories can be registered, delete one first")
+
+    def get(self, inventory_id):
+        return self.inventories.get(inventory_id)
+
+    def remove(self, inventory_id):
+        with self.lock:
+            return self.inventories.pop(inventory_id, None)
+
+    def list(self):
+        return [inventory.summary() for inventory in list(self.inventories.values())]
@@ -0,0 +1,377 @@
+import os
+import sys
+import glob
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from RecipeDecoder import IncrementalRecipeDecoder, pad_sequences
+from ResultCache import LRUCache
+
+# 레시피 생성 모델을 어떤 런타임으로 실행할지 선택합니다.
+# Eval.generate_recipe는 predictor의 predict(sequences) -> (batch, num_ingredients) 만 사용하고,
+# start(sequence)가 있는 predictor(numpy)는 LSTM 상태를 유지하며 새 재료만 입력합니다.
+# predictor.input_offset은 pad_sequences에 넘길 재료 ID offset입니다. (mask_zero 모델은 1, 이전 모델은 0)
+# PrefixCachedPredictor로 감싸면 prefix별 다음 재료 확률을 캐시하고, 캐시에 없을 때만 모델을 실행합니다.
+# MicroBatchPredictor로 감싸면 동시에 들어온 여러 요청의 입력을 모아 한 번에 실행합니다.
+#
+#     numpy        : best_model_xxx.npz         (python RecipeDecoder.py export best_model_xxx.h5 best_model_xxx.npz)
+#     keras        : best_model_xxx.h5
+#     tflite       : best_model_xxx.tflite      (python ModelRuntime.py convert best_model_xxx.h5)
+#     tflite_int8  : best_model_xxx.int8.tflite (dynamic-range 양자화)
+RUNTIMES = ['numpy', 'keras', 'tflite', 'tflite_int8']
+
+def runtime_model_path(model_path, runtime):
+    base, _ = os.path.splitext(model_path)
+    if runtime == 'numpy':
+        return base + '.npz'
+    if runtime == 'tflite':
+        return base + '.tflite'
+    if runtime == 'tflite_int8':
+        return base + '.int8.tflite'
+    return base + '.h5'
+
+
+class KerasPredictor:
+    def __init__(self, model_path):
+        import tensorflow as tf
+        self.model = tf.keras.models.load_model(model_path)
+        # mask_zero 모델은 embedding에 패딩 행이 하나 더 있습니다.
+        self.input_offset = int(self.model.layers[0].input_dim == self.model.output_shape[-1] + 1)
+
+    def predict(self, sequences):
+        return self.model.predict(np.asarray(sequences), verbose=0)
+
+
+def load_tflite_interpreter(tflite_path):
+    # 가벼운 LiteRT/tflite_runtime 패키지를 우선 사용하고, 없으면 tensorflow에 포함된 인터프리터를 사용합니다.
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=tflite_path)
+
+
+class TFLitePredictor:
+    '''
+    convert_to_tflite로 만든 (1, max_recipe_length) 입력의 tflite 모델을 한 줄씩 실행합니다.
+    '''
+    input_offset = 0
+
+    def __init__(self, tflite_path):
+        self.interpreter = load_tflite_interpreter(tflite_path)
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        # 인터프리터는 여러 thread에서 동시에 실행할 수 없습니다.
+        self.lock = threading.Lock()
+
+    def predict(self, sequences):
+        probabilities = []
+        with self.lock:
+            for sequence in np.asarray(sequences, dtype=np.float32):
+                self.interpreter.set_tensor(self.input_index, sequence[None])
+                self.interpreter.invoke()
+                probabilities.append(self.interpreter.get_tensor(self.output_index)[0].copy())
+        return np.array(probabilities)
+
+
+def load_predictor(runtime, model_path, max_recipe_length=10):
+    if runtime not in RUNTIMES:
+        raise ValueError(f"unknown model runtime '{runtime}', choose one of {RUNTIMES}")
+    path = runtime_model_path(model_path, runtime)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found. (python RecipeDecoder.py export / python ModelRuntime.py convert 로 생성합니다.)")
+    if runtime == 'numpy':
+        return IncrementalRecipeDecoder.load_npz(path, max_recipe_length)
+    if runtime == 'keras':
+        return KerasPredictor(path)
+    return TFLitePredictor(path)
+
+
+class PrefixCachedPredictor:
+    '''
+    레시피 prefix(패딩된 재료 ID 시퀀스)별로 모델이 출력한 다음 재료 확률(softmax, 사용자 선호도 반영 전)을 캐시합니다.
+    사용자별 재점수화는 캐시 이후에 적용되므로 같은 prefix라면 어떤 사용자 프로필에도 그대로 쓸 수 있습니다.
+    '''
+    def __init__(self, predictor, max_size=10000, max_recipe_length=10):
+        self.predictor = predictor
+        self.max_recipe_length = max_recipe_length
+        self.input_offset = getattr(predictor, 'input_offset', 0)
+        self.cache = LRUCache(max_size, ttl=float('inf'))
+
+    def prefix_key(self, sequence, padded=False):
+        # padded=True는 predict에 들어온 pad_sequences 결과, False는 재료 ID 목록입니다.
+        window = [int(ingredient_id) for ingredient_id in sequence[-self.max_recipe_length:]]
+        if self.input_offset:
+            # mask_zero 모델은 패딩과 재료 ID가 겹치지 않으므로 패딩만 제거하고 재료 ID로 되돌립니다.
+            return tuple(ingredient_id - self.input_offset for ingredient_id in window if ingredient_id != 0) if padded else tuple(window)
+        # pad_sequences 결과가 같은 시퀀스는 같은 key가 되도록 앞쪽의 0(패딩과 같은 입력)을 제거합니다.
+        while window and window[0] == 0:
+            window.pop(0)
+        return tuple(window)
+
+    def predict(self, sequences):
+        # 캐시에 없는 prefix만 모아 한 번의 batch predict로 계산합니다.
+        sequences = np.asarray(sequences)
+        keys = [self.prefix_key(list(sequence), padded=True) for sequence in sequences]
+        probabilities = [self.cache.get(key) for key in keys]
+        missing = [i for i, row in enumerate(probabilities) if row is None]
+        if missing:
+            for i, row in zip(missing, self.predictor.predict(sequences[missing])):
+                row.flags.writeable = False
+                self.cache.set(keys[i], row)
+                probabilities[i] = row
+        return np.array(probabilities)
+
+    def start(self, sequence):
+        return CachedDecodingSession(self, sequence)
+
+    def warm_up(self, ingredient_ids):
+        # 모든 seed 재료의 첫 step 확률을 미리 계산해 둡니다.
+        if hasattr(self.predictor, 'start'):
+            for ingredient_id in ingredient_ids:
+                self.start([ingredient_id]).next_probabilities()
+            return
+        # start가 없는 predictor는 한 번의 batch predict로 계산합니다.
+        ingredient_ids = list(ingredient_ids)
+        sequences = pad_sequences([[ingredient_id] for ingredient_id in ingredient_ids], self.max_recipe_length, self.input_offset)
+        for ingredient_id, probabilities in zip(ingredient_ids, self.predictor.predict(sequences)):
+            probabilities.flags.writeable = False
+            self.cache.set(self.prefix_key([ingredient_id]), probabilities)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class CachedDecodingSession:
+    '''
+    캐시에 있는 prefix는 모델을 실행하지 않습니다. 캐시에 없을 때만 내부 디코더 상태를 현재 prefix까지 따라잡아 계산합니다.
+    '''
+    def __init__(self, cached_predictor, sequence):
+        self.cached_predictor = cached_predictor
+        self.sequence = list(sequence)
+        self.session = None
+
+    def next_probabilities(self):
+        cache = self.cached_predictor.cache
+        key = self.cached_predictor.prefix_key(self.sequence)
+        probabilities = cache.get(key)
+        if probabilities is None:
+            probabilities = self.compute()
+            probabilities.flags.writeable = False
+            cache.set(key, probabilities)
+        return probabilities.copy()
+
+    def compute(self):
+        predictor = self.cached_predictor.predictor
+        if not hasattr(predictor, 'start'):
+            return predictor.predict(pad_sequences([self.sequence], self.cached_predictor.max_recipe_length, self.cached_predictor.input_offset))[0]
+        if self.session is None:
+            self.session = predictor.start(self.sequence)
+        else:
+            for ingredient_id in self.sequence[len(self.session.sequence):]:
+                self.session.feed(ingredient_id)
+        return self.session.next_probabilities()
+
+    def feed(self, ingredient_id):
+        self.sequence.append(ingredient_id)
+
+
+class MicroBatchPredictor:
+    '''
+    여러 thread(요청)에서 호출한 predict의 입력 행을 window_ms 동안 또는 max_batch_size개가 찰 때까지 모아
+    한 번의 batch predict로 실행하고, 각 호출에 자기 행의 결과를 돌려줍니다.
+    '''
+    def __init__(self, predictor, window_ms=3, max_batch_size=32):
+        self.predictor = predictor
+        self.input_offset = getattr(predictor, 'input_offset', 0)
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.rows = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def predict(self, sequences):
+        futures = []
+        for sequence in np.asarray(sequences):
+            future = Future()
+            self.queue.put((sequence, future))
+            futures.append(future)
+        return np.array([future.result() for future in futures])
+
+    def collect(self):
+        items = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(items) < self.max_batch_size:
+            # window가 지나면 이미 들어와 있는 입력만 더 모읍니다.
+            timeout = deadline - time.monotonic()
+            try:
+                items.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def run(self):
+        while True:
+            items = self.collect()
+            try:
+                probabilities = self.predictor.predict(np.stack([sequence for sequence, _ in items]))
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.rows += len(items)
+            for (_, future), row in zip(items, probabilities):
+                future.set_result(row)
+
+    def stats(self):
+        return {'batches': self.batches, 'rows': self.rows, 'mean_batch_size': self.rows / self.batches if self.batches else 0}
+
+
+def convert_to_tflite(model_path, max_recipe_length=10):
+    '''
+    keras 모델을 tflite(float32)와 dynamic-range 양자화(int8 가중치) tflite로 변환합니다.
+    LSTM의 while 루프는 tflite에서 변수를 읽지 못하므로, 같은 구조를 unroll=True, batch 1로 다시 만들어 가중치를 복사한 뒤 변환합니다.
+    '''
+    import tensorflow as tf
+    from tensorflow.keras.layers import Input, LSTM, Dense, Embedding
+    model = tf.keras.models.load_model(model_path)
+    lstm_layers = [layer for layer in model.layers if isinstance(layer, LSTM)]
+    dense_layers = [layer for layer in model.layers if isinstance(layer, Dense)]
+    embedding = model.layers[0]
+    if embedding.mask_zero:
+        # 고정 길이로 unroll하면 mask로 줄어드는 계산이 없어지므로 mask_zero 모델은 numpy 런타임을 사용합니다.
+        raise ValueError(f"{model_path} is a mask_zero model; use the numpy runtime (python RecipeDecoder.py export)")
+    unrolled_model = tf.keras.Sequential([
+        Input(batch_shape=(1, max_recipe_length)),
+        Embedding(embedding.input_dim, embedding.output_dim),
+        LSTM(lstm_layers[0].units, return_sequences=True, unroll=True),
+        LSTM(lstm_layers[1].units, unroll=True),
+        Dense(dense_layers[0].units, activation=dense_layers[0].activation),
+        Dense(dense_layers[1].units, activation='softmax')
+    ])
+    unrolled_model.set_weights(model.get_weights())
+
+    for runtime in ['tflite', 'tflite_int8']:
+        converter = tf.lite.TFLiteConverter.from_keras_model(unrolled_model)
+        if runtime == 'tflite_int8':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        tflite_path = runtime_model_path(model_path, runtime)
+        with open(tflite_path, 'wb') as f:
+            f.write(converter.convert())
+        print(f"{model_path} -> {tflite_path}")
+
+
+def benchmark(model_path, runtimes=None, num_samples=300, max_recipe_length=10):
+    '''
+    런타임별로 한 step(다음 재료 확률 1회) 지연 시간과 keras 모델 대비 top-1 일치율을 측정합니다.
+    '''
+    runtimes = runtimes or RUNTIMES
+    keras_predictor = load_predictor('keras', model_path, max_recipe_length)
+    num_ingredients = keras_predictor.model.output_shape[-1]
+    rng = np.random.RandomState(0)
+    sequences = [rng.randint(0, num_ingredients, size=rng.randint(1, max_recipe_length + 1)) for _ in range(num_samples)]
+    padded = pad_sequences(sequences, max_recipe_length, keras_predictor.input_offset)
+    reference = keras_predictor.predict(padded).argmax(axis=1)
+
+    results = {}
+    for runtime in runtimes:
+        predictor = load_predictor(runtime, model_path, max_recipe_length)
+        predictor.predict(padded[:1])  # warm-up
+        latencies = []
+        predictions = []
+        for sequence in padded:
+            start = time.perf_counter()
+            probabilities = predictor.predict(sequence[None])[0]
+            latencies.append(time.perf_counter() - start)
+            predictions.append(np.argmax(probabilities))
+        results[runtime] = {
+            'p50_ms': np.percentile(latencies, 50) * 1000,
+            'p95_ms': np.percentile(latencies, 95) * 1000,
+            'top1_agreement': float(np.mean(np.array(predictions) == reference)),
+        }
+        if hasattr(predictor, 'start'):
+            # 상태를 유지하는 디코더는 step마다 새 재료 하나만 입력합니다.
+            latencies = []
+            for sequence in sequences:
+                session = predictor.start(sequence[:1])
+                for ingredient_id in sequence[1:]:
+                    start = time.perf_counter()
+                    session.feed(ingredient_id)
+                    session.next_probabilities()
+                    latencies.append(time.perf_counter() - start)
+            results[runtime]['incremental_p50_ms'] = np.percentile(latencies, 50) * 1000
+        print(f"{runtime:>12} : " + ", ".join(f"{key} {value:.4f}" for key, value in results[runtime].items()))
+    return results
+
+
+def benchmark_micro_batching(model_path, runtimes=None, clients=(1, 8, 32, 128), window_ms=3, max_batch_size=32,
+                             recipes_per_client=10, recipe_length=5, max_recipe_length=10):
+    '''
+    동시 클라이언트 수별로 레시피 디코딩(재료 recipe_length개, step마다 predict 1회)의 처리량과 지연 시간을
+    micro-batching 없이(step마다 1행 predict) 실행했을 때와 비교합니다.
+    '''
+    runtimes = runtimes or RUNTIMES
+    results = {}
+    for runtime in runtimes:
+        predictor = load_predictor(runtime, model_path, max_recipe_length)
+        batcher = MicroBatchPredictor(predictor, window_ms, max_batch_size)
+        num_ingredients = predictor.predict(pad_sequences([[1]], max_recipe_length)).shape[-1]
+
+        def decode(target, seed):
+            recipe = [seed]
+            start = time.perf_counter()
+            for _ in range(recipe_length - 1):
+                probabilities = target.predict(pad_sequences([recipe], max_recipe_length, target.input_offset))[0]
+                probabilities[recipe] = 0
+                recipe.append(int(np.argmax(probabilities)))
+            return time.perf_counter() - start
+
+        for mode, target in [('single', predictor), ('batched', batcher)]:
+            for num_clients in clients:
+                seeds = np.random.RandomState(num_clients).randint(1, num_ingredients, size=num_clients * recipes_per_client)
+                with ThreadPoolExecutor(num_clients) as executor:
+                    start = time.perf_counter()
+                    latencies = list(executor.map(lambda seed: decode(target, int(seed)), seeds))
+                    elapsed = time.perf_counter() - start
+                results[(runtime, mode, num_clients)] = {
+                    'recipes_per_s': len(seeds) / elapsed,
+                    'p50_ms': np.percentile(latencies, 50) * 1000,
+                    'p95_ms': np.percentile(latencies, 95) * 1000,
+                }
+                print(f"{runtime:>12} {mode:>8} clients {num_clients:>4} : " + ", ".join(f"{key} {value:.2f}" for key, value in results[(runtime, mode, num_clients)].items()))
+        print(f"{runtime:>12} batches : {batcher.stats()}")
+    return results
+
+
+if __name__ == '__main__':
+    # python ModelRuntime.py convert best_model_earthy.h5 best_model_*.h5
+    # python ModelRuntime.py benchmark best_model_earthy.h5
+    # python ModelRuntime.py batching best_model_earthy.h5 --runtimes numpy keras
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['convert', 'benchmark', 'batching'])
+    parser.add_argument('model_paths', nargs='*', default=['best_model_earthy.h5'])
+    parser.add_argument('--runtimes', nargs='*', default=RUNTIMES)
+    parser.add_argument('--window_ms', type=float, default=3)
+    parser.add_argument('--max_batch_size', type=int, default=32)
+    args = parser.parse_args()
+    model_paths = [path for pattern in args.model_paths for path in sorted(glob.glob(pattern))]
+    if not model_paths:
+        sys.exit(f"no model found : {args.model_paths}")
+    for model_path in model_paths:
+        if args.command == 'convert':
+            convert_to_tflite(model_path)
+        elif args.command == 'batching':
+            benchmark_micro_batching(model_path, args.runtimes, window_ms=args.window_ms, max_batch_size=args.max_batch_size)
+        else:
+            benchmark(model_path, args.runtimes)
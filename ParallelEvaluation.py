@@ -0,0 +1,93 @@
+import io
+import os
+import json
+import time
+import argparse
+import contextlib
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from CocktailEmbeddingMaker import Eval
+from ModelRuntime import load_predictor, RUNTIMES
+
+# Eval.evaluate_model과 같은 평가를 여러 프로세스에서 나누어 실행합니다.
+# 각 worker는 시작할 때 데이터, Eval, 모델을 한 번만 불러오고, 받은 사용자들을 batch_size명씩 함께 디코딩합니다.
+# 사용자별 seed 재료는 (seed, 사용자 위치)로 정한 난수로 고르므로 evaluate_model(..., seed=seed)와 같은 지표가 나옵니다.
+#
+#     python ParallelEvaluation.py --users 1000 --workers 4 --compare
+
+worker_eval = None
+worker_model = None
+
+def load_eval():
+    with open('./train_data.json', 'r') as f:
+        json_data = json.load(f)
+    with open('./flavor.json', 'r') as f:
+        flavor_data = json.load(f)
+    with open('./category.json', 'r') as f:
+        category_data = json.load(f)
+    return Eval(json_data, flavor_data, category_data)
+
+def init_worker(runtime, model_path):
+    global worker_eval, worker_model
+    worker_eval = load_eval()
+    worker_model = load_predictor(runtime, model_path)
+
+def evaluate_chunk(start, users, seed, batch_size):
+    return worker_eval.evaluate_users(worker_model, users, seed, start, batch_size)
+
+def evaluate_model_parallel(users, model_path='best_model_earthy.h5', runtime='numpy', workers=None, batch_size=64, seed=0):
+    '''
+    users를 batch_size명씩 나누어 process pool에서 평가하고 (평가 지표, 맛 프로파일 목록, 초당 사용자 수)를 반환합니다.
+    초당 사용자 수는 worker 시작(모델 로딩) 시간을 포함합니다.
+    '''
+    workers = workers or os.cpu_count()
+    starts = list(range(0, len(users), batch_size))
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(runtime, model_path)) as executor:
+        chunks = executor.map(evaluate_chunk, starts, [users[start:start + batch_size] for start in starts], repeat(seed), repeat(batch_size))
+        evaluation_results = [result for chunk in chunks for result in chunk]
+    users_per_s = len(users) / (time.perf_counter() - start_time)
+    evaluation_metrics, recipe_profile_list = Eval.summarize_evaluation(evaluation_results)
+    return evaluation_metrics, recipe_profile_list, users_per_s
+
+def compare_serial(users, model_path='best_model_earthy.h5', runtime='numpy', workers=None, batch_size=64, seed=0):
+    '''
+    같은 사용자들에 대해 evaluate_model(한 명씩)과 evaluate_model_parallel의 지표와 초당 사용자 수를 비교합니다.
+    '''
+    start_time = time.perf_counter()
+    eval_obj = load_eval()
+    model = load_predictor(runtime, model_path)
+    # evaluate_model이 사용자마다 출력하는 레시피는 비교에 필요하지 않습니다.
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial_metrics, serial_profiles = eval_obj.evaluate_model(model, users, False, seed=seed)
+    serial_users_per_s = len(users) / (time.perf_counter() - start_time)
+
+    parallel_metrics, parallel_profiles, parallel_users_per_s = evaluate_model_parallel(users, model_path, runtime, workers, batch_size, seed)
+    identical = serial_metrics == parallel_metrics and serial_profiles == parallel_profiles
+    print(f"serial   : {serial_users_per_s:.1f} users/s, {serial_metrics}")
+    print(f"parallel : {parallel_users_per_s:.1f} users/s, {parallel_metrics}")
+    print(f"identical : {identical}")
+    return {'serial_users_per_s': serial_users_per_s, 'parallel_users_per_s': parallel_users_per_s, 'identical': identical}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', default='best_model_earthy.h5')
+    parser.add_argument('--runtime', choices=RUNTIMES, default='numpy')
+    parser.add_argument('--user_list', default=None, help='사용자 목록 JSON 파일 (없으면 --users명을 무작위로 만듭니다.)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', action='store_true', help='evaluate_model(한 명씩) 결과와 비교합니다.')
+    args = parser.parse_args()
+
+    if args.user_list:
+        with open(args.user_list, 'r') as f:
+            users = json.load(f)
+    else:
+        users = load_eval().generate_random_user_list(args.users, args.seed, save=False)
+    if args.compare:
+        compare_serial(users, args.model_path, args.runtime, args.workers, args.batch_size, args.seed)
+    else:
+        evaluation_metrics, _, users_per_s = evaluate_model_parallel(users, args.model_path, args.runtime, args.workers, args.batch_size, args.seed)
+        print(f"{users_per_s:.1f} users/s, {evaluation_metrics}")
@@ -0,0 +1,342 @@
+import math
+import sys
+import time
+import subprocess
+import numpy as np
+
+# npz로 저장할 때 사용하는 가중치 이름 (model.get_weights() 순서와 같습니다.)
+WEIGHT_NAMES = ['embedding',
+                'lstm_kernel', 'lstm_recurrent_kernel', 'lstm_bias',
+                'lstm_1_kernel', 'lstm_1_recurrent_kernel', 'lstm_1_bias',
+                'dense_kernel', 'dense_bias',
+                'dense_1_kernel', 'dense_1_bias']
+
+def sigmoid(x):
+    # 큰 음수 입력에서 exp가 inf가 되어도 결과는 0으로 올바르므로 경고만 숨깁니다.
+    with np.errstate(over='ignore'):
+        return 1 / (1 + np.exp(-x))
+
+def gelu(x):
+    # keras의 gelu(approximate=False)와 같은 정확한 erf 기반 gelu입니다.
+    erf = np.array([math.erf(v) for v in (x / math.sqrt(2)).ravel()], dtype=x.dtype).reshape(x.shape)
+    return 0.5 * x * (1 + erf)
+
+def softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+class LSTMWeights:
+    def __init__(self, kernel, recurrent_kernel, bias):
+        self.kernel = kernel
+        self.recurrent_kernel = recurrent_kernel
+        self.bias = bias
+        self.units = recurrent_kernel.shape[0]
+
+    def step(self, x, h, c):
+        # keras LSTMCell과 같은 게이트 순서(i, f, c, o)로 한 step을 계산합니다.
+        z = x @ self.kernel + h @ self.recurrent_kernel + self.bias
+        i, f, g, o = np.split(z, 4, axis=-1)
+        c = sigmoid(f) * c + sigmoid(i) * np.tanh(g)
+        h = sigmoid(o) * np.tanh(c)
+        return h, c
+
+
+class IncrementalRecipeDecoder:
+    '''
+    RecipeGenerationModel.build_model의 구조(Embedding -> LSTM -> LSTM -> Dense(gelu) -> Dense(softmax))를
+    학습된 가중치로 직접 계산하는 추론용 디코더입니다.
+    LSTM 상태를 step 사이에 유지하여, 새로 선택된 재료만 입력하면 다음 재료 확률을 얻을 수 있습니다.
+
+    embedding 행이 재료 수보다 하나 많으면 RecipeGenerationModel(masked=True)로 학습한 mask_zero 모델입니다.
+    이 모델은 재료 ID + 1을 입력하고(input_offset = 1) 0(패딩)인 step은 건너뜁니다.
+    '''
+    def __init__(self, weights, max_recipe_length=10):
+        weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        (self.embedding,
+         lstm_kernel, lstm_recurrent, lstm_bias,
+         lstm_1_kernel, lstm_1_recurrent, lstm_1_bias,
+         self.dense_kernel, self.dense_bias,
+         self.output_kernel, self.output_bias) = weights
+        self.lstm = LSTMWeights(lstm_kernel, lstm_recurrent, lstm_bias)
+        self.lstm_1 = LSTMWeights(lstm_1_kernel, lstm_1_recurrent, lstm_1_bias)
+        self.max_recipe_length = max_recipe_length
+        self.num_ingredients = self.output_bias.shape[0]
+        self.masked = self.embedding.shape[0] == self.num_ingredients + 1
+        self.input_offset = int(self.masked)
+        if not self.masked:
+            self.init_padding_states()
+
+    @classmethod
+    def from_keras_model(cls, model, max_recipe_length=10):
+        # model.get_weights()는 레이어 순서대로 embedding, lstm(kernel, recurrent_kernel, bias) x 2, dense x 2를 반환합니다.
+        return cls(model.get_weights(), max_recipe_length)
+
+    @classmethod
+    def load(cls, model_path, max_recipe_length=10):
+        # .npz는 numpy만으로 읽고, .h5는 keras 모델을 읽어 가중치를 가져옵니다.
+        if model_path.endswith('.npz'):
+            return cls.load_npz(model_path, max_recipe_length)
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_path)
+        return cls.from_keras_model(model, max_recipe_length)
+
+    @classmethod
+    def load_npz(cls, npz_path, max_recipe_length=10):
+        with np.load(npz_path) as data:
+            weights = [data[name] for name in WEIGHT_NAMES]
+        return cls(weights, max_recipe_length)
+
+    def weights(self):
+        return [self.embedding,
+                self.lstm.kernel, self.lstm.recurrent_kernel, self.lstm.bias,
+                self.lstm_1.kernel, self.lstm_1.recurrent_kernel, self.lstm_1.bias,
+                self.dense_kernel, self.dense_bias,
+                self.output_kernel, self.output_bias]
+
+    def save_npz(self, npz_path):
+        np.savez_compressed(npz_path, **dict(zip(WEIGHT_NAMES, self.weights())))
+
+    def zero_states(self, batch_size):
+        return [np.zeros((batch_size, self.lstm.units), dtype=np.float32), np.zeros((batch_size, self.lstm.units), dtype=np.float32),
+                np.zeros((batch_size, self.lstm_1.units), dtype=np.float32), np.zeros((batch_size, self.lstm_1.units), dtype=np.float32)]
+
+    def init_padding_states(self):
+        '''
+        pad_sequences는 레시피 앞쪽을 0(첫 번째 재료 ID)으로 채우고, 모델은 이 값도 그대로 입력으로 받습니다.
+        패딩 입력은 항상 같으므로 패딩 개수별 LSTM 상태를 미리 계산해 둡니다.
+        '''
+        h, c, h_1, c_1 = self.zero_states(1)
+        states = [(h, c, h_1, c_1)]
+        for _ in range(self.max_recipe_length):
+            h, c = self.lstm.step(self.embedding[[0]], h, c)
+            h_1, c_1 = self.lstm_1.step(h, h_1, c_1)
+            states.append((h, c, h_1, c_1))
+        self.padding_states = [np.concatenate(state, axis=0) for state in zip(*states)]
+
+    def step(self, ingredient_ids, h, c, h_1, c_1):
+        x = self.embedding[ingredient_ids]
+        h, c = self.lstm.step(x, h, c)
+        h_1, c_1 = self.lstm_1.step(h, h_1, c_1)
+        return h, c, h_1, c_1
+
+    def output(self, h_1):
+        hidden = gelu(h_1 @ self.dense_kernel + self.dense_bias)
+        return softmax(hidden @ self.output_kernel + self.output_bias)
+
+    def predict(self, sequences):
+        '''
+        keras model.predict와 같이 pad_sequences로 길이를 맞춘 (batch, max_recipe_length) 입력의 다음 재료 확률을 계산합니다.
+        mask_zero 모델은 pad_sequences(..., offset=input_offset) 입력을 받고, 모든 행이 패딩인 앞쪽 step은 계산하지 않습니다.
+        '''
+        sequences = np.asarray(sequences)
+        states = self.zero_states(sequences.shape[0])
+        first_step = 0
+        if self.masked:
+            columns = np.flatnonzero(sequences.any(axis=0))
+            first_step = columns[0] if len(columns) else sequences.shape[1]
+        for t in range(first_step, sequences.shape[1]):
+            next_states = self.step(sequences[:, t], *states)
+            if self.masked:
+                # keras의 mask와 같이 패딩 step에서는 이전 상태를 그대로 둡니다.
+                padding = (sequences[:, t] == 0)[:, None]
+                next_states = [np.where(padding, state, next_state) for state, next_state in zip(states, next_states)]
+            states = next_states
+        return self.output(states[2])
+
+    def start(self, sequence):
+        if self.masked:
+            return MaskedDecodingSession(self, sequence)
+        return DecodingSession(self, sequence)
+
+
+class DecodingSession:
+    '''
+    한 레시피를 생성하는 동안의 LSTM 상태를 보관합니다.
+
+    왼쪽 패딩 때문에 레시피 길이가 1 늘어날 때마다 앞쪽 패딩이 1개 줄어들어, 직전 step의 상태를 그대로 이어 쓸 수 없습니다.
+    그래서 앞으로 예측할 레시피 길이마다(= 패딩 개수마다) 하나씩 상태 트랙을 두고,
+    새 재료가 선택되면 남은 트랙 전체를 한 번의 batch cell 계산으로 갱신합니다.
+    각 길이에서의 확률은 패딩된 전체 시퀀스를 다시 계산한 결과와 같습니다.
+    '''
+    def __init__(self, decoder, sequence):
+        self.decoder = decoder
+        self.sequence = list(sequence)
+        max_recipe_length = decoder.max_recipe_length
+        # 현재 길이부터 max_recipe_length까지 각 길이에 필요한 패딩 개수
+        self.padding = np.arange(max_recipe_length - len(self.sequence), -1, -1)
+        self.states = None
+        if len(self.padding) > 0:
+            self.states = [state[self.padding] for state in decoder.padding_states]
+            for ingredient_id in self.sequence:
+                self.advance(ingredient_id)
+
+    def advance(self, ingredient_id):
+        ingredient_ids = np.full(len(self.padding), ingredient_id)
+        self.states = list(self.decoder.step(ingredient_ids, *self.states))
+
+    def next_probabilities(self):
+        if self.states is None:
+            # max_recipe_length보다 길어진 경우에는 pad_sequences처럼 마지막 max_recipe_length개만 사용합니다.
+            window = np.array([self.sequence[-self.decoder.max_recipe_length:]])
+            return self.decoder.predict(window)[0]
+        return self.decoder.output(self.states[2][:1])[0]
+
+    def feed(self, ingredient_id):
+        self.sequence.append(ingredient_id)
+        if self.states is None:
+            return
+        # 현재 길이에 해당하는 트랙은 더 이상 필요 없으므로 제거합니다.
+        self.padding = self.padding[1:]
+        if len(self.padding) == 0:
+            self.states = None
+            return
+        self.states = [state[1:] for state in self.states]
+        self.advance(ingredient_id)
+
+
+class MaskedDecodingSession:
+    '''
+    mask_zero 모델은 패딩을 입력받지 않으므로 직전 step의 상태를 그대로 이어 씁니다.
+    상태 트랙이 하나뿐이라 새 재료마다 LSTM step을 한 번만 계산하며, 비용은 max_recipe_length와 관계없습니다.
+    '''
+    def __init__(self, decoder, sequence):
+        self.decoder = decoder
+        self.sequence = []
+        self.states = decoder.zero_states(1)
+        for ingredient_id in sequence:
+            self.feed(ingredient_id)
+
+    def next_probabilities(self):
+        if len(self.sequence) > self.decoder.max_recipe_length:
+            # 학습과 같이 마지막 max_recipe_length개만 사용하므로 처음부터 다시 계산합니다.
+            window = pad_sequences([self.sequence], self.decoder.max_recipe_length, self.decoder.input_offset)
+            return self.decoder.predict(window)[0]
+        return self.decoder.output(self.states[2])[0]
+
+    def feed(self, ingredient_id):
+        self.sequence.append(ingredient_id)
+        if len(self.sequence) <= self.decoder.max_recipe_length:
+            self.states = list(self.decoder.step(np.array([ingredient_id + self.decoder.input_offset]), *self.states))
+
+
+def pad_sequences(sequences, maxlen, offset=0):
+    '''
+    tf.keras.preprocessing.sequence.pad_sequences의 기본 동작(앞쪽 0 패딩, 앞쪽 잘라내기, int32)과 같은 numpy 구현입니다.
+    offset은 재료 ID에 더할 값입니다. (mask_zero 모델은 1)
+    '''
+    padded = np.zeros((len(sequences), maxlen), dtype=np.int32)
+    for i, sequence in enumerate(sequences):
+        sequence = list(sequence)[-maxlen:]
+        if sequence:
+            padded[i, maxlen - len(sequence):] = np.asarray(sequence) + offset
+    return padded
+
+
+def masked_weights(weights):
+    # mask_zero 모델과 같은 형식(embedding 0번 행이 패딩)으로 가중치를 바꿉니다. (compare_layouts에서 step 비용 비교에 사용)
+    embedding = np.asarray(weights[0])
+    return [np.vstack([np.zeros((1, embedding.shape[1]), dtype=embedding.dtype), embedding])] + list(weights[1:])
+
+
+def export_model(model_path, npz_path):
+    # keras .h5 모델의 가중치를 tensorflow 없이 읽을 수 있는 .npz로 저장합니다.
+    decoder = IncrementalRecipeDecoder.load(model_path)
+    decoder.save_npz(npz_path)
+    print(f"{model_path} -> {npz_path}")
+
+
+def check_parity(model_path, npz_path, num_samples=200, max_recipe_length=10):
+    '''
+    무작위 레시피 prefix에 대해 keras 모델과 numpy 디코더의 다음 재료 확률을 비교합니다.
+    '''
+    import tensorflow as tf
+    model = tf.keras.models.load_model(model_path)
+    decoder = IncrementalRecipeDecoder.load_npz(npz_path, max_recipe_length)
+    rng = np.random.RandomState(0)
+    sequences = [rng.randint(0, decoder.num_ingredients, size=rng.randint(1, max_recipe_length + 1)) for _ in range(num_samples)]
+    padded = pad_sequences(sequences, max_recipe_length, decoder.input_offset)
+    keras_padded = tf.keras.preprocessing.sequence.pad_sequences([sequence + decoder.input_offset for sequence in sequences], maxlen=max_recipe_length)
+    assert np.array_equal(padded, keras_padded), "pad_sequences 결과가 keras와 다릅니다."
+
+    keras_probabilities = model.predict(padded, verbose=0)
+    numpy_probabilities = decoder.predict(padded)
+    session_probabilities = np.array([decoder.start(sequence).next_probabilities() for sequence in sequences])
+    max_diff = max(np.abs(keras_probabilities - numpy_probabilities).max(), np.abs(keras_probabilities - session_probabilities).max())
+    top1 = np.mean(np.argmax(keras_probabilities, axis=1) == np.argmax(session_probabilities, axis=1))
+    print(f"samples : {num_samples}, max abs diff : {max_diff:.3e}, top-1 agreement : {top1:.4f}")
+    return max_diff, top1
+
+
+def compare_layouts(npz_path, max_recipe_lengths=(10, 20, 40), num_recipes=200, recipe_length=6):
+    '''
+    같은 가중치로 앞쪽 패딩(고정 길이) 디코더와 mask_zero 디코더의 레시피 시작(start) 시간과 재료 1개당 step 시간을
+    max_recipe_length별로 비교합니다. 고정 길이 디코더는 남은 길이마다 상태 트랙을 두므로 max_recipe_length에 비례해 느려집니다.
+    '''
+    with np.load(npz_path) as data:
+        weights = [data[name] for name in WEIGHT_NAMES]
+    rng = np.random.RandomState(0)
+    recipes = [rng.randint(0, weights[-1].shape[0], size=recipe_length) for _ in range(num_recipes)]
+    results = {}
+    for max_recipe_length in max_recipe_lengths:
+        for layout, layout_weights in [('fixed', weights), ('masked', masked_weights(weights))]:
+            decoder = IncrementalRecipeDecoder(layout_weights, max_recipe_length)
+            start_latencies = []
+            step_latencies = []
+            for recipe in recipes:
+                start = time.perf_counter()
+                session = decoder.start(recipe[:1])
+                session.next_probabilities()
+                start_latencies.append(time.perf_counter() - start)
+                for ingredient_id in recipe[1:]:
+                    start = time.perf_counter()
+                    session.feed(ingredient_id)
+                    session.next_probabilities()
+                    step_latencies.append(time.perf_counter() - start)
+            results[(max_recipe_length, layout)] = {'start_p50_ms': np.percentile(start_latencies, 50) * 1000,
+                                                    'step_p50_ms': np.percentile(step_latencies, 50) * 1000}
+            print(f"max_recipe_length {max_recipe_length:>3} {layout:>6} : " + ", ".join(f"{key} {value:.4f}" for key, value in results[(max_recipe_length, layout)].items()))
+    return results
+
+
+STARTUP_SCRIPTS = {
+    'keras': "import tensorflow as tf; model = tf.keras.models.load_model({path!r}); model.predict(__import__('numpy').zeros((1, 10)), verbose=0)",
+    'numpy': "from RecipeDecoder import IncrementalRecipeDecoder; IncrementalRecipeDecoder.load_npz({path!r}).start([0]).next_probabilities()",
+}
+
+def compare_startup(model_path, npz_path):
+    '''
+    새 프로세스에서 모델을 불러와 첫 추론까지 걸리는 시간과 최대 RSS를 keras와 numpy 디코더에 대해 비교합니다.
+    '''
+    results = {}
+    for runtime, path in [('keras', model_path), ('numpy', npz_path)]:
+        script = STARTUP_SCRIPTS[runtime].format(path=path)
+        script += "; import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+        elapsed = time.perf_counter() - start
+        max_rss_mb = int(output.strip().splitlines()[-1]) / 1024
+        results[runtime] = {'cold_start_s': elapsed, 'max_rss_mb': max_rss_mb}
+        print(f"{runtime:>6} : cold start {elapsed:.2f}s, max RSS {max_rss_mb:.1f}MB")
+    return results
+
+
+if __name__ == '__main__':
+    # python RecipeDecoder.py export best_model_earthy.h5 best_model_earthy.npz
+    # python RecipeDecoder.py check best_model_earthy.h5 best_model_earthy.npz
+    # python RecipeDecoder.py startup best_model_earthy.h5 best_model_earthy.npz
+    # python RecipeDecoder.py layout best_model_earthy.h5 best_model_earthy.npz
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['export', 'check', 'startup', 'layout'])
+    parser.add_argument('model_path', nargs='?', default='best_model_earthy.h5')
+    parser.add_argument('npz_path', nargs='?', default='best_model_earthy.npz')
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_model(args.model_path, args.npz_path)
+    elif args.command == 'check':
+        check_parity(args.model_path, args.npz_path)
+    elif args.command == 'layout':
+        compare_layouts(args.npz_path)
+    else:
+        compare_startup(args.model_path, args.npz_path)
@@ -0,0 +1,140 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    프로세스 내부 LRU 캐시입니다. 최대 개수(max_size)와 유효 시간(ttl, 초)을 넘은 항목은 제거됩니다.
+    '''
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and item[1] <= time.monotonic():
+                del self.items[key]
+                self.evictions += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {'size': len(self.items), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class SQLiteCache:
+    '''
+    여러 worker 프로세스가 함께 쓰는 파일(SQLite) 캐시입니다. 값은 JSON으로 저장합니다.
+    '''
+    def __init__(self, path, max_size=10000, ttl=3600):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)')
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM cache WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+            self.connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', (key, json.dumps(value), now + self.ttl, now))
+            # 만료된 항목과 max_size를 넘는 오래된 항목을 제거합니다.
+            removed = self.connection.execute('DELETE FROM cache WHERE expires <= ?', (now,)).rowcount
+            size = self.connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            if size > self.max_size:
+                removed += self.connection.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)', (size - self.max_size,)).rowcount
+            self.connection.commit()
+            self.evictions += removed
+
+    def stats(self):
+        with self.lock:
+            size = self.connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return {'size': size, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class RecipeCache:
+    '''
+    /predict 결과 캐시입니다. 프로세스 내부 LRU를 먼저 확인하고, 없으면 공유 캐시(shared)를 확인합니다.
+    key는 seed와 16개 feature 값(과 Live Demo 레시피를 만든 소지 재료 목록의 key)으로 만듭니다.
+    step을 주면 feature를 step 단위로 반올림한 값을 key와 레시피 생성에 함께 사용합니다. (0이면 입력 그대로)
+    '''
+    def __init__(self, step=0, max_size=1024, ttl=3600, shared=None):
+        self.step = step
+        self.local = LRUCache(max_size, ttl)
+        self.shared = shared
+
+    def quantize(self, user_profile):
+        if not self.step:
+            return dict(user_profile)
+        quantized = {}
+        for feature, value in user_profile.items():
+            rounded = round(round(value / self.step) * self.step, 6)
+            # ABV가 0보다 크면 무알콜(0)로 바뀌지 않도록 합니다.
+            if feature == 'ABV' and value > 0 and rounded <= 0:
+                rounded = self.step
+            quantized[feature] = rounded
+        return quantized
+
+    def make_key(self, seed, quantized_profile, inventory_key=None):
+        key = [seed] + [quantized_profile[feature] for feature in sorted(quantized_profile)]
+        if inventory_key is not None:
+            key.append(inventory_key)
+        return json.dumps(key)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def stats(self):
+        stats = {'local': self.local.stats()}
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+        return stats
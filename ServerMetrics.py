@@ -0,0 +1,140 @@
+import os
+import time
+import bisect
+import resource
+import threading
+from contextlib import contextmanager
+
+# fastapi_srv의 /metrics에서 사용하는 Prometheus text format(0.0.4) 지표입니다.
+# 외부 패키지 없이 Counter, Histogram과 scrape 시점에 값을 읽는 Gauge만 구현합니다.
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STEP_BUCKETS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for labelvalues, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.labelnames, labelvalues)} {format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label 값별로 [bucket별 개수, 합계, 전체 개수]를 저장합니다. bucket별 개수는 expose할 때 누적합니다.
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labelvalues)
+            if state is None:
+                state = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for labelvalues, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    labels = format_labels(self.labelnames, labelvalues, [('le', format_value(bound))])
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = format_labels(self.labelnames, labelvalues)
+                lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge:
+    '''
+    scrape 시점에 callback을 호출해 값을 읽습니다. callback은 숫자 또는 {label 값 tuple: 숫자} dict를 반환합니다.
+    '''
+    def __init__(self, name, documentation, callback, labelnames=(), metric_type='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.metric_type = metric_type
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f'{self.name}{format_labels(self.labelnames, labelvalues)} {format_value(value)}')
+        return lines
+
+
+def process_rss_bytes():
+    # 현재 RSS는 /proc에서 읽고, /proc이 없으면(macOS 등) 최대 RSS를 사용합니다.
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ServerMetrics:
+    '''
+    /predict 처리 단계별 시간(seed 선택, 모델 step, 재점수화, 재료 양 조정, 재료 대체, Live Demo 재료 양 조정),
+    레시피당 step 수, 요청 수/지연 시간과 scrape 시점의 Gauge를 모아 Prometheus text format으로 반환합니다.
+    '''
+    def __init__(self, namespace='feelflask'):
+        self.namespace = namespace
+        self.stage_seconds = Histogram(f'{namespace}_stage_seconds', 'Time spent in each recipe generation stage.', ['stage'])
+        self.recipe_steps = Histogram(f'{namespace}_recipe_steps', 'Decoding steps (model forward passes) per generated recipe.', buckets=STEP_BUCKETS)
+        self.request_seconds = Histogram(f'{namespace}_request_seconds', 'HTTP request latency.', ['endpoint'])
+        self.requests_total = Counter(f'{namespace}_requests_total', 'HTTP requests by endpoint and status code.', ['endpoint', 'status'])
+        self.metrics = [self.stage_seconds, self.recipe_steps, self.request_seconds, self.requests_total,
+                        Gauge('process_resident_memory_bytes', 'Resident memory size in bytes.', process_rss_bytes)]
+
+    def add_gauge(self, name, documentation, callback, labelnames=(), metric_type='gauge'):
+        self.metrics.append(Gauge(f'{self.namespace}_{name}', documentation, callback, labelnames, metric_type))
+
+    @contextmanager
+    def stage_timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - start, stage)
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
@@ -486,10 +486,13 @@ class Eval(CocktailEmbeddingMaker):
         while total_prob < max_prob_sum:
             try:
                 sequence = [self.ingredient_ids[self.normalize_string(ingredient)] for ingredient in generated_recipe]
+                # RecipeGenerationModel(masked=True)로 학습한 모델은 패딩 없이 ID + 1을 입력합니다.
+                masked_input = np.array([[ingredient_id + 1 for ingredient_id in sequence[-self.max_recipe_length:]]])
                 sequence = tf.keras.preprocessing.sequence.pad_sequences([sequence], maxlen=self.max_recipe_length)
+                model_input = masked_input if getattr(self.model.layers[0], 'mask_zero', False) else sequence
             except Exception as e:
                 print(f"generated_recipe : {generated_recipe}")
-            probabilities = self.model.predict(sequence)[0]
+            probabilities = self.model.predict(model_input)[0]
             probabilities[sequence[0]] = 0  # 중복 재료 제거
             
             # 사용자 선호도를 반영하여 재료 선택 확률 조정
@@ -3,6 +3,7 @@ import numpy as np
 import tensorflow as tf
 import random
 import json
+import time
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense, Embedding
 from CocktailEmbeddingMaker import CocktailEmbeddingMaker
@@ -10,17 +11,23 @@ from CocktailEmbeddingMaker import Eval
 import wandb
 class RecipeGenerationModel:
     #RecipeGenerationModel(cocktail_embedding_maker, wandb_flag=True, max_recipe_length=10)
-    def __init__(self, cocktail_embedding_maker,eval_obj,json_data,flavor_data,category_data,wandb_Flag=False, max_recipe_length=10):
+    # masked=True이면 재료 ID를 1씩 밀어 0은 패딩으로만 사용하고(mask_zero), 길이가 비슷한 prefix끼리 batch를 만들어 학습합니다.
+    # masked=False는 이전과 같이 모든 prefix를 max_recipe_length로 앞쪽 패딩합니다. (패딩과 0번 재료가 같은 입력)
+    def __init__(self, cocktail_embedding_maker,eval_obj,json_data,flavor_data,category_data,wandb_Flag=False, max_recipe_length=10, masked=True):
         self.cocktail_embedding_maker = cocktail_embedding_maker
         self.ingredient_ids = cocktail_embedding_maker.ingredient_ids
         self.num_ingredients = cocktail_embedding_maker.num_ingredients
         self.max_recipe_length = max_recipe_length
+        self.masked = masked
         self.ingredient_embedding_matrix = cocktail_embedding_maker.create_ingredient_embedding_matrix()
         self.sweep_config = None
         self.evaluation_metrics=None
         self.sweep_id = None
         self.wandb = wandb_Flag
         self.aug = True
+        self.augmentation = True
+        # 학습 pair를 섞는 tf.data shuffle buffer 크기 (레시피 순서는 epoch마다 전체를 섞습니다.)
+        self.shuffle_buffer = 4096
         self.total_amount = 200
         self.Eval = eval_obj
         self.attributes = ['ABV', 'boozy', 'sweet', 'sour', 'bitter', 'umami', 'salty', 'astringent', 'Perceived_temperature', 'spicy', 'herbal', 'floral', 'fruity', 'nutty', 'creamy', 'smoky']
@@ -41,16 +48,23 @@ class RecipeGenerationModel:
             hidden_units = wandb.config.get('hidden_units', 128)
             optimizer =  wandb.config.get('optimizer', 'adam')
         
+        if self.masked:
+            # 0번 행은 패딩이며 LSTM은 mask된 step을 건너뜁니다. 입력 길이는 batch마다 다를 수 있습니다.
+            embedding_matrix = np.vstack([np.zeros((1, self.ingredient_embedding_matrix.shape[1])), self.ingredient_embedding_matrix])
+            embedding = Embedding(self.num_ingredients + 1, embedding_matrix.shape[1],
+                                  weights=[embedding_matrix], mask_zero=True, trainable=False)
+        else:
+            embedding = Embedding(self.num_ingredients, self.ingredient_embedding_matrix.shape[1],
+                                  weights=[self.ingredient_embedding_matrix], input_length=self.max_recipe_length, trainable=False)
         model = Sequential([
-            Embedding(self.num_ingredients, self.ingredient_embedding_matrix.shape[1],
-                      weights=[self.ingredient_embedding_matrix], input_length=self.max_recipe_length, trainable=False),
+            embedding,
             LSTM(hidden_units, return_sequences=True),
             LSTM(hidden_units),
             Dense(64, activation='gelu'),
             Dense(self.num_ingredients, activation='softmax')
         ])
         
-        model.compile(loss='categorical_crossentropy', optimizer=optimizer,metrics=['accuracy'])
+        model.compile(loss='sparse_categorical_crossentropy', optimizer=optimizer,metrics=['accuracy'])
         return model
     def augment_recipes(self,recipes, augmentation_factor=2):
         augmented_recipes = []
@@ -67,9 +81,73 @@ class RecipeGenerationModel:
         
         return augmented_recipes
     
+    def encode_recipe(self, recipe):
+        return [self.ingredient_ids[self.cocktail_embedding_maker.normalize_string(ingredient)] for ingredient in recipe]
+
+    def pad_prefix(self, prefix):
+        # max_recipe_length보다 길면 앞쪽을 자릅니다.
+        prefix = prefix[-self.max_recipe_length:]
+        padding = [0] * (self.max_recipe_length - len(prefix))
+        if self.masked:
+            # masked 모델은 ID + 1을 입력합니다. 뒤쪽 패딩은 make_dataset에서 제거하고 batch마다 다시 채웁니다.
+            return [ingredient_id + 1 for ingredient_id in prefix] + padding
+        # pad_sequences와 같이 앞쪽을 0으로 채웁니다.
+        return padding + prefix
+
+    def bucket_boundaries(self):
+        # prefix 길이 8까지는 길이마다, 그 뒤로는 두 배씩 bucket을 나눕니다. (max_recipe_length를 늘려도 bucket은 조금만 늘어납니다.)
+        boundaries = [length for length in range(2, 9) if length <= self.max_recipe_length]
+        while boundaries[-1] < self.max_recipe_length:
+            boundaries.append(boundaries[-1] * 2)
+        return boundaries
+
+    def iterate_training_pairs(self, recipes, augmentation_factor=2):
+        '''
+        레시피마다 (앞부분 재료 sequence 배열, 다음 재료 id 배열) 학습 pair를 만듭니다.
+        augment_recipes와 같이 원본과 augmentation_factor개의 섞은 레시피를 사용하지만, 복사본을 미리 만들지 않고 호출할 때(epoch)마다 새로 섞습니다.
+        '''
+        order = list(range(len(recipes)))
+        random.shuffle(order)
+        for index in order:
+            sequence = self.encode_recipe(recipes[index])
+            variants = [sequence] + [random.sample(sequence, len(sequence)) for _ in range(augmentation_factor)]
+            prefixes = []
+            next_ingredients = []
+            for variant in variants:
+                for i in range(1, len(variant)):
+                    prefixes.append(self.pad_prefix(variant[:i]))
+                    next_ingredients.append(variant[i])
+            if prefixes:
+                yield np.array(prefixes, dtype=np.int32), np.array(next_ingredients, dtype=np.int32)
+
+    def make_dataset(self, recipes, batch_size=32, augmentation=True):
+        '''
+        학습 pair를 필요할 때 만드는 tf.data pipeline입니다. 다음 재료는 one-hot 대신 정수 id로 두고 sparse categorical cross-entropy로 학습합니다.
+        메모리는 레시피 수와 관계없이 shuffle buffer와 prefetch된 batch 크기만큼만 사용합니다.
+        '''
+        augmentation_factor = 2 if augmentation else 0
+        # generator는 레시피 단위로 넘기고(Python 호출 횟수를 줄임) unbatch로 pair 단위로 나눕니다.
+        dataset = tf.data.Dataset.from_generator(
+            lambda: self.iterate_training_pairs(recipes, augmentation_factor),
+            output_signature=(tf.TensorSpec(shape=(None, self.max_recipe_length), dtype=tf.int32),
+                              tf.TensorSpec(shape=(None,), dtype=tf.int32)))
+        dataset = dataset.unbatch().shuffle(self.shuffle_buffer)
+        if not self.masked:
+            return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+        # 패딩을 제거하고 길이가 비슷한 prefix끼리 batch를 만들어, LSTM은 batch에서 가장 긴 prefix 길이만큼만 실행됩니다.
+        dataset = dataset.map(lambda prefix, next_ingredient: (prefix[:tf.math.count_nonzero(prefix, dtype=tf.int32)], next_ingredient))
+        boundaries = self.bucket_boundaries()
+        dataset = dataset.bucket_by_sequence_length(lambda prefix, next_ingredient: tf.shape(prefix)[0],
+                                                    boundaries, [batch_size] * (len(boundaries) + 1))
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    def model_input(self, prefix):
+        # 추론 입력 (batch 1). masked 모델은 패딩 없이 실제 길이만큼만 입력합니다.
+        if self.masked:
+            return np.array([[ingredient_id + 1 for ingredient_id in prefix[-self.max_recipe_length:]]], dtype=np.int32)
+        return np.array([self.pad_prefix(prefix)], dtype=np.int32)
+
     def train(self, recipes,test_user_list,perEpoch= True, epochs=50, batch_size=32,learning_rate=0.001):
-        ingredient_sequences = []
-        next_ingredients = []
         if self.wandb:
             # wandb 초기화
             wandb.init(project='cocktail_recipe_generation_v3_random_seed')
@@ -79,23 +157,14 @@ class RecipeGenerationModel:
             optimizer = wandb.config.get('optimizer', 'adam')
             self.augmentation = wandb.config.get('augmentation', True)
 
-        if self.augmentation:
-            recipes = self.augment_recipes(recipes)
-        for recipe in recipes:
-            sequence = [self.ingredient_ids[self.cocktail_embedding_maker.normalize_string(ingredient)] for ingredient in recipe]
-            for i in range(1, len(sequence)):
-                ingredient_sequences.append(sequence[:i])
-                next_ingredients.append(sequence[i])
-
-        ingredient_sequences = tf.keras.preprocessing.sequence.pad_sequences(ingredient_sequences, maxlen=self.max_recipe_length)
-        next_ingredients = tf.keras.utils.to_categorical(next_ingredients, num_classes=self.num_ingredients)
-        
+        # 레시피는 epoch마다 다시 읽으므로 list로 받아 둡니다. (dict_keys 등)
+        recipes = [list(recipe) for recipe in recipes]
+        dataset = self.make_dataset(recipes, batch_size, self.augmentation)
 
-            
         self.model = self.build_model()
         if perEpoch:
             for epoch in range(epochs):
-                history = self.model.fit(ingredient_sequences, next_ingredients, epochs=1, batch_size=batch_size, verbose=0)
+                history = self.model.fit(dataset, epochs=1, verbose=0)
                 loss = history.history['loss'][0]
                 accuracy = history.history['accuracy'][0]
 
@@ -108,7 +177,7 @@ class RecipeGenerationModel:
                             'accuracy': accuracy,
                         })
         else:
-            history = self.model.fit(ingredient_sequences, next_ingredients, epochs=epochs, batch_size=batch_size, verbose=0)
+            history = self.model.fit(dataset, epochs=epochs, verbose=0)
             loss = history.history['loss'][0]
             accuracy = history.history['accuracy'][0]
             if self.wandb:
@@ -158,9 +227,52 @@ class RecipeGenerationModel:
         return loss, accuracy, performance
 
 
+def compare_layouts(cocktail_embedding_maker, eval_obj, json_data, flavor_data, category_data, recipes,
+                    max_recipe_lengths=(10, 30), epochs=3, batch_size=32, prefix_lengths=(1, 2, 3, 4, 5), repeat=50):
+    '''
+    고정 길이(앞쪽 패딩)와 길이별 bucket + masking을 max_recipe_length별로 비교합니다.
+    epoch 시간(첫 epoch은 graph 생성 시간이 포함되므로 제외한 평균)과 prefix 길이별 추론 1회(model 호출) 시간을 측정합니다.
+    '''
+    recipes = [list(recipe) for recipe in recipes]
+    results = {}
+    for max_recipe_length in max_recipe_lengths:
+        for masked in (False, True):
+            recipe_generation_model = RecipeGenerationModel(cocktail_embedding_maker, eval_obj, json_data, flavor_data, category_data,
+                                                            False, max_recipe_length=max_recipe_length, masked=masked)
+            model = recipe_generation_model.build_model()
+            dataset = recipe_generation_model.make_dataset(recipes, batch_size, recipe_generation_model.augmentation)
+            epoch_seconds = []
+            for _ in range(epochs):
+                start = time.perf_counter()
+                model.fit(dataset, epochs=1, verbose=0)
+                epoch_seconds.append(time.perf_counter() - start)
+
+            step_ms = {}
+            for prefix_length in prefix_lengths:
+                model_input = recipe_generation_model.model_input(list(range(prefix_length)))
+                model(model_input, training=False)
+                latencies = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    model(model_input, training=False)
+                    latencies.append(time.perf_counter() - start)
+                step_ms[prefix_length] = float(np.median(latencies) * 1000)
+
+            layout = 'bucketed' if masked else 'fixed'
+            results[(max_recipe_length, layout)] = {'epoch_s': float(np.mean(epoch_seconds[1:] or epoch_seconds)), 'step_ms': step_ms}
+            print(f"max_recipe_length {max_recipe_length:>3} {layout:>8} : epoch {results[(max_recipe_length, layout)]['epoch_s']:.2f}s, "
+                  + ", ".join(f"prefix {length} {ms:.2f}ms" for length, ms in step_ms.items()))
+    return results
+
+
 if __name__ == '__main__':
     import sys 
     import os 
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--compare', action='store_true', help='고정 길이와 bucket + masking의 학습/추론 시간을 비교합니다.')
+    parser.add_argument('--max_recipe_lengths', type=int, nargs='*', default=[10, 30])
+    args = parser.parse_args()
     # os.chdir('G:\내 드라이브\DOC\Lecture\DataEng\FeelFlask\backend\data_works')
     # sys.path.append('G:\내 드라이브\DOC\Lecture\DataEng\FeelFlask\backend\data_works')
     # sys.path.append('G:\내 드라이브\DOC\Lecture\DataEng\FeelFlask\backend')
@@ -172,12 +284,16 @@ if __name__ == '__main__':
         category_data = json.load(f)
     cocktail_embedding_maker = CocktailEmbeddingMaker(json_data, flavor_data,category_data)
     eval_obj = Eval(json_data,flavor_data,category_data)
+    # 학습 데이터 준비
+    train_recipes = [recipe['recipe'].keys() for recipe in json_data['cocktail_info']]
+    if args.compare:
+        compare_layouts(cocktail_embedding_maker, eval_obj, json_data, flavor_data, category_data, train_recipes, args.max_recipe_lengths)
+        sys.exit(0)
+
     # RecipeGenerationModel 인스턴스 생성
     recipe_generation_model = RecipeGenerationModel(cocktail_embedding_maker,eval_obj,json_data,flavor_data,category_data
                                                     , False, max_recipe_length=10)
     test_user_list = eval_obj.generate_random_user_list(5)
-    # 학습 데이터 준비
-    train_recipes = [recipe['recipe'].keys() for recipe in json_data['cocktail_info']]
 
     # 모델 학습
     loss, accuracy, performance = recipe_generation_model.train(train_recipes,test_user_list)
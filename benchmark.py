@@ -0,0 +1,205 @@
+import gc
+import os
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import argparse
+import tracemalloc
+import numpy as np
+import fastapi_srv
+from CocktailEmbeddingMaker import CocktailEmbeddingMaker, Eval, RecipeContext
+from ModelRuntime import load_predictor
+
+# 추천 엔진의 주요 함수를 서버 없이 같은 입력(고정 seed의 사용자 목록 + user_list_v1_5.json)으로 측정합니다.
+# 함수별로 지연 시간(p50/p95/p99), 초당 실행 수, 실행 중 최대 메모리 사용량(tracemalloc)을 JSON으로 저장하고,
+# 기준 결과(baseline)보다 threshold 비율 이상 나빠진 항목이 있으면 종료 코드 1을 반환합니다.
+# p95/p99는 p50보다 흔들림이 크므로 별도의 tail_threshold를 사용합니다.
+# 지연 시간은 실행한 기계에 따라 다르므로 baseline은 비교할 기계에서 --record-baseline으로 저장합니다.
+# baseline을 저장한 환경(기계, CPU 수, Python/NumPy 버전)이 현재와 다르면 경고를 출력합니다.
+#
+#     python benchmark.py --record-baseline
+#     python benchmark.py --output benchmark_results.json
+#     python benchmark.py --baseline benchmark_baseline.json --threshold 0.25 --tail_threshold 0.5
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+# 값이 클수록 나쁜 지표와 작을수록 나쁜 지표
+HIGHER_IS_WORSE = ['p50_ms', 'peak_memory_kb']
+LOWER_IS_WORSE = ['ops_per_s']
+# 값이 클수록 나쁘고 tail_threshold로 비교하는 지표
+TAIL_METRICS = ['p95_ms', 'p99_ms']
+# baseline과 값이 다르면 결과를 비교할 수 없다고 경고하는 환경 항목
+ENVIRONMENT_KEYS = ['machine', 'processor', 'cpu_count', 'python', 'numpy']
+
+def load_data():
+    with open('./train_data.json', 'r') as f:
+        json_data = json.load(f)
+    with open('./flavor.json', 'r') as f:
+        flavor_data = json.load(f)
+    with open('./category.json', 'r') as f:
+        category_data = json.load(f)
+    return json_data, flavor_data, category_data
+
+def load_corpus(eval_obj, num_users, seed):
+    users = eval_obj.generate_random_user_list(num_users, seed, save=False)
+    with open('./user_list_v1_5.json', 'r') as f:
+        users += json.load(f)
+    return users
+
+def user_features(user, seed_ingredient):
+    # 사용자 선호도를 /filter 요청 형식으로 바꿉니다.
+    features = {feature: user.get(feature, 0) for feature in ['ABV', 'sweet', 'sour', 'bitter', 'spicy', 'herbal', 'floral', 'fruity',
+                                                               'nutty', 'boozy', 'astringent', 'umami', 'salty', 'creamy', 'smoky']}
+    features['perceived_t'] = user['Perceived_temperature']
+    features['seed'] = seed_ingredient
+    return fastapi_srv.Features(**features)
+
+def measure(operation, inputs, repeat=5, warmup=3):
+    '''
+    inputs 전체를 repeat번 실행하고, timeit처럼 가장 빠른 회차의 값을 사용합니다. (다른 프로세스의 영향을 가장 적게 받은 값)
+    측정하는 동안에는 timeit과 같이 garbage collection을 끕니다.
+    '''
+    for item in inputs[:warmup]:
+        operation(item)
+    rounds = []
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    for _ in range(repeat):
+        latencies = []
+        start = time.perf_counter()
+        for item in inputs:
+            operation_start = time.perf_counter()
+            operation(item)
+            latencies.append(time.perf_counter() - operation_start)
+        rounds.append((time.perf_counter() - start, np.array(latencies) * 1000))
+    if gc_enabled:
+        gc.enable()
+    elapsed, latencies = min(rounds, key=lambda round_result: round_result[0])
+
+    # tracemalloc은 실행을 느리게 하므로 메모리는 별도로 한 번 더 실행해 측정합니다.
+    tracemalloc.start()
+    for item in inputs:
+        operation(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'ops': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'mean_ms': float(latencies.mean()),
+            'ops_per_s': len(latencies) / elapsed,
+            'peak_memory_kb': peak / 1024}
+
+def run_benchmarks(num_users=200, seed=0, repeat=5, only=None):
+    json_data, flavor_data, category_data = load_data()
+    eval_obj = Eval(json_data, flavor_data, category_data)
+    model = load_predictor('numpy', 'best_model_earthy.h5')
+    users = load_corpus(eval_obj, num_users, seed)
+    # 뒤 단계의 입력(seed 재료, 레시피)은 측정 전에 한 번만 만들어 둡니다.
+    seed_ingredients = [eval_obj.select_user_seed(user, eval_obj.evaluation_context(seed, i)) for i, user in enumerate(users)]
+    recipes = [eval_obj.generate_recipe(model, seed_ingredient, user)
+               for seed_ingredient, user in zip(seed_ingredients, users)]
+    live_bar = fastapi_srv.live_bar_ingredient_list
+
+    def filter_operation(features):
+        return fastapi_srv.filter_ingredients(fastapi_srv.FilterRequest(features=features, selected_ingredient='', selected_index=-1))
+
+    benchmarks = {
+        'cocktail_embedding_maker_init': (lambda _: CocktailEmbeddingMaker(json_data, flavor_data, category_data), list(range(100))),
+        'select_user_seed': (lambda item: eval_obj.select_user_seed(item[1], eval_obj.evaluation_context(seed, item[0])), list(enumerate(users))),
+        'generate_recipe': (lambda item: eval_obj.generate_recipe(model, item[0], item[1]), list(zip(seed_ingredients, users))),
+        'adjust_ingredient_quantities_heuristic': (lambda item: eval_obj.adjust_ingredient_quantities(item[0][0], item[1]['ABV'], item[1], method='heuristic'),
+                                                   list(zip(recipes, users))),
+        'adjust_ingredient_quantities_solver': (lambda item: eval_obj.adjust_ingredient_quantities(item[0][0], item[1]['ABV'], item[1], method='solver'),
+                                                list(zip(recipes, users))),
+        'find_similar_ingredients': (lambda item: eval_obj.find_similar_ingredients(item[1][0], live_bar, item[2], RecipeContext(live_bar, rng=random.Random(item[0]))),
+                                     [(i, recipe, user) for i, (recipe, user) in enumerate(zip(recipes, users))]),
+        'filter_scoring': (filter_operation, [user_features(user, seed_ingredient) for user, seed_ingredient in zip(users, seed_ingredients)]),
+        'evaluate_similarity': (eval_obj.evaluate_similarity, recipes),
+    }
+    if only:
+        benchmarks = {name: benchmark for name, benchmark in benchmarks.items() if name in only}
+    if 'filter_scoring' in benchmarks:
+        # /filter는 fastapi_srv의 재료 테이블을 사용하므로 서버와 같은 방법으로 엔진을 불러옵니다.
+        fastapi_srv.load_engine()
+
+    results = {}
+    for name, (operation, inputs) in benchmarks.items():
+        random.seed(seed)
+        np.random.seed(seed)
+        results[name] = measure(operation, inputs, repeat)
+        print(f"{name:<40} p50 {results[name]['p50_ms']:8.3f}ms  p95 {results[name]['p95_ms']:8.3f}ms  "
+              f"p99 {results[name]['p99_ms']:8.3f}ms  {results[name]['ops_per_s']:10.1f} ops/s  peak {results[name]['peak_memory_kb']:9.1f}KB")
+    return {'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                            'machine': platform.machine(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+                            'users': len(users), 'seed': seed, 'repeat': repeat,
+                            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024},
+            'benchmarks': results}
+
+def environment_mismatches(results, baseline):
+    # baseline을 저장한 환경과 값이 다른 (항목, baseline 값, 현재 값) 목록
+    previous = baseline.get('environment', {})
+    current = results['environment']
+    return [(key, previous.get(key), current.get(key)) for key in ENVIRONMENT_KEYS if previous.get(key) != current.get(key)]
+
+def compare_to_baseline(results, baseline, threshold=0.25, tail_threshold=0.5):
+    '''
+    baseline보다 threshold(p95/p99는 tail_threshold) 비율 이상 나빠진 (benchmark, 지표, baseline 값, 현재 값) 목록을 반환합니다.
+    '''
+    for key, previous, current in environment_mismatches(results, baseline):
+        print(f"WARNING baseline environment differs, {key} : {previous} -> {current} (re-record with --record-baseline)")
+    regressions = []
+    for name, current in results['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if previous is None:
+            continue
+        for metric in HIGHER_IS_WORSE:
+            if previous[metric] > 0 and current[metric] > previous[metric] * (1 + threshold):
+                regressions.append((name, metric, previous[metric], current[metric]))
+        for metric in TAIL_METRICS:
+            if metric in previous and previous[metric] > 0 and current[metric] > previous[metric] * (1 + tail_threshold):
+                regressions.append((name, metric, previous[metric], current[metric]))
+        for metric in LOWER_IS_WORSE:
+            if current[metric] < previous[metric] * (1 - threshold):
+                regressions.append((name, metric, previous[metric], current[metric]))
+    for name, metric, previous, current in regressions:
+        print(f"REGRESSION {name} {metric} : {previous:.3f} -> {current:.3f}")
+    print(f"{len(regressions)} regressions (threshold {threshold:.0%}, tail threshold {tail_threshold:.0%})")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200, help='generate_random_user_list로 만들 사용자 수 (user_list_v1_5.json에 더해집니다.)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='*', default=None)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help=f'비교할 결과 파일 (기본 {DEFAULT_BASELINE}, 없으면 비교하지 않습니다.)')
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--tail_threshold', type=float, default=0.5, help='p95_ms, p99_ms에 사용할 threshold')
+    parser.add_argument('--record-baseline', action='store_true', help='비교하지 않고 결과를 baseline 파일로 저장합니다.')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.users, args.seed, args.repeat, args.only)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline_path = args.baseline or DEFAULT_BASELINE
+    if args.record_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved : {baseline_path}")
+        sys.exit(0)
+    try:
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        if args.baseline:
+            raise
+        print(f"no baseline ({baseline_path}), run with --record-baseline on this machine first")
+        sys.exit(0)
+    sys.exit(1 if compare_to_baseline(results, baseline, args.threshold, args.tail_threshold) else 0)
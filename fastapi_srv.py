@@ -1,33 +1,258 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 import numpy as np
-import tensorflow as tf
 import json
-from CocktailEmbeddingMaker import Eval
-from typing import List, Dict
-import sys
-import traceback
+from CocktailEmbeddingMaker import Eval, RecipeContext, NO_TIMER, no_stage_timer
+from ModelRuntime import load_predictor, PrefixCachedPredictor, MicroBatchPredictor
+from ResultCache import RecipeCache, SQLiteCache
+from InventoryRegistry import InventoryRegistry, InventoryLimitError
+from ServerMetrics import ServerMetrics
+from AppLogging import get_logger, new_request_id, request_id_var
+from typing import List, Dict, Optional
+import os
+import time
+import asyncio
+import contextvars
 import random
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 
-app = FastAPI()
+logger = get_logger('server')
 
-# model = tf.keras.models.load_model('testmodel.h5')
-model = tf.keras.models.load_model('best_model_earthy.h5')
-
-with open('./train_data.json', 'r') as f:
-    json_data = json.load(f)
+# 서버 시작 과정 : 데이터, 모델, Eval을 불러온 뒤(load_engine) warm-up 레시피를 생성합니다(warm_up_engine).
+# 이 과정은 서버가 요청을 받기 시작한 뒤 별도 thread에서 실행되므로 /healthz는 바로 응답하고,
+# /readyz와 레시피 요청은 warm-up이 끝날 때까지 503을 반환합니다.
+@asynccontextmanager
+async def lifespan(app):
+    startup = asyncio.get_running_loop().run_in_executor(None, start_engine)
+    yield
+    await asyncio.wait([startup], timeout=5)
 
-with open('./flavor.json', 'r') as f:
-    flavor_data = json.load(f)
-    
-with open('./ingredients_description.json', 'r') as f:
-    ingredients_description = json.load(f)
+app = FastAPI(lifespan=lifespan)
 
-with open('./category.json', 'r') as f:
-    category_data = json.load(f)
+# model = tf.keras.models.load_model('testmodel.h5')
+# 모델 런타임 : numpy(기본, tensorflow 불필요), keras, tflite, tflite_int8 (ModelRuntime.py 참고)
+# numpy 디코더는 LSTM 상태를 유지하며 새 재료만 입력합니다.
+model_runtime = os.environ.get('MODEL_RUNTIME', 'numpy')
+# MICRO_BATCH_WINDOW_MS를 주면 동시에 처리 중인 요청들의 다음 재료 예측을 window(ms) 동안 또는
+# MICRO_BATCH_SIZE개까지 모아 한 번에 실행합니다. (0이면 기다리지 않고 이미 들어온 입력만 모읍니다.)
+# 한 번에 한 행씩 실행하는 tflite 런타임에서는 효과가 없습니다.
+micro_batch_window_ms = os.environ.get('MICRO_BATCH_WINDOW_MS')
+# prefix별 다음 재료 확률 캐시 (PREFIX_CACHE_SIZE=0이면 사용하지 않습니다.)
+prefix_cache_size = int(os.environ.get('PREFIX_CACHE_SIZE', 10000))
+# warm-up으로 생성할 레시피 수 (알콜/무알콜 profile을 번갈아 사용, 0이면 warm-up을 하지 않습니다.)
+# WARMUP_PROFILES에 /predict 입력 형식의 profile 목록(JSON 파일)을 주면 그 profile들을 사용합니다.
+warmup_decodes = int(os.environ.get('WARMUP_DECODES', 8))
+warmup_profiles_path = os.environ.get('WARMUP_PROFILES')
+# PUT /inventories로 등록할 수 있는 소지 재료 목록 수(MAX_INVENTORIES, 기본 목록 포함)와 목록 하나의 재료 수(MAX_INVENTORY_INGREDIENTS)
+# 목록 하나는 약 (전체 재료 수 x 16 x 재료 수 x 8) byte를 사용합니다. 가득 차면 새 ID는 507, 재료가 너무 많으면 400을 반환합니다.
+max_inventories = int(os.environ.get('MAX_INVENTORIES', 64))
+max_inventory_ingredients = int(os.environ.get('MAX_INVENTORY_INGREDIENTS', 100))
 
 total_amount = 200 #ml
-eval_obj = Eval(json_data, flavor_data, category_data, total_amount)
+model = None
+micro_batcher = None
+eval_obj = None
+inventory_registry = None
+
+# /predict 결과 캐시 : seed와 feature 값이 같으면 결과를 재사용합니다.
+# 기본(PREDICT_CACHE_STEP=0)은 입력을 반올림하지 않으므로 캐시를 켜고 끄는 것과 관계없이 같은 입력에 같은 레시피를 반환합니다.
+# PREDICT_CACHE_STEP(예: 1.0)을 주면 feature를 그 단위로 반올림한 값으로 레시피를 생성하고 key를 만듭니다.
+# 적중률은 높아지지만 UI의 소수 입력(ABV 0.1 단위, astringent = bitter * 0.9 등)은 반올림된 값으로 레시피가 만들어집니다.
+# PREDICT_CACHE_SHARED에 sqlite 파일 경로를 주면 여러 worker가 캐시를 공유합니다. PREDICT_CACHE_SIZE=0이면 사용하지 않습니다.
+predict_cache = None
+if int(os.environ.get('PREDICT_CACHE_SIZE', 1024)) > 0:
+    shared_cache = None
+    if os.environ.get('PREDICT_CACHE_SHARED'):
+        shared_cache = SQLiteCache(os.environ['PREDICT_CACHE_SHARED'],
+                                   max_size=int(os.environ.get('PREDICT_CACHE_SHARED_SIZE', 10000)),
+                                   ttl=float(os.environ.get('PREDICT_CACHE_TTL', 3600)))
+    predict_cache = RecipeCache(step=float(os.environ.get('PREDICT_CACHE_STEP', 0)),
+                                max_size=int(os.environ.get('PREDICT_CACHE_SIZE', 1024)),
+                                ttl=float(os.environ.get('PREDICT_CACHE_TTL', 3600)),
+                                shared=shared_cache)
+
+# phase : starting -> loading -> warming_up -> ready (실패하면 failed)
+startup_state = {'phase': 'starting', 'ready': False, 'error': None, 'seconds': {}}
+
+@contextmanager
+def startup_phase(phase):
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    startup_state['seconds'][phase] = seconds
+    logger.info("startup phase", extra={'phase': phase, 'seconds': round(seconds, 3)})
+
+def start_engine():
+    try:
+        startup_state['phase'] = 'loading'
+        load_engine()
+        startup_state['phase'] = 'warming_up'
+        warm_up_engine()
+        attach_metrics()
+    except Exception as e:
+        logger.exception("[startup]error")
+        startup_state['phase'] = 'failed'
+        startup_state['error'] = f"{type(e).__name__}: {e}"
+        return
+    startup_state['seconds']['total'] = sum(startup_state['seconds'].values())
+    startup_state['phase'] = 'ready'
+    startup_state['ready'] = True
+    logger.info("startup complete", extra={'seconds': round(startup_state['seconds']['total'], 3)})
+
+def load_engine():
+    global json_data, flavor_data, ingredients_description, category_data, model, micro_batcher, eval_obj, inventory_registry
+    with startup_phase('load_data'):
+        with open('./train_data.json', 'r') as f:
+            json_data = json.load(f)
+
+        with open('./flavor.json', 'r') as f:
+            flavor_data = json.load(f)
+
+        with open('./ingredients_description.json', 'r') as f:
+            ingredients_description = json.load(f)
+
+        with open('./category.json', 'r') as f:
+            category_data = json.load(f)
+
+    with startup_phase('load_model'):
+        engine_model = load_predictor(model_runtime, 'best_model_earthy.h5')
+        if micro_batch_window_ms:
+            micro_batcher = MicroBatchPredictor(engine_model,
+                                                window_ms=float(micro_batch_window_ms),
+                                                max_batch_size=int(os.environ.get('MICRO_BATCH_SIZE', 32)))
+            engine_model = micro_batcher
+        if prefix_cache_size > 0:
+            engine_model = PrefixCachedPredictor(engine_model, max_size=prefix_cache_size)
+
+    with startup_phase('build_engine'):
+        # 재료 양 조정 방식 : heuristic(기존 100회 반복 조정, 기본) 또는 solver(제약 조건 최적화, QUANTITY_METHOD=solver)
+        eval_obj = Eval(json_data, flavor_data, category_data, total_amount,
+                        quantity_method=os.environ.get('QUANTITY_METHOD', 'heuristic'),
+                        stage_timer=engine_stage_timer if metrics is not None else no_stage_timer)
+        build_filter_tables()
+        inventory_registry = InventoryRegistry(eval_obj.ingredient_table, eval_obj.ingredient_mapping,
+                                               max_inventories=max_inventories, max_ingredients=max_inventory_ingredients)
+        inventory_registry.register(default_inventory_id, live_bar_ingredient_list, limited=False)
+
+    if isinstance(engine_model, PrefixCachedPredictor):
+        with startup_phase('prefix_warm_up'):
+            # 모든 seed 재료의 첫 step 확률을 미리 캐시합니다.
+            engine_model.warm_up(range(eval_obj.num_ingredients))
+    model = engine_model
+
+class SlotStreamingResponse(StreamingResponse):
+    '''
+    응답이 끝나면 executor 자리를 반납하는 StreamingResponse입니다.
+    client가 끊겨 body generator가 시작되지 않거나 background task가 실행되지 않아도 release가 호출됩니다.
+    '''
+    def __init__(self, content, slot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.release()
+
+class ExecutorSlot:
+    '''
+    InferenceExecutor에서 acquire한 자리 하나입니다. release()를 여러 번 호출해도 한 번만 반납하고,
+    executor thread에서 실행 중인 작업이 있으면 그 작업이 끝날 때까지 반납을 미룹니다.
+    '''
+    def __init__(self, executor):
+        self.executor = executor
+        self.pending = None
+        self.requested = False
+        self.released = False
+
+    def submit(self, function, *args):
+        self.pending = self.executor.executor.submit(function, *args)
+        self.executor.release_when_done(self.pending, self.settle)
+        return asyncio.wrap_future(self.pending)
+
+    def release(self):
+        self.requested = True
+        self.settle()
+
+    def settle(self):
+        if self.requested and not self.released and (self.pending is None or self.pending.done()):
+            self.released = True
+            self.executor.release()
+
+class InferenceExecutor:
+    '''
+    레시피 생성, 재료 필터링 같은 CPU 작업을 event loop 밖의 thread pool에서 실행합니다.
+    실행 중(workers)인 작업과 대기 중(queue_depth)인 작업이 가득 차면 기다리게 하지 않고 바로 503을 반환합니다.
+    '''
+    def __init__(self, workers=4, queue_depth=16):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self.workers = workers
+        self.limit = workers + queue_depth
+        # in_flight는 event loop에서만 변경하므로 lock이 필요 없습니다.
+        self.in_flight = 0
+        self.rejected = 0
+
+    def acquire(self):
+        if not startup_state['ready']:
+            raise HTTPException(status_code=503, detail="server is starting, retry later", headers={"Retry-After": "1"})
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="server is busy, retry later", headers={"Retry-After": "1"})
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+
+    def acquire_slot(self):
+        # acquire()한 자리를 여러 번 작업에 나누어 쓰는 ExecutorSlot을 반환합니다. (/predict/stream)
+        self.acquire()
+        return ExecutorSlot(self)
+
+    def release_when_done(self, future, release):
+        # 작업이 끝나거나 대기 중에 취소되면 event loop에서 release합니다.
+        # 기다리던 coroutine이 취소되어도(client 연결 끊김 등) thread의 작업은 계속 실행되므로 그때까지 자리를 유지합니다.
+        loop = asyncio.get_running_loop()
+        def done(_):
+            try:
+                loop.call_soon_threadsafe(release)
+            except RuntimeError:
+                # event loop가 이미 닫혔으면(서버 종료) 반납할 필요가 없습니다.
+                pass
+        future.add_done_callback(done)
+
+    async def run(self, function, *args):
+        self.acquire()
+        try:
+            # 요청 ID 등 context 변수를 executor thread에서도 사용할 수 있도록 현재 context에서 실행합니다.
+            context = contextvars.copy_context()
+            future = self.executor.submit(context.run, function, *args)
+        except BaseException:
+            self.release()
+            raise
+        self.release_when_done(future, self.release)
+        return await asyncio.wrap_future(future)
+
+    async def iterate(self, iterator, slot):
+        # acquire_slot()한 뒤 넘겨받은 iterator의 각 원소를 executor thread에서 계산해 차례로 yield합니다. 끝나면 release합니다.
+        context = contextvars.copy_context()
+        try:
+            while True:
+                item = await slot.submit(context.run, next, iterator, None)
+                if item is None:
+                    break
+                yield item
+        finally:
+            slot.release()
+
+    def stats(self):
+        return {'workers': self.workers, 'limit': self.limit, 'in_flight': self.in_flight, 'rejected': self.rejected}
+
+# INFERENCE_WORKERS : 동시에 실행할 작업 수, INFERENCE_QUEUE_DEPTH : 실행을 기다릴 수 있는 작업 수
+inference_executor = InferenceExecutor(workers=int(os.environ.get('INFERENCE_WORKERS', 4)),
+                                       queue_depth=int(os.environ.get('INFERENCE_QUEUE_DEPTH', 16)))
 
 class Features(BaseModel):
     ABV: float
@@ -47,17 +272,34 @@ class Features(BaseModel):
     creamy: float
     smoky: float
     seed: str
+    # Live Demo 레시피에 사용할 소지 재료 목록(/inventories로 등록)의 ID, 없으면 기본 Live Demo 바
+    inventory: Optional[str] = None
 
 class Recipe(BaseModel):
     recipe: Dict[str, float]
     profile: Dict[str, float]
     live_recipe: Dict[str, float]
 
+class BatchRecipe(BaseModel):
+    recipe: Optional[Recipe] = None
+    error: Optional[str] = None
+
 class FilteredIngredients(BaseModel):
     ingredients: List[str]
     flavor: Dict[str, Dict[str, float]]
     description: Dict[str, Dict[str, str]]
 
+class InventoryRequest(BaseModel):
+    ingredients: List[str]
+
+class ClosestCocktailsRequest(BaseModel):
+    recipe: Dict[str, float]
+    k: int = 5
+
+class ClosestCocktail(BaseModel):
+    cocktail_name: str
+    similarity: float
+
 class FilterRequest(BaseModel):
     features: Features
     selected_ingredient: str
@@ -65,47 +307,86 @@ class FilterRequest(BaseModel):
 
 def normalize_string(name):
     return name.replace('\\"', '"').replace("\\'", "'")
+
+def features_to_profile(features):
+    return {'ABV': features.ABV,
+            'sweet' : features.sweet,
+            'sour' : features.sour,
+            'bitter' : features.bitter,
+            'spicy' : features.spicy,
+            'herbal' : features.herbal,
+            'floral' : features.floral,
+            'fruity' : features.fruity,
+            'nutty' : features.nutty,
+            'boozy' : features.boozy,
+            'astringent' : features.astringent,
+            'umami' : features.umami,
+            'salty' : features.salty,
+            'Perceived_temperature' : features.perceived_t,
+            'creamy' : features.creamy,
+            'smoky' : features.smoky,
+            }
+
+flavor_dic = {}
+description_dic = {}
+filter_table = None
+non_alcohol_mask = None
+alcohol_mask = None
+
+def build_filter_tables():
+    # /filter에서 사용하는 재료 정보는 서버 시작 시 한 번만 만듭니다.
+    global filter_table, non_alcohol_mask, alcohol_mask
+    # 각 ingredient name과 이름을 제외한 ingredient flavor 정보가 맵핑되도록 합니다.
+    for flavor in flavor_data:
+        element = {}
+        for feature, value in flavor.items():
+            if feature != "name" and feature != "ID":
+                element[feature] = value
+        flavor_dic[flavor['name']] = element
+
+    # 각 ingredient name과 ingredient의 카테고리 정보가 맵핑되도록 합니다.
+    for ingredient in ingredients_description:
+        element = {"description": ingredient['description']}
+        description_dic[ingredient['name'].lower()] = element
+
+    # 재료별 feature 행렬(flavor_data 순서)과 후보 조건 mask
+    filter_table = eval_obj.ingredient_table
+    # 알콜이 없는 경우 : Mixer 카테고리에 속하고 ABV가 0인 재료
+    non_alcohol_mask = (filter_table.abv == 0) & np.array(['Mixer' in category_data[name] for name in filter_table.names])
+    # 알콜이 있는 경우 : Alcohol 카테고리에 속하고 ABV가 0보다 큰 재료
+    alcohol_mask = (filter_table.abv > 0) & np.array(['Alcohol' in category_data[normalize_string(name)] for name in filter_table.names])
+
+def rank_filter_candidates(top_features, mask, k):
+    '''
+    top_features와의 L1 거리(lower is better)가 가장 작은 순서로 mask에 해당하는 재료 이름을 k개 반환합니다.
+    거리가 같으면 flavor_data 순서를 따릅니다. (전체 정렬 결과에서 앞부분만 뽑은 것과 같습니다.)
+    '''
+    filter_score = np.zeros(len(filter_table))
+    # 재료별로 feature 순서대로 더한 값과 같도록 feature 하나씩 더합니다.
+    for feature, value in top_features:
+        filter_score += np.abs(filter_table.matrix[:, filter_table.attribute_index[feature]] - value)
+
+    candidates = np.flatnonzero(mask)
+    if len(candidates) > k:
+        # k번째 거리와 같은 재료까지 모두 남겨야 동점일 때의 순서가 유지됩니다.
+        threshold = np.partition(filter_score[candidates], k - 1)[k - 1]
+        candidates = candidates[filter_score[candidates] <= threshold]
+    candidates = candidates[np.argsort(filter_score[candidates], kind='stable')][:k]
+    return [filter_table.names[index] for index in candidates]
+
 # 사용자의 profile을 입력으로, 가장 값이 높은 feature 3개를 뽑습니다.
 # 해당 feature들과 가장 유사한 값을 가지는 ingredient를 여러개 뽑아 list로 반환합니다.
 @app.post("/filter", response_model=FilteredIngredients)
 async def filter(request: FilterRequest):
+    return await inference_executor.run(filter_ingredients, request)
+
+def filter_ingredients(request):
     try:
         features = request.features
         selected_ingredient = request.selected_ingredient
         selected_index = request.selected_index
-        
-        # 각 ingredient name과 이름을 제외한 ingredient flavor 정보가 맵핑되도록 합니다.
-        flavor_dic = {}
-        for flavor in flavor_data:
-            element = {}
-            for feature, value in flavor.items():
-                if feature != "name" and feature != "ID":
-                    element[feature] = value
-            flavor_dic[flavor['name']] = element
-
-        # 각 ingredient name과 ingredient의 카테고리 정보가 맵핑되도록 합니다.
-        description_dic = {}
-        for ingredient in ingredients_description:
-            element = {"description": ingredient['description']}
-            description_dic[ingredient['name'].lower()] = element
-
-        user_profile = {'ABV': features.ABV,
-                          'sweet' : features.sweet,
-                          'sour' : features.sour,
-                          'bitter' : features.bitter,
-                          'spicy' : features.spicy,
-                          'herbal' : features.herbal,
-                          'floral' : features.floral,
-                          'fruity' : features.fruity,
-                          'nutty' : features.nutty,
-                          'boozy' : features.boozy,
-                          'astringent' : features.astringent,
-                          'umami' : features.umami,
-                          'salty' : features.salty,
-                          'Perceived_temperature' : features.perceived_t,
-                          'creamy' : features.creamy,
-                          'smoky' : features.smoky,
-                          }
+
+        user_profile = features_to_profile(features)
 
         # 알콜이 없는 음료를 요구한 경우, ABV 정보를 제외하고 정렬된 feature 값을 생성합니다.
         sorted_values = []
@@ -123,16 +404,6 @@ async def filter(request: FilterRequest):
             if ('ABV', user_profile['ABV']) not in top_5_features:
                 top_5_features.append(('ABV', user_profile['ABV']))
 
-        # 필터링 점수를 기준으로 정렬된 재료 목록을 생성합니다.
-        # lower is better
-        filter_score = {}
-        for ing_name, feature_list in flavor_dic.items():
-            filter_score[ing_name] = 0
-            for feature, value in top_5_features:
-                filter_score[ing_name] += abs(feature_list[feature] - value)
-
-        sorted_ingredient = sorted(filter_score.items(), key=lambda x: x[1])
-
         # top_10_ingredient 리스트를 10개의 None 값으로 초기화합니다.
         top_10_ingredient = [None] * 10
         added_ingredients = set()
@@ -150,24 +421,16 @@ async def filter(request: FilterRequest):
         count = 0
         # ABV가 0인 경우 (알콜이 없는 경우)
         if user_profile['ABV'] == 0:
-            for ing_name, score in sorted_ingredient:
-                # Mixer 카테고리에 속하고, ABV가 0인 경우에 추가합니다.
-                if flavor_dic[ing_name]['ABV'] == 0 and ('Mixer' in category_data[ing_name]):
-                    if ing_name in added_ingredients:
-                        continue
-                    while top_10_ingredient[count] is not None:
-                        count += 1
-                    top_10_ingredient[count] = ing_name
-                    added_ingredients.add(ing_name)
-                    count += 1
-                if count == 10:
-                    break
+            candidate_mask = non_alcohol_mask
         else:
             # ABV가 0이 아닌 경우 (알콜이 있는 경우)
             # ABV값이 0 이상이고, Alcohol 카테고리에 속하는 재료를 선정합니다.
-            seed = eval_obj.select_user_seed(user_profile)
+            candidate_mask = alcohol_mask
+            context = RecipeContext(rng=random.Random())
+            with eval_obj.stage_timer('seed_selection'):
+                seed = eval_obj.select_user_seed(user_profile, context)
             base_liq = ['vodka', 'tequila', 'rum']
-            base = random.choice(base_liq)
+            base = context.rng.choice(base_liq)
 
             for ingredient in [base, seed]:
                 if ingredient not in added_ingredients:
@@ -176,18 +439,21 @@ async def filter(request: FilterRequest):
                     top_10_ingredient[count] = ingredient
                     added_ingredients.add(ingredient)
                     count += 1
-                    
-            for ing_name, score in sorted_ingredient:
-                if flavor_dic[ing_name]['ABV'] > 0 and 'Alcohol' in category_data[normalize_string(ing_name)]:
-                    if ing_name in added_ingredients:
-                        continue
-                    while top_10_ingredient[count] is not None:
-                        count += 1
-                    top_10_ingredient[count] = ing_name
-                    added_ingredients.add(ing_name)
-                    count += 1
-                if count == 10:
-                    break
+
+        # 필터링 점수가 낮은 순서로 후보를 뽑습니다. 이미 추가된 재료를 건너뛰어도 10개를 채울 수 있을 만큼만 필요합니다.
+        for ing_name in rank_filter_candidates(top_5_features, candidate_mask, 10 + len(added_ingredients)):
+            if count == 10:
+                break
+            if ing_name in added_ingredients:
+                continue
+            # 사용자가 마지막 자리(selected_index 9)를 선택했다면 앞의 9자리를 채운 뒤 끝납니다.
+            while count < 10 and top_10_ingredient[count] is not None:
+                count += 1
+            if count == 10:
+                break
+            top_10_ingredient[count] = ing_name
+            added_ingredients.add(ing_name)
+            count += 1
 
         # None 값을 제거하고 최종 top 10 리스트를 생성합니다.
         top_10_ingredient = [ing for ing in top_10_ingredient if ing is not None]
@@ -211,69 +477,405 @@ async def filter(request: FilterRequest):
                 "description" : top_10_description}
 
     except Exception as e:
-        _, _ , tb = sys.exc_info()    # tb  ->  traceback object
-        print('file name = ', __file__)
-        print('error line No = {}'.format(tb.tb_lineno))
-
+        logger.exception("[filter]error")
         raise HTTPException(status_code=500, detail=str(e))
 
+# 기본 Live Demo 바에서 사용할 수 있는 재료 목록 (서버 시작 시 default_inventory_id로 등록합니다.)
+default_inventory_id = 'live_bar'
+live_bar_ingredient_list = ['peach schnapps','baileys irish cream','kahlua','triple sec','malibu rum','tequila',
+                            'whisky','jack daniels','malibu rum','midori melon liqueur','vodka','light rum',
+                            "cranberry juice","lime juice",'lemon juice',"orange juice","tonic water", "milk",'sugar syrup',
+                            'powdered sugar','salt','sugar','ice','cinnamon','black pepper','grenadine','carbonated water'
+                            ]
+
+recipe_length = 5
+# /predict/batch 한 번에 받을 수 있는 최대 항목 수
+predict_batch_max_size = int(os.environ.get('PREDICT_BATCH_MAX_SIZE', 1000))
+
+def lookup_inventory(inventory_id):
+    inventory = inventory_registry.get(inventory_id or default_inventory_id)
+    if inventory is None:
+        raise HTTPException(status_code=404, detail=f"inventory not found: {inventory_id}")
+    return inventory
+
+def make_recipe(input_features, seed_ingredient, inventory):
+    # 소지 재료 목록, 선호도 점수 등 요청 하나의 상태는 context에만 둡니다. (eval_obj는 모든 요청이 함께 사용합니다.)
+    context = make_request_context(seed_ingredient, inventory)
+    generated_recipes = eval_obj.generate_recipe(model,seed_ingredient, input_features, recipe_length, context)
+    observe_recipe_steps(generated_recipes[0])
+    return finish_recipe(input_features, seed_ingredient, generated_recipes, inventory, context)
+
+def make_request_context(seed_ingredient, inventory):
+    return RecipeContext(list(inventory.ingredients), seed_ingredient, random.Random())
+
+def finish_recipe(input_features, seed_ingredient, generated_recipes, inventory, context=None):
+    # 생성된 레시피로 응답(재료 양, 맛 프로파일, Live Demo 레시피)을 만듭니다.
+    logger.debug("generated recipe", extra={'recipe': generated_recipes[0]})
+    result_recipe = make_result_recipe(generated_recipes)
+    user_recipe_profile = eval_obj.get_taste_log(generated_recipes)
+    result_recipe_live = make_live_recipe(input_features, seed_ingredient, generated_recipes, inventory, context)
+    return {"recipe" : result_recipe,
+            "profile" : user_recipe_profile,
+            "live_recipe":result_recipe_live}
+
+def make_result_recipe(generated_recipes):
+    result_recipe = {}
+    for recipe, ingredients in zip(generated_recipes[0], generated_recipes[1]):
+        result_recipe[recipe]= ingredients * total_amount
+    return result_recipe
+
+def make_live_recipe(input_features, seed_ingredient, generated_recipes, inventory, context=None):
+    #Live Demo
+    try:
+        context = context or make_request_context(seed_ingredient, inventory)
+        with eval_obj.stage_timer('find_similar_ingredients'):
+            best_ingredient = eval_obj.find_inventory_substitutes(generated_recipes[0], inventory, input_features, context)
+        target_abv = input_features['ABV']
+        with eval_obj.stage_timer('live_quantities'):
+            quantities = eval_obj.adjust_ingredient_quantities(best_ingredient, target_abv, input_features,total_amount=100, context=context)
+        result_recipe_live = {}
+        for recipe, ingredients in zip(best_ingredient, quantities):
+            result_recipe_live[recipe]= ingredients * 100
+    except Exception as e:
+        logger.exception("[make_live_recipe]error")
+        result_recipe_live = {}
+    return result_recipe_live
+
+# 레시피 생성은 inference_executor의 thread에서 실행합니다. 동시에 들어온 요청의 예측은 micro-batching으로 함께 묶을 수 있습니다.
 @app.post("/predict", response_model=Recipe)
 async def predict(features: Features):
+    return await inference_executor.run(predict_recipe, features)
+
+def predict_recipe(features):
     # Extract input features
     # Predict using the model
     try:
-        input_features = {'ABV': features.ABV,
-                          'sweet' : features.sweet,
-                          'sour' : features.sour,
-                          'bitter' : features.bitter,
-                          'spicy' : features.spicy,
-                          'herbal' : features.herbal,
-                          'floral' : features.floral,
-                          'fruity' : features.fruity,
-                          'nutty' : features.nutty,
-                          'boozy' : features.boozy,
-                          'astringent' : features.astringent,
-                          'umami' : features.umami,
-                          'salty' : features.salty,
-                          'Perceived_temperature' : features.perceived_t,
-                          'creamy' : features.creamy,
-                          'smoky' : features.smoky,
-                          }
+        input_features = features_to_profile(features)
         seed_ingredient = features.seed
+        inventory = lookup_inventory(features.inventory)
+        if predict_cache is None:
+            return make_recipe(input_features, seed_ingredient, inventory)
+
+        # 반올림한 feature로 레시피를 만들어야 같은 key에 항상 같은 결과가 저장됩니다.
+        input_features = predict_cache.quantize(input_features)
+        cache_key = predict_cache.make_key(seed_ingredient, input_features, inventory.key)
+        result = predict_cache.get(cache_key)
+        if result is None:
+            result = make_recipe(input_features, seed_ingredient, inventory)
+            predict_cache.set(cache_key, result)
+        return result
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("[predict]error")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        print(f"eval init")
-        recipe_length = 5
-
-        generated_recipes = eval_obj.generate_recipe(model,seed_ingredient, input_features, recipe_length)
-        result_recipe = {}
-        print(f"generated_recipes: {generated_recipes}")
+# /predict와 같은 결과를 Server-Sent Events로 나누어 보냅니다.
+# 재료가 정해질 때마다 ingredient 이벤트를 보내고, 이어서 recipe(재료 양), profile, live_recipe, done 이벤트를 보냅니다.
+# 실패하면 error 이벤트를 보내고 끝납니다.
+@app.post("/predict/stream")
+async def predict_stream(features: Features):
+    slot = inference_executor.acquire_slot()
+    try:
+        inventory = lookup_inventory(features.inventory)
+    except HTTPException:
+        slot.release()
+        raise
+    return SlotStreamingResponse(inference_executor.iterate(stream_recipe(features, inventory), slot), slot, media_type="text/event-stream")
 
-        for recipe, ingredients in zip(generated_recipes[0], generated_recipes[1]):
-            result_recipe[recipe]= ingredients * total_amount
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        user_recipe_profile = eval_obj.get_taste_log(generated_recipes)
-        
-        
-        #Live Demo
+def stream_recipe(features, inventory):
+    try:
+        input_features = features_to_profile(features)
+        seed_ingredient = features.seed
+        result = None
+        if predict_cache is not None:
+            input_features = predict_cache.quantize(input_features)
+            cache_key = predict_cache.make_key(seed_ingredient, input_features, inventory.key)
+            result = predict_cache.get(cache_key)
+        if result is not None:
+            for ingredient in result['recipe']:
+                yield sse_event('ingredient', {'ingredient': ingredient})
+            for event in ['recipe', 'profile', 'live_recipe']:
+                yield sse_event(event, result[event])
+            yield sse_event('done', {})
+            return
+
+        context = make_request_context(seed_ingredient, inventory)
+        generated_recipe = []
+        for ingredient in eval_obj.generate_recipe_steps(model, seed_ingredient, input_features, recipe_length, context):
+            generated_recipe.append(ingredient)
+            yield sse_event('ingredient', {'ingredient': ingredient})
+        observe_recipe_steps(generated_recipe)
+        with eval_obj.stage_timer('quantities'):
+            quantities = eval_obj.adjust_ingredient_quantities(generated_recipe, input_features['ABV'], input_features, context=context)
+        generated_recipes = (generated_recipe, quantities)
+        result = {"recipe": make_result_recipe(generated_recipes)}
+        yield sse_event('recipe', result['recipe'])
+        result['profile'] = eval_obj.get_taste_log(generated_recipes)
+        yield sse_event('profile', result['profile'])
+        result['live_recipe'] = make_live_recipe(input_features, seed_ingredient, generated_recipes, inventory, context)
+        yield sse_event('live_recipe', result['live_recipe'])
+        if predict_cache is not None:
+            predict_cache.set(cache_key, result)
+        yield sse_event('done', {})
+    except Exception as e:
+        logger.exception("[predict_stream]error")
+        yield sse_event('error', {'detail': str(e)})
+
+# 여러 profile의 레시피를 한 번에 생성합니다. (프로모션, 메뉴 기획용 사전 계산)
+# 모든 항목을 함께 디코딩하고, 실패한 항목은 error에 이유를 담아 반환하며 나머지 항목은 그대로 반환합니다.
+@app.post("/predict/batch", response_model=List[BatchRecipe])
+async def predict_batch(features_list: List[Features]):
+    if len(features_list) > predict_batch_max_size:
+        raise HTTPException(status_code=413, detail=f"batch size {len(features_list)} exceeds {predict_batch_max_size}")
+    return await inference_executor.run(predict_recipes, features_list)
+
+def predict_recipes(features_list):
+    input_features_list = [features_to_profile(features) for features in features_list]
+    seed_ingredients = [features.seed for features in features_list]
+    results = [None] * len(features_list)
+    cache_keys = [None] * len(features_list)
+    # 소지 재료 목록을 찾지 못한 항목은 디코딩하지 않고 error로 반환합니다.
+    inventories = [inventory_registry.get(features.inventory or default_inventory_id) for features in features_list]
+    for i, (features, inventory) in enumerate(zip(features_list, inventories)):
+        if inventory is None:
+            results[i] = {"error": f"inventory not found: {features.inventory}"}
+    if predict_cache is not None:
+        # /predict와 같은 key를 사용하므로 캐시를 함께 씁니다.
+        input_features_list = [predict_cache.quantize(input_features) for input_features in input_features_list]
+        for i, (seed_ingredient, input_features) in enumerate(zip(seed_ingredients, input_features_list)):
+            if results[i] is None:
+                cache_keys[i] = predict_cache.make_key(seed_ingredient, input_features, inventories[i].key)
+                results[i] = predict_cache.get(cache_keys[i])
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    generated = eval_obj.generate_recipes(model, [seed_ingredients[i] for i in missing],
+                                          [input_features_list[i] for i in missing], recipe_length)
+    for i, generated_recipes in zip(missing, generated):
         try:
-            limited_ingredient_list= [  'peach schnapps','baileys irish cream','kahlua','triple sec','malibu rum','tequila',
-                                'whisky','jack daniels','malibu rum','midori melon liqueur','vodka','light rum',
-                                "cranberry juice","lime juice",'lemon juice',"orange juice","tonic water", "milk",'sugar syrup',
-                                'powdered sugar','salt','sugar','ice','cinnamon','black pepper','grenadine','carbonated water'
-                                ]
-            eval_obj.set_limited_ingredient(limited_ingredient_list)
-            best_ingredient = eval_obj.find_similar_ingredients(generated_recipes[0],limited_ingredient_list,input_features)
-            target_abv = input_features['ABV']
-            quantities = eval_obj.adjust_ingredient_quantities(best_ingredient, target_abv, input_features,total_amount=100)
-            result_recipe_live = {}
-            for recipe, ingredients in zip(best_ingredient, quantities):
-                result_recipe_live[recipe]= ingredients * 100
+            if isinstance(generated_recipes, Exception):
+                raise generated_recipes
+            observe_recipe_steps(generated_recipes[0])
+            results[i] = finish_recipe(input_features_list[i], seed_ingredients[i], generated_recipes, inventories[i])
+            if predict_cache is not None:
+                predict_cache.set(cache_keys[i], results[i])
         except Exception as e:
-            print(traceback.format_exc())
-            result_recipe_live = {}
-        return {"recipe" : result_recipe,
-                "profile" : user_recipe_profile,
-                "live_recipe":result_recipe_live}
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+            logger.warning(f"[predict_batch]item {i} failed : {type(e).__name__}: {e}")
+            results[i] = {"error": f"{type(e).__name__}: {e}"}
+    return [result if "error" in result else {"recipe": result} for result in results]
+
+# 레시피({재료: 양})와 재료 구성이 가장 비슷한(코사인 유사도) 기존 cocktail k개를 반환합니다.
+@app.post("/cocktails/closest", response_model=List[ClosestCocktail])
+async def closest_cocktails(request: ClosestCocktailsRequest):
+    if request.k < 1:
+        raise HTTPException(status_code=400, detail="k must be at least 1")
+    return await inference_executor.run(find_closest_cocktails, request)
+
+def find_closest_cocktails(request):
+    return eval_obj.closest_cocktails((list(request.recipe.keys()), list(request.recipe.values())), request.k)
+
+# 매장(바)별 소지 재료 목록을 등록합니다. /predict의 inventory에 ID를 주면 해당 목록으로 Live Demo 레시피를 만듭니다.
+# 등록할 때 재료 간 거리를 미리 계산하므로 등록은 executor에서 실행합니다. 같은 ID로 다시 등록하면 목록이 교체됩니다.
+# 목록은 프로세스 메모리에만 저장되므로 worker가 여러 개면 각 worker에 등록해야 합니다.
+@app.put("/inventories/{inventory_id}")
+async def put_inventory(inventory_id: str, request: InventoryRequest):
+    return await inference_executor.run(register_inventory, inventory_id, request.ingredients)
+
+def register_inventory(inventory_id, ingredients):
+    check_not_default_inventory(inventory_id)
+    try:
+        inventory = inventory_registry.register(inventory_id, ingredients)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except InventoryLimitError as e:
+        raise HTTPException(status_code=507, detail=str(e))
+    logger.info("inventory registered", extra={'inventory_id': inventory_id, 'version': inventory.version,
+                                                'ingredients': len(inventory.ingredients)})
+    return inventory.summary()
+
+# 기본 목록은 ID 없이 요청한 모든 /predict가 사용하므로 교체하거나 삭제할 수 없습니다.
+def check_not_default_inventory(inventory_id):
+    if inventory_id == default_inventory_id:
+        raise HTTPException(status_code=400, detail=f"{default_inventory_id} is the default inventory and cannot be replaced or deleted")
+
+def ready_registry():
+    if inventory_registry is None:
+        raise HTTPException(status_code=503, detail="server is starting, retry later", headers={"Retry-After": "1"})
+    return inventory_registry
+
+@app.get("/inventories")
+async def list_inventories():
+    return ready_registry().list()
+
+@app.get("/inventories/{inventory_id}")
+async def get_inventory(inventory_id: str):
+    ready_registry()
+    return lookup_inventory(inventory_id).summary()
+
+@app.delete("/inventories/{inventory_id}")
+async def delete_inventory(inventory_id: str):
+    check_not_default_inventory(inventory_id)
+    if ready_registry().remove(inventory_id) is None:
+        raise HTTPException(status_code=404, detail=f"inventory not found: {inventory_id}")
+    return {"deleted": inventory_id}
+
+# 각 feature 값이 ingredient와 가장 가까운 소지 재료
+@app.get("/inventories/{inventory_id}/substitutes")
+async def inventory_substitutes(inventory_id: str, ingredient: str):
+    ready_registry()
+    inventory = lookup_inventory(inventory_id)
+    if ingredient not in inventory.ingredient_table:
+        raise HTTPException(status_code=404, detail=f"unknown ingredient: {ingredient}")
+    return inventory.substitutes(ingredient)
+
+# 요청마다 ID를 정해(X-Request-ID 헤더가 있으면 그 값) 로그에 남기고 응답 헤더로 돌려줍니다.
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    request_id = request.headers.get('X-Request-ID') or new_request_id()
+    token = request_id_var.set(request_id)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+        response.headers['X-Request-ID'] = request_id
+        logger.debug("request", extra={'path': request.url.path, 'status': response.status_code,
+                                       'ms': round((time.perf_counter() - start) * 1000, 3)})
+        return response
+    finally:
+        request_id_var.reset(token)
+
+def collect_cache_stats():
+    stats = {}
+    if predict_cache is not None:
+        stats['predict'] = predict_cache.stats()
+    if isinstance(model, PrefixCachedPredictor):
+        stats['prefix'] = model.stats()
+    if micro_batcher is not None:
+        stats['micro_batch'] = micro_batcher.stats()
+    stats['executor'] = inference_executor.stats()
+    return stats
+
+@app.get("/cache_stats")
+async def cache_stats():
+    return collect_cache_stats()
+
+# METRICS=0이면 단계별 시간 측정과 /metrics를 모두 끕니다. (Eval의 stage_timer는 아무것도 하지 않는 기본값을 사용합니다.)
+metrics = None
+if os.environ.get('METRICS', '1') != '0':
+    metrics = ServerMetrics()
+
+    def cache_values(field):
+        # {'predict': {'local': {...}, 'shared': {...}}, 'prefix': {...}} -> {(cache,): value}
+        stats = collect_cache_stats()
+        values = {}
+        if 'predict' in stats:
+            for tier, tier_stats in stats['predict'].items():
+                values[(f'predict_{tier}',)] = tier_stats[field]
+        if 'prefix' in stats:
+            values[('prefix',)] = stats['prefix'][field]
+        return values
+
+    metrics.add_gauge('cache_hits_total', 'Cache hits.', lambda: cache_values('hits'), ['cache'], 'counter')
+    metrics.add_gauge('cache_misses_total', 'Cache misses.', lambda: cache_values('misses'), ['cache'], 'counter')
+    metrics.add_gauge('cache_entries', 'Cached entries.', lambda: cache_values('size'), ['cache'])
+    metrics.add_gauge('in_flight_requests', 'Requests running or queued on the inference executor.', lambda: inference_executor.in_flight)
+    metrics.add_gauge('rejected_requests_total', 'Requests rejected with 503 because the executor was full.', lambda: inference_executor.rejected, metric_type='counter')
+    metrics.add_gauge('ready', '1 after startup and warm-up have finished.', lambda: int(startup_state['ready']))
+    metrics.add_gauge('startup_phase_seconds', 'Time spent in each startup phase.',
+                      lambda: {(phase,): seconds for phase, seconds in startup_state['seconds'].items()}, ['phase'])
+
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # 등록된 경로만 label로 사용합니다. (없는 경로 요청으로 label이 계속 늘어나지 않도록)
+            route = request.scope.get('route')
+            endpoint = route.path if route is not None else 'unmatched'
+            metrics.request_seconds.observe(time.perf_counter() - start, endpoint)
+            metrics.requests_total.inc(endpoint, str(status))
+
+def engine_stage_timer(stage):
+    # 시작 과정이 끝난 뒤에만 기록해 warm-up 레시피가 단계별 시간에 섞이지 않도록 합니다.
+    if not startup_state['ready']:
+        return NO_TIMER
+    return metrics.stage_timer(stage)
+
+def attach_metrics():
+    if metrics is None:
+        return
+    if micro_batcher is not None:
+        metrics.add_gauge('micro_batch_rows_total', 'Rows run through the micro-batcher.', lambda: micro_batcher.rows, metric_type='counter')
+        metrics.add_gauge('micro_batches_total', 'Batched forward passes run by the micro-batcher.', lambda: micro_batcher.batches, metric_type='counter')
+
+def observe_recipe_steps(recipe):
+    # seed 이후에 모델로 고른 재료 수 = 레시피 하나를 만드는 데 실행한 step 수
+    if metrics is not None:
+        metrics.recipe_steps.observe(len(recipe) - 1)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="metrics are disabled (METRICS=0)")
+    return PlainTextResponse(metrics.expose(), media_type="text/plain; version=0.0.4")
+
+def make_warmup_profiles(count):
+    # 알콜/무알콜 profile을 번갈아 만듭니다. seed는 /filter의 후보 재료(알콜이면 Alcohol, 무알콜이면 Mixer 카테고리)에서 고릅니다.
+    rng = random.Random(0)
+    alcohol_names = [filter_table.names[index] for index in np.flatnonzero(alcohol_mask)]
+    non_alcohol_names = [filter_table.names[index] for index in np.flatnonzero(non_alcohol_mask)]
+    profiles = []
+    for i in range(count):
+        profile = {feature: rng.randint(0, 100) for feature in ['sweet', 'sour', 'bitter', 'spicy', 'herbal', 'floral', 'fruity', 'nutty',
+                                                               'boozy', 'astringent', 'umami', 'salty', 'perceived_t', 'creamy', 'smoky']}
+        if i % 2 == 0:
+            profile['ABV'] = rng.randint(5, 40)
+            profile['seed'] = rng.choice(alcohol_names)
+        else:
+            profile['ABV'] = 0
+            profile['seed'] = rng.choice(non_alcohol_names)
+        profiles.append(Features(**profile))
+    return profiles
+
+def warm_up_engine():
+    # /filter, /predict, /predict/batch와 같은 경로로 레시피를 생성해 모델(Keras graph tracing 등)과 캐시를 미리 준비합니다.
+    # 결과는 /predict 결과 캐시에 넣지 않습니다.
+    if warmup_profiles_path:
+        with open(warmup_profiles_path, 'r') as f:
+            profiles = [Features(**profile) for profile in json.load(f)]
+    else:
+        profiles = make_warmup_profiles(warmup_decodes)
+    if not profiles:
+        return
+    with startup_phase('warm_up'):
+        for features in profiles:
+            filter_ingredients(FilterRequest(features=features, selected_ingredient='', selected_index=-1))
+            input_features = features_to_profile(features)
+            generated_recipes = eval_obj.generate_recipe(model, features.seed, input_features, recipe_length)
+            finish_recipe(input_features, features.seed, generated_recipes, lookup_inventory(features.inventory))
+        for generated_recipes in eval_obj.generate_recipes(model, [features.seed for features in profiles],
+                                                           [features_to_profile(features) for features in profiles], recipe_length):
+            if isinstance(generated_recipes, Exception):
+                raise generated_recipes
+    logger.info("warm-up decodes", extra={'recipes': len(profiles)})
+
+# liveness : 프로세스가 요청을 처리할 수 있으면 200, 시작 과정이 실패했으면 500 (재시작이 필요합니다.)
+@app.get("/healthz")
+async def healthz():
+    if startup_state['phase'] == 'failed':
+        raise HTTPException(status_code=500, detail=startup_state['error'])
+    return {"status": "ok", "phase": startup_state['phase']}
+
+# readiness : warm-up까지 끝난 뒤에만 200을 반환합니다.
+@app.get("/readyz")
+async def readyz():
+    if not startup_state['ready']:
+        raise HTTPException(status_code=503, detail=startup_state['phase'], headers={"Retry-After": "1"})
+    return {"status": "ready", "startup_seconds": startup_state['seconds']}
@@ -0,0 +1,128 @@
+import json
+import time
+import random
+import argparse
+import urllib.request
+import urllib.error
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# 실행 중인 fastapi_srv에 동시 클라이언트 수(concurrency)별로 요청을 보내 처리량과 지연 시간(p50/p95/p99)을 측정합니다.
+# 각 클라이언트는 응답을 받으면 바로 다음 요청을 보냅니다. 503(과부하로 거절) 응답은 따로 집계합니다.
+#
+#     uvicorn fastapi_srv:app
+#     python load_test.py --endpoint predict --concurrency 1 8 32 128
+#
+# --compare에 다른 설정으로 실행한 서버 주소를 주면 두 서버에 같은 요청을 번갈아 보내고 차이를 출력합니다.
+# 예) 부하를 거절하지 않는 설정(대기열 제한을 사실상 없앰)과 기본 설정 비교
+#
+#     INFERENCE_QUEUE_DEPTH=100000 uvicorn fastapi_srv:app --port 8001
+#     uvicorn fastapi_srv:app --port 8000
+#     python load_test.py --compare http://127.0.0.1:8001 --url http://127.0.0.1:8000 --concurrency 8 32 128
+
+# 비교할 지표 (ok_per_s, ok만 클수록 좋습니다.)
+COMPARED_METRICS = ['ok_per_s', 'ok', 'rejected', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'all_p99_ms']
+
+FEATURES = ['ABV', 'sweet', 'sour', 'bitter', 'spicy', 'herbal', 'floral', 'fruity', 'nutty', 'boozy',
+            'astringent', 'umami', 'salty', 'perceived_t', 'creamy', 'smoky']
+
+def random_features(rng, ingredient_names):
+    features = {feature: rng.randint(0, 100) for feature in FEATURES}
+    features['ABV'] = rng.choice([0, rng.randint(1, 40)])
+    features['seed'] = rng.choice(ingredient_names)
+    return features
+
+def make_body(endpoint, rng, ingredient_names):
+    features = random_features(rng, ingredient_names)
+    if endpoint == 'filter':
+        return {'features': features, 'selected_ingredient': '', 'selected_index': -1}
+    return features
+
+def send(url, body, timeout):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, TimeoutError):
+        status = 0
+    return status, time.perf_counter() - start
+
+def run_load(url, endpoint, concurrency, num_requests, ingredient_names, timeout=30):
+    rng = random.Random(concurrency)
+    bodies = [make_body(endpoint, rng, ingredient_names) for _ in range(num_requests)]
+    with ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(lambda body: send(f"{url}/{endpoint}", body, timeout), bodies))
+        elapsed = time.perf_counter() - start
+
+    statuses = np.array([status for status, _ in results])
+    latencies = np.array([latency for _, latency in results])
+    ok = latencies[statuses == 200]
+    report = {
+        'concurrency': concurrency,
+        'requests': num_requests,
+        'ok_per_s': len(ok) / elapsed,
+        'ok': int(len(ok)),
+        'rejected': int(np.sum(statuses == 503)),
+        'errors': int(np.sum((statuses != 200) & (statuses != 503))),
+        'p50_ms': float(np.percentile(ok, 50) * 1000) if len(ok) else None,
+        'p95_ms': float(np.percentile(ok, 95) * 1000) if len(ok) else None,
+        'p99_ms': float(np.percentile(ok, 99) * 1000) if len(ok) else None,
+        # 거절된 요청이 얼마나 빨리 응답을 받았는지 확인합니다.
+        'all_p99_ms': float(np.percentile(latencies, 99) * 1000),
+    }
+    print(", ".join(f"{key} {value:.1f}" if isinstance(value, float) else f"{key} {value}" for key, value in report.items()))
+    return report
+
+def compare_reports(baseline, current):
+    '''
+    같은 concurrency의 두 결과에서 지표별 (baseline 값, 현재 값, 변화율)을 반환합니다. 값이 없거나 baseline이 0이면 변화율은 None입니다.
+    '''
+    delta = {'concurrency': current['concurrency']}
+    for metric in COMPARED_METRICS:
+        before, after = baseline[metric], current[metric]
+        change = (after - before) / before if before is not None and after is not None and before != 0 else None
+        delta[metric] = (before, after, change)
+    return delta
+
+def print_delta(delta, labels):
+    print(f"concurrency {delta['concurrency']} ({labels[0]} -> {labels[1]})")
+    for metric in COMPARED_METRICS:
+        before, after, change = delta[metric]
+        format_value = lambda value: "-" if value is None else f"{value:.1f}" if isinstance(value, float) else str(value)
+        print(f"    {metric:<12} {format_value(before):>10} -> {format_value(after):>10}" + ("" if change is None else f"  {change:+.1%}"))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--endpoint', choices=['predict', 'filter'], default='predict')
+    parser.add_argument('--concurrency', type=int, nargs='*', default=[1, 8, 32, 128])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None, help='비교할 서버 주소 (baseline). 같은 요청을 --url과 번갈아 보냅니다.')
+    parser.add_argument('--labels', nargs=2, default=['baseline', 'current'], help='--compare, --url 결과의 이름')
+    args = parser.parse_args()
+
+    with open('./flavor.json', 'r') as f:
+        ingredient_names = [flavor['name'] for flavor in json.load(f)]
+    if args.compare:
+        # concurrency마다 baseline, current 순서로 실행해 시간에 따른 기계 상태 변화가 한쪽에 몰리지 않게 합니다.
+        reports = {label: [] for label in args.labels}
+        deltas = []
+        for concurrency in args.concurrency:
+            for label, url in zip(args.labels, [args.compare, args.url]):
+                print(f"[{label}] ", end="")
+                reports[label].append(run_load(url, args.endpoint, concurrency, args.requests, ingredient_names))
+            deltas.append(compare_reports(reports[args.labels[0]][-1], reports[args.labels[1]][-1]))
+        for delta in deltas:
+            print_delta(delta, args.labels)
+        reports['delta'] = deltas
+    else:
+        reports = [run_load(args.url, args.endpoint, concurrency, args.requests, ingredient_names) for concurrency in args.concurrency]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
@@ -9,8 +9,21 @@ from PIL import Image
 import base64
 from pathlib import Path
 import json
+import os
 from streamlit_lottie import st_lottie
 from streamlit_star_rating import st_star_rating
+from AppLogging import get_logger, new_request_id, request_id_var
+
+logger = get_logger('ui')
+
+# 추천 결과를 /predict/stream으로 받아 재료가 정해지는 대로 화면에 보여줍니다. (STREAM_PREDICTION=0이면 /predict 응답을 한 번에 받습니다.)
+stream_prediction = os.environ.get('STREAM_PREDICTION', '1') != '0'
+
+def request_headers():
+    # 서버 로그에서 같은 요청을 찾을 수 있도록 요청 ID를 X-Request-ID 헤더로 보냅니다.
+    request_id = new_request_id()
+    request_id_var.set(request_id)
+    return {'X-Request-ID': request_id}
 
 def restart_btn():
     col1, col2, col3 = st.columns([50, 14, 50])
@@ -42,7 +55,7 @@ def filter_feature(feature_dic):
                 feature_dic[key] = float(100)
             elif feature_dic[key] < 0:
                 feature_dic[key] = float(0)
-    print("Filtered Feature: ", feature_dic)
+    logger.debug("Filtered Feature", extra={'features': feature_dic})
     return feature_dic
 
 
@@ -530,7 +543,7 @@ def handle_input_by_images(drinktype):
                 st.session_state.choice_state -= rose_value
             st.session_state.choice['rose'] = 0
 
-    print("choice_state: ", st.session_state.choice_state)
+    logger.debug("choice_state", extra={'choice_state': st.session_state.choice_state.tolist()})
 
     st.write('Your Profile!')
     fig1, ax1 = plt.subplots(subplot_kw={'projection': 'polar'})
@@ -551,7 +564,7 @@ def handle_input_by_images(drinktype):
     # Set My Taste 버튼을 누르면 다음 페이지로 넘어가며, update된 feature dictionary를 업데이트 합니다.
     if st.button("Set My Taste", type='primary', use_container_width=True):
         selection_list = st.session_state.choice
-        print("Choice: ", selection_list)
+        logger.debug("Choice", extra={'selection_list': selection_list})
         # Perceived_temperature, boozy, astringent는 제외하였습니다. 해당 feature들은 랜덤하거나, ABV, bitter 값에 따라 조절됩니다.
         feature_selection = ['sweet', 'sour', 'bitter', 'fruity', 'umami', 'smoky',
                              'herbal', 'floral', 'nutty', 'creamy', 'spicy', 'salty']
@@ -606,11 +619,11 @@ def handle_input_by_images(drinktype):
                 elif choice == "champagne":
                     value_selection += champagne_value
                 else:
-                    print("----!Invalid Choice!----")
+                    logger.warning("----!Invalid Choice!----")
 
         feature_dic = update_feature(feature_dic, feature_selection, value_selection)
         st.session_state.main_feature_values = feature_dic
-        print(feature_dic)
+        logger.debug("feature_dic", extra={'features': feature_dic})
         next_page()
 
     col1, col2, col3 = st.columns([3, 1, 3])
@@ -701,7 +714,8 @@ def handle_input_seed_ingredient(loading_animations):
             "features": st.session_state.main_feature_values,
             "selected_ingredient": st.session_state.selected_ingredient,
             "selected_index": st.session_state.selected_index
-        }
+        },
+        headers=request_headers()
     )
 
     if response.status_code == 200:
@@ -774,7 +788,7 @@ def handle_input_seed_ingredient(loading_animations):
         use_container_width=True,
         type='primary'
     ):
-        print("main_feature_values: ", st.session_state.main_feature_values)
+        logger.debug("main_feature_values", extra={'features': st.session_state.main_feature_values})
         main_features = st.session_state.main_feature_values
         if st.session_state.selected_ingredient == "":
             main_features['seed'] = random.choice(seed_ingredient_list['ingredients'])
@@ -815,14 +829,25 @@ def show_loading_page():
     )
 
     st_lottie(st.session_state.loading_animation, height=500, key=f"loading_animation_{random.randint(0, 1000)}")
-    # Simulate random latency between 0.5 and 2 seconds
-    time.sleep(random.uniform(0.5, 2))
 
     main_features = st.session_state.main_feature_values
-    print("!!!![st.session_state.main_feature_values]!!!!!!", main_features)
+    logger.debug("main_feature_values", extra={'features': main_features})
+
+    if stream_prediction:
+        predict = stream_recommendation(main_features)
+        if predict is not None:
+            st.session_state.prediction_result = predict
+            next_page()
+        else:
+            st.write("Failed to get a cocktail recommendation. Please try again later.")
+        restart_btn()
+        return
+
+    # Simulate random latency between 0.5 and 2 seconds
+    time.sleep(random.uniform(0.5, 2))
 
     # response -> (recipe: result_recipe, profile: user_recipe_profile)인 딕셔너리임
-    response = requests.post('http://127.0.0.1:8000/predict', json=main_features)
+    response = requests.post('http://127.0.0.1:8000/predict', json=main_features, headers=request_headers())
 
     if response.status_code == 200:
         predict = response.json()
@@ -835,6 +860,47 @@ def show_loading_page():
 
 
 
+def read_sse_events(response):
+    # Server-Sent Events 응답을 (event, data) 단위로 읽습니다.
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith('event: '):
+            event = line[len('event: '):]
+        elif line.startswith('data: '):
+            yield event, json.loads(line[len('data: '):])
+            event = None
+
+def stream_recommendation(main_features):
+    '''
+    /predict/stream 응답을 받는 대로 재료와 재료 양을 화면에 표시하고, 모두 받으면 /predict와 같은 형태의 결과를 반환합니다.
+    실패하면 None을 반환합니다.
+    '''
+    placeholder = st.empty()
+    ingredients = []
+    predict = {}
+    try:
+        response = requests.post('http://127.0.0.1:8000/predict/stream', json=main_features, stream=True, headers=request_headers())
+        if response.status_code != 200:
+            return None
+        for event, data in read_sse_events(response):
+            if event == 'ingredient':
+                ingredients.append(data['ingredient'])
+                placeholder.markdown("\n".join(f"- {ingredient}" for ingredient in ingredients))
+            elif event == 'recipe':
+                predict['recipe'] = data
+                placeholder.markdown("\n".join(f"- {ingredient}: {round(amount, 2)}ml" for ingredient, amount in data.items()))
+            elif event in ('profile', 'live_recipe'):
+                predict[event] = data
+            elif event == 'error':
+                logger.error(f"[stream_recommendation]error : {data['detail']}")
+                return None
+    except requests.exceptions.RequestException as e:
+        logger.error(f"[stream_recommendation]error : {e}")
+        return None
+    if set(predict) != {'recipe', 'profile', 'live_recipe'}:
+        return None
+    return predict
+
 def show_recommendation(prediction, cocktail_animations):
     st.markdown(
         """
@@ -892,7 +958,6 @@ def show_recommendation(prediction, cocktail_animations):
 
         with col2:
             st.markdown("<div class='centered-title'>Recommend Recipe:</div>", unsafe_allow_html=True)
-            print(prediction.keys())
             for ingredient, amount in prediction['live_recipe'].items():
                 st.write(f"- {ingredient}: {round(amount, 2)}ml")
             st.markdown("</div>", unsafe_allow_html=True)
@@ -0,0 +1,70 @@
+import os
+import json
+import random
+import pytest
+from CocktailEmbeddingMaker import Eval, RecipeContext
+from InventoryRegistry import InventoryRegistry, InventoryLimitError
+
+# InventoryRegistry의 등록 제한, 버전(key), find_inventory_substitutes와 find_similar_ingredients의 결과가 같은지 확인합니다.
+#
+#     python -m pytest test_inventory_registry.py
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope='module')
+def eval_obj():
+    data = []
+    for name in ['train_data.json', 'flavor.json', 'category.json']:
+        with open(os.path.join(DATA_DIR, name), 'r') as f:
+            data.append(json.load(f))
+    return Eval(*data)
+
+
+@pytest.fixture
+def registry(eval_obj):
+    return InventoryRegistry(eval_obj.ingredient_table, eval_obj.ingredient_mapping, max_inventories=2, max_ingredients=3)
+
+
+def test_register_rejects_new_id_when_full(registry):
+    registry.register('a', ['vodka'])
+    registry.register('b', ['kahlua'])
+    with pytest.raises(InventoryLimitError):
+        registry.register('c', ['tequila'])
+    # 이미 등록된 ID는 가득 차 있어도 교체할 수 있습니다.
+    assert registry.register('a', ['tequila']).ingredients == ('tequila',)
+    assert registry.remove('b') is not None
+    registry.register('c', ['tequila'])
+    assert sorted(inventory['inventory_id'] for inventory in registry.list()) == ['a', 'c']
+
+
+def test_register_rejects_too_many_ingredients(registry):
+    with pytest.raises(ValueError):
+        registry.register('a', ['vodka', 'kahlua', 'tequila', 'vodka'])
+    # 서버가 등록하는 기본 목록에는 제한을 적용하지 않습니다.
+    assert len(registry.register('a', ['vodka', 'kahlua', 'tequila', 'vodka'], limited=False).ingredients) == 4
+
+
+def test_reregister_bumps_version_and_key(registry):
+    first = registry.register('a', ['vodka', 'kahlua'])
+    second = registry.register('a', ['vodka', 'kahlua'])
+    assert second.version > first.version
+    assert second.key != first.key
+    assert registry.get('a') is second
+
+
+def test_inventory_substitutes_match_find_similar_ingredients(eval_obj):
+    rng = random.Random(0)
+    names = list(eval_obj.ingredient_table.names)
+    # 매핑된 재료가 있는 목록과 없는 목록, 중복이 있는 목록을 함께 확인합니다.
+    mapped = sorted(set(eval_obj.ingredient_mapping.values()) & set(names))
+    inventories = [rng.sample(names, 25), mapped[:10] + rng.sample(names, 10), ['vodka', 'kahlua', 'vodka']]
+    users = eval_obj.generate_random_user_list(20, seed=0, save=False)
+    registry = InventoryRegistry(eval_obj.ingredient_table, eval_obj.ingredient_mapping, max_ingredients=100)
+    for inventory_index, ingredients in enumerate(inventories):
+        inventory = registry.register(f'bar_{inventory_index}', ingredients)
+        for user_index, user in enumerate(users):
+            recipe = rng.sample(names, 6) + rng.sample(mapped, 2)
+            expected = eval_obj.find_similar_ingredients(recipe, ingredients, user, RecipeContext(ingredients, rng=random.Random(user_index)))
+            actual = eval_obj.find_inventory_substitutes(recipe, inventory, user, RecipeContext(ingredients, rng=random.Random(user_index)))
+            assert actual == expected, (inventory_index, user_index, recipe)
@@ -0,0 +1,284 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import urllib.parse
+import numpy as np
+
+# 실행 중인 fastapi_srv에 Streamlit UI와 같은 순서로 요청을 보내는 부하 테스트입니다.
+# 사용자(session) 한 명은 seed 재료 페이지가 다시 그려질 때마다 /filter를 보내고(재료를 고를 때마다 한 번 더),
+# Determine을 누르면 /predict/stream(또는 /predict)을 보냅니다.
+# 사용자는 응답 속도와 관계없이 초당 rate명씩(Poisson 도착) 들어오며(open loop), rate를 올려 가며
+# endpoint별 p99가 --p99_limit_ms를 넘기 전까지 동시에 처리할 수 있는 사용자 수를 찾습니다.
+#
+#     uvicorn fastapi_srv:app
+#     python ui_load_test.py --rates 0.5 1 2 4 8 --duration 30
+
+# handle_input_by_images와 같은 기본값과 이미지별 feature 변화량입니다. (page_handler는 streamlit이 필요해 import하지 않습니다.)
+FEATURE_LIST = ["ABV", "boozy", "sweet", "sour", "bitter", "umami", "salty", "astringent", "perceived_t", "spicy",
+                "herbal", "floral", "fruity", "nutty", "creamy", "smoky"]
+DEFAULT_VALUE = 50.0
+FEATURE_SELECTION = ['sweet', 'sour', 'bitter', 'fruity', 'umami', 'smoky', 'herbal', 'floral', 'nutty', 'creamy', 'spicy', 'salty']
+IMAGE_VALUES = {
+    'lemon': [5, 30, 20, 25, 10, -10, 10, 10, -5, 0, 5, 0],
+    'lime': [0, 30, 20, 25, 10, -15, 15, 15, -10, 0, 5, 0],
+    'grapefruit': [5, 20, 20, 25, 5, -10, 5, 5, -10, 0, 5, 0],
+    'honey': [25, -10, -10, -5, -5, -15, -5, -5, 0, 5, 0, 0],
+    'candy': [25, 5, -5, -15, -5, -10, -10, -10, 0, 0, 0, 0],
+    'bonfire': [0, 0, 0, -10, 0, 30, 0, 0, 5, -5, 0, 5],
+    'pepper': [0, 5, 15, 0, 10, -10, 5, 0, -10, -10, 20, 0],
+    'hot_pepper': [0, 5, 20, 0, 10, -10, 5, 0, -10, -10, 30, 0],
+    'milk': [0, 0, 0, 0, 10, -5, 0, 0, 0, 30, -10, -5],
+    'ice_cream': [25, -10, -10, -5, -10, -10, 0, 0, 0, 25, 0, 10],
+    'chocolate': [25, -5, -5, -5, -10, 0, 0, 0, 0, -10, 0, 0],
+    'mint': [0, 0, 0, 0, 0, -10, 25, 25, -10, 0, 10, 0],
+    'basil': [0, 0, 5, 0, 0, -5, 15, 15, -5, 0, 5, 0],
+    'coffee_beans': [0, 0, 10, 0, 0, 20, 10, 0, 5, 0, 0, 0],
+    'dark_chocolate': [0, 0, 20, 0, 0, 0, 5, 0, 0, 0, 0, 0],
+    'pretzel': [0, 0, 0, -5, 0, 10, -5, -5, 10, -5, 0, 15],
+    'salt': [0, 0, 0, 0, 5, 0, 0, 0, 0, 0, 5, 25],
+    'almond': [0, 0, 0, -10, -5, 10, -5, -5, 25, 0, 0, 0],
+    'pistachio': [0, 0, 5, 0, 0, 10, 0, 0, 15, 0, 5, 0],
+    'rose': [0, 0, 0, -5, 5, -10, 15, 20, -10, 0, 0, 0],
+    'lavender': [0, 0, 0, -5, 5, -10, 25, 15, -10, 0, 0, 0],
+    'cola': [20, 10, 5, -5, 10, -15, -10, -10, -10, 5, 15, 10],
+    'champagne': [0, 0, 0, 0, 5, -10, 0, 5, -10, -5, 0, 0],
+}
+ENDPOINTS = ['filter', 'predict']
+
+def make_main_features(rng):
+    '''
+    handle_input_by_images(음료 종류, ABV slider, 이미지 선택)와 handle_input_seed_ingredient(astringent, boozy, perceived_t, filter_feature)가
+    만드는 것과 같은 feature dictionary를 만듭니다.
+    '''
+    features = {feature: DEFAULT_VALUE for feature in FEATURE_LIST}
+    features['ABV'] = 0.0
+    if rng.random() < 0.5:
+        features['ABV'] = round(rng.uniform(0.0, 60.0), 1)
+    value_selection = np.zeros(len(FEATURE_SELECTION))
+    for image in rng.sample(list(IMAGE_VALUES), rng.randint(0, 5)):
+        value_selection += IMAGE_VALUES[image]
+    for feature, value in zip(FEATURE_SELECTION, value_selection):
+        features[feature] += value
+
+    features['astringent'] = features['bitter'] * 0.9
+    features['boozy'] = features['ABV'] * 0.9
+    features['perceived_t'] = rng.uniform(0.3, 0.5) * 100
+    features = {feature: float(min(max(value, 0), 100)) for feature, value in features.items()}
+    features['seed'] = ""
+    return features
+
+def decode_chunked(body):
+    # chunked 응답(/predict/stream, /metrics)은 chunk를 이어 붙입니다.
+    decoded = b''
+    while body:
+        size, _, rest = body.partition(b'\r\n')
+        size = int(size, 16)
+        if size == 0:
+            break
+        decoded += rest[:size]
+        body = rest[size + 2:]
+    return decoded
+
+async def exchange(host, port, request):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(request)
+        await writer.drain()
+        return await reader.read()
+    finally:
+        writer.close()
+
+async def send(url, method, path, body=None, timeout=30):
+    '''
+    asyncio stream으로 요청을 보내고 (status, 지연 시간, 응답 본문)을 반환합니다. 연결하지 못했거나 timeout이면 status는 0입니다.
+    응답마다 연결을 닫으므로(Connection: close) 본문은 연결이 끝날 때까지 읽습니다.
+    '''
+    parsed = urllib.parse.urlsplit(url)
+    data = b'' if body is None else json.dumps(body).encode()
+    request = (f"{method} {path} HTTP/1.1\r\nHost: {parsed.netloc}\r\nContent-Type: application/json\r\n"
+               f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n").encode() + data
+    start = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(exchange(parsed.hostname, parsed.port or 80, request), timeout)
+        head, _, payload = response.partition(b'\r\n\r\n')
+        status = int(head.split(b' ', 2)[1])
+        if b'transfer-encoding: chunked' in head.lower():
+            payload = decode_chunked(payload)
+    except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+        status, payload = 0, b''
+    return status, time.perf_counter() - start, payload
+
+async def get_metrics(url):
+    # /metrics가 없거나(METRICS=0) 응답하지 않으면 None을 반환합니다.
+    status, _, payload = await send(url, 'GET', '/metrics', timeout=10)
+    return payload.decode() if status == 200 else None
+
+class FlowStats:
+    def __init__(self):
+        # endpoint별 (status, 지연 시간) 목록
+        self.requests = {endpoint: [] for endpoint in ENDPOINTS}
+        self.sessions = []
+        self.active = 0
+        self.max_active = 0
+
+    def record(self, endpoint, status, latency):
+        self.requests[endpoint].append((status, latency))
+
+async def run_session(url, rng, stats, args):
+    '''
+    사용자 한 명의 흐름을 재현합니다. 중간 요청이 실패하면 UI처럼 그 사용자는 추천을 받지 못하고 끝납니다.
+    '''
+    stats.active += 1
+    stats.max_active = max(stats.max_active, stats.active)
+    start = time.perf_counter()
+    completed = False
+    try:
+        features = make_main_features(rng)
+        selected_ingredient, selected_index = "", -1
+        ingredients = []
+        # 첫 화면 + 재료를 고를 때마다 다시 그려지는 화면
+        for rerun in range(rng.randint(1, args.max_reruns)):
+            if rerun > 0:
+                await asyncio.sleep(rng.expovariate(1 / args.think_time))
+                selected_index = rng.randrange(len(ingredients))
+                selected_ingredient = ingredients[selected_index]
+            features['seed'] = selected_ingredient
+            body = {'features': features, 'selected_ingredient': selected_ingredient, 'selected_index': selected_index}
+            status, latency, payload = await send(url, 'POST', '/filter', body, args.timeout)
+            stats.record('filter', status, latency)
+            if status != 200:
+                return
+            ingredients = json.loads(payload)['ingredients']
+            if not ingredients:
+                return
+
+        await asyncio.sleep(rng.expovariate(1 / args.think_time))
+        features['seed'] = selected_ingredient or rng.choice(ingredients)
+        path = '/predict/stream' if args.stream else '/predict'
+        status, latency, payload = await send(url, 'POST', path, features, args.timeout)
+        # 스트리밍 응답은 200으로 시작한 뒤 error event로 실패를 알립니다.
+        if status == 200 and args.stream and b'event: error' in payload:
+            status = 500
+        stats.record('predict', status, latency)
+        completed = status == 200
+    finally:
+        stats.active -= 1
+        stats.sessions.append((time.perf_counter() - start, completed))
+
+def parse_metrics(text):
+    # Prometheus text format에서 누적 값(_total, _sum, _count)만 읽습니다.
+    samples = {}
+    for line in (text or '').splitlines():
+        if line.startswith('#') or not line.strip():
+            continue
+        name, _, value = line.rpartition(' ')
+        if name.split('{')[0].endswith(('_total', '_sum', '_count')):
+            samples[name] = float(value)
+    return samples
+
+def latency_report(results):
+    statuses = np.array([status for status, _ in results])
+    latencies = np.array([latency for _, latency in results]) * 1000
+    ok = latencies[statuses == 200]
+    return {
+        'requests': len(results),
+        'ok': int(len(ok)),
+        'rejected': int(np.sum(statuses == 503)),
+        'errors': int(np.sum((statuses != 200) & (statuses != 503))),
+        'error_rate': float(np.mean(statuses != 200)) if len(results) else 0.0,
+        'p50_ms': float(np.percentile(ok, 50)) if len(ok) else None,
+        'p95_ms': float(np.percentile(ok, 95)) if len(ok) else None,
+        'p99_ms': float(np.percentile(ok, 99)) if len(ok) else None,
+        # 거절/실패한 요청까지 포함한 p99 (p99_limit_ms 비교에 사용합니다.)
+        'all_p99_ms': float(np.percentile(latencies, 99)) if len(results) else None,
+    }
+
+async def run_rate(url, rate, args):
+    '''
+    duration초 동안 초당 rate명의 사용자를 Poisson 간격으로 시작시키고, 모든 사용자가 끝나면 결과를 반환합니다.
+    '''
+    rng = random.Random(f"{args.seed}-{rate}")
+    stats = FlowStats()
+    metrics_before = parse_metrics(await get_metrics(url))
+
+    start = time.perf_counter()
+    sessions = []
+    arrival = rng.expovariate(rate)
+    while arrival < args.duration:
+        await asyncio.sleep(max(0, start + arrival - time.perf_counter()))
+        sessions.append(asyncio.create_task(run_session(url, random.Random(rng.random()), stats, args)))
+        arrival += rng.expovariate(rate)
+    await asyncio.gather(*sessions)
+    elapsed = time.perf_counter() - start
+
+    metrics_after = await get_metrics(url)
+    session_seconds = [seconds for seconds, _ in stats.sessions]
+    report = {
+        'rate': rate,
+        'sessions': len(stats.sessions),
+        'completed': sum(completed for _, completed in stats.sessions),
+        'sessions_per_s': sum(completed for _, completed in stats.sessions) / elapsed,
+        # Little's law: 평균 동시 사용자 수 = 사용자별 머문 시간의 합 / 측정 시간
+        'concurrent_users': sum(session_seconds) / elapsed,
+        'max_concurrent_users': stats.max_active,
+        'session_p50_s': float(np.percentile(session_seconds, 50)) if session_seconds else None,
+        'endpoints': {endpoint: latency_report(results) for endpoint, results in stats.requests.items()},
+    }
+    if metrics_after is not None:
+        metrics_after = parse_metrics(metrics_after)
+        report['server_metrics'] = {name: value - metrics_before.get(name, 0) for name, value in metrics_after.items()
+                                    if value != metrics_before.get(name, 0)}
+
+    print(f"rate {rate}/s : {report['completed']}/{report['sessions']} sessions, {report['sessions_per_s']:.2f} sessions/s, "
+          f"concurrent users {report['concurrent_users']:.1f} (max {report['max_concurrent_users']})")
+    for endpoint, endpoint_report in report['endpoints'].items():
+        print(f"    {endpoint:<8} " + ", ".join(f"{key} {value:.1f}" if isinstance(value, float) else f"{key} {value}"
+                                               for key, value in endpoint_report.items()))
+    return report
+
+def within_limit(report, p99_limit_ms, max_error_rate):
+    for endpoint_report in report['endpoints'].values():
+        if endpoint_report['requests'] == 0:
+            continue
+        if endpoint_report['all_p99_ms'] > p99_limit_ms or endpoint_report['error_rate'] > max_error_rate:
+            return False
+    return True
+
+async def main(args):
+    reports = []
+    capacity = None
+    for rate in sorted(args.rates):
+        report = await run_rate(args.url, rate, args)
+        reports.append(report)
+        if not within_limit(report, args.p99_limit_ms, args.max_error_rate):
+            print(f"rate {rate}/s exceeds p99 {args.p99_limit_ms:.0f}ms or error rate {args.max_error_rate:.0%}")
+            break
+        capacity = report
+    if capacity is None:
+        print("no rate stayed within the limit")
+    else:
+        print(f"capacity : {capacity['rate']} sessions/s arriving, {capacity['concurrent_users']:.1f} concurrent users "
+              f"(max {capacity['max_concurrent_users']}) within p99 {args.p99_limit_ms:.0f}ms")
+    return {'reports': reports, 'capacity': capacity and {key: capacity[key] for key in ['rate', 'concurrent_users', 'max_concurrent_users']}}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--rates', type=float, nargs='*', default=[0.5, 1, 2, 4, 8], help='초당 새로 들어오는 사용자 수 (작은 값부터 실행합니다.)')
+    parser.add_argument('--duration', type=float, default=30, help='rate별로 사용자를 들여보내는 시간(초)')
+    parser.add_argument('--think_time', type=float, default=2.0, help='화면 사이에서 사용자가 머무는 평균 시간(초, 지수 분포)')
+    parser.add_argument('--max_reruns', type=int, default=4, help='사용자 한 명이 보내는 최대 /filter 요청 수')
+    parser.add_argument('--no_stream', dest='stream', action='store_false', help='/predict/stream 대신 /predict를 사용합니다. (STREAM_PREDICTION=0)')
+    parser.add_argument('--p99_limit_ms', type=float, default=1000)
+    parser.add_argument('--max_error_rate', type=float, default=0.01)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)